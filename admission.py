@@ -0,0 +1,433 @@
+# admission.py - 上游调用的准入控制：按观测延迟自适应调整并发上限，超出上限的请求在有界队列中等待，
+# 无法在截止时间前开始的请求提前拒绝（429/503 + Retry-After），避免线程全部阻塞在上游直至 gunicorn 超时
+# 每个请求带有预计耗时 cost（见 latency_model），用于延迟样本归一化、排队等待估计和短作业优先
+import collections
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from utils.metrics import ADMISSION_LIMIT, ADMISSION_QUEUE_SECONDS, ADMISSION_REJECTED
+
+logger = logging.getLogger('Admission')
+
+# 请求类别：交互式单次合成、长文本分段、批量任务条目；排队时按此顺序优先
+INTERACTIVE = 'interactive'
+SEGMENT = 'segment'
+BATCH = 'batch'
+PRIORITIES = (INTERACTIVE, SEGMENT, BATCH)
+_RANK = {priority: rank for rank, priority in enumerate(PRIORITIES)}
+
+
+def tenant_id(api_key):
+    """租户标识：只使用 API 密钥的摘要"""
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+
+
+def parse_weights(spec):
+    """解析 "key1:4,key2:1" 形式的租户权重，返回 {tenant_id: weight}"""
+    weights = {}
+    for item in (spec or '').split(','):
+        key, sep, weight = item.strip().rpartition(':')
+        if not sep or not key:
+            continue
+        try:
+            weights[tenant_id(key)] = max(0.01, float(weight))
+        except ValueError:
+            logger.warning(f"忽略无效的租户权重配置: {item}")
+    return weights
+
+
+class Overloaded(Exception):
+    """准入被拒绝：queue_full（队列已满，429）或 deadline（无法在截止时间前开始，503）"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"服务繁忙（{reason}），请 {math.ceil(retry_after)} 秒后重试")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def status(self):
+        return 429 if self.reason == 'queue_full' else 503
+
+
+class VegasLimit:
+    """
+    Vegas 式并发上限：以空载延迟为基准估计上游排队数 queue = limit * (1 - 基准延迟 / 当前延迟)，
+    排队少于 3·log10(limit) 时增大上限，多于 6·log10(limit) 时减小；上游明确过载（超时、429/503）时乘性减小（AIMD）
+    样本为实际耗时 / 预计耗时（无预测时 cost 为 1，即原始耗时），文本长短不同的请求可以相互比较；
+    样本先做短窗口 EWMA 平滑，基准取平滑值在近期的最小值
+    """
+
+    def __init__(self, initial=8, min_limit=1, max_limit=64, smoothing=100, probe_interval=1000, backoff=0.9):
+        """
+        :param smoothing: 延迟 EWMA 的样本窗口
+        :param probe_interval: 每隔该数量的样本重置一次基准，适应上游空载延迟的变化
+        :param backoff: 上游过载时的乘性减小系数
+        """
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.probe_interval = probe_interval
+        self._alpha = 2.0 / (smoothing + 1)
+        self.rtt = None
+        self.base_rtt = None
+        self._samples = 0
+
+    def _clamp(self, value):
+        return min(self.max_limit, max(self.min_limit, value))
+
+    def on_sample(self, rtt, in_flight):
+        self.rtt = rtt if self.rtt is None else self.rtt + self._alpha * (rtt - self.rtt)
+        self._samples += 1
+        if self.base_rtt is None or self.rtt < self.base_rtt or self._samples >= self.probe_interval:
+            self.base_rtt = self.rtt
+            self._samples = 0
+        step = max(1.0, math.log10(self.limit))
+        queue = self.limit * (1 - self.base_rtt / self.rtt)
+        if queue > 6 * step:
+            self.limit = self._clamp(self.limit - step / self.limit)
+        elif queue < 3 * step and in_flight >= self.limit / 2:
+            # 远未用满上限时延迟信息不代表容量，不提高上限
+            self.limit = self._clamp(self.limit + step / self.limit)
+
+    def on_drop(self):
+        self.limit = self._clamp(self.limit * self.backoff)
+
+    @property
+    def slowdown(self):
+        """当前单位 cost 的平均耗时"""
+        return self.rtt
+
+
+class FifoQueue:
+    """等待队列：按到达顺序出队"""
+
+    def __init__(self):
+        self._items = collections.deque()
+        self.cost = 0.0
+
+    def push(self, waiter):
+        self._items.append(waiter)
+        self.cost += waiter.cost
+
+    def pop(self, eligible=None):
+        for waiter in self._items:
+            if eligible is None or eligible(waiter):
+                self.remove(waiter)
+                return waiter
+        return None
+
+    def worst(self):
+        return None
+
+    def remove(self, waiter):
+        self._items.remove(waiter)
+        self.cost -= waiter.cost
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FairQueue:
+    """
+    按类别分级、类别内按租户加权公平排队（start-time fair queueing）：
+    每个租户的请求依次获得虚拟完成时间 finish = max(虚拟时钟, 该租户上一个 finish) + cost / weight，
+    出队时选 finish 最小者，单个租户积压再多也只占其权重对应的份额；
+    高类别优先，等待每超过 aging 秒提升一级，低类别不会饿死；
+    shortest_first 时类别内改为预计耗时最短者优先（平均延迟更低），等待超过 aging 的请求按到达顺序优先
+    """
+
+    def __init__(self, weights=None, aging=5.0, shortest_first=False):
+        """
+        :param weights: {tenant_id: weight}，未配置的租户权重为 1
+        :param aging: 类别提升间隔（秒）
+        :param shortest_first: 类别内按预计耗时排序（shortest-expected-job-first）
+        """
+        self.weights = weights or {}
+        self.aging = aging
+        self.shortest_first = shortest_first
+        self._items = []
+        self.cost = 0.0
+        self._clock = {}
+        self._last_finish = {}
+
+    def _tag(self, waiter):
+        key = (waiter.priority, waiter.tenant)
+        start = max(self._clock.get(waiter.priority, 0.0), self._last_finish.get(key, 0.0))
+        waiter.start = start
+        waiter.finish = start + waiter.cost / self.weights.get(waiter.tenant, 1.0)
+        self._last_finish[key] = waiter.finish
+
+    def _order(self, waiter, now):
+        rank = _RANK.get(waiter.priority, len(PRIORITIES))
+        waited = now - waiter.enqueued_at
+        if self.aging > 0:
+            rank -= int(waited / self.aging)
+        if self.shortest_first:
+            if self.aging > 0 and waited >= self.aging:
+                # 已等待超过 aging 的请求不再按长短排序，按到达顺序优先，长请求不会饿死
+                return max(0, rank), 0, waiter.enqueued_at
+            return max(0, rank), 1, waiter.cost
+        return max(0, rank), waiter.finish
+
+    def push(self, waiter):
+        self._tag(waiter)
+        self._items.append(waiter)
+        self.cost += waiter.cost
+        if len(self._last_finish) > 10000:
+            # 租户的完成时间落后于虚拟时钟后不再影响排队，定期清理
+            self._last_finish = {
+                key: finish for key, finish in self._last_finish.items()
+                if finish > self._clock.get(key[0], 0.0)
+            }
+
+    def pop(self, eligible=None):
+        now = time.monotonic()
+        candidates = [waiter for waiter in self._items if eligible is None or eligible(waiter)]
+        if not candidates:
+            return None
+        waiter = min(candidates, key=lambda item: self._order(item, now))
+        self.remove(waiter)
+        self._clock[waiter.priority] = max(self._clock.get(waiter.priority, 0.0), waiter.start)
+        return waiter
+
+    def worst(self):
+        """排在最后的等待者，队列已满时可被更优先的请求挤出"""
+        if not self._items:
+            return None
+        now = time.monotonic()
+        return max(self._items, key=lambda item: self._order(item, now))
+
+    def outranks(self, waiter, other):
+        now = time.monotonic()
+        return self._order(waiter, now) < self._order(other, now)
+
+    def remove(self, waiter):
+        self._items.remove(waiter)
+        self.cost -= waiter.cost
+
+    def __len__(self):
+        return len(self._items)
+
+
+class _Waiter:
+    __slots__ = ('event', 'granted', 'rejected', 'enqueued_at', 'tenant', 'priority', 'cost', 'start', 'finish')
+
+    def __init__(self, tenant=None, priority=INTERACTIVE, cost=1.0):
+        self.event = threading.Event()
+        self.granted = False
+        self.rejected = False
+        self.enqueued_at = time.monotonic()
+        self.tenant = tenant
+        self.priority = priority
+        self.cost = cost
+        self.start = self.finish = 0.0
+
+
+class Permit:
+    def __init__(self, controller, priority=INTERACTIVE, cost=1.0):
+        self._controller = controller
+        self.priority = priority
+        self.cost = cost
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self, dropped=False, sample=True):
+        """
+        :param dropped: 上游过载（超时、429/503），收缩并发上限
+        :param sample: 是否把本次耗时作为延迟样本
+        """
+        if not self._released:
+            self._released = True
+            self._controller._release(self, time.monotonic() - self.started, dropped, sample)
+
+
+class AdmissionController:
+    def __init__(self, limit=None, max_queue=64, queue_timeout=10.0, enabled=True, queue=None, batch_share=0.75):
+        """
+        :param limit: 并发上限算法（默认 VegasLimit）
+        :param max_queue: 等待队列长度上限，队列满时直接拒绝（429）
+        :param queue_timeout: 在队列中等待的最长时间（秒），预计等待超过该值时提前拒绝（503）
+        :param queue: 等待队列（默认 FifoQueue）
+        :param batch_share: 批量任务最多占用并发上限的比例，为交互式请求保留名额
+        """
+        self.limit = limit or VegasLimit()
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.enabled = enabled
+        self.queue = queue if queue is not None else FifoQueue()
+        self.batch_share = batch_share
+        self.in_flight = 0
+        self.in_flight_cost = 0.0
+        self.in_flight_by_priority = collections.Counter()
+        self.admitted = 0
+        self.rejected = collections.Counter()
+        self._lock = threading.Lock()
+        ADMISSION_LIMIT.set(self.limit.limit)
+
+    @classmethod
+    def from_env(cls):
+        scheduler = os.getenv('ADMISSION_SCHEDULER', 'fair').lower()
+        return cls(
+            limit=VegasLimit(
+                initial=int(os.getenv('ADMISSION_INITIAL_LIMIT', 8)),
+                min_limit=int(os.getenv('ADMISSION_MIN_LIMIT', 1)),
+                max_limit=int(os.getenv('ADMISSION_MAX_LIMIT', 64)),
+            ),
+            max_queue=int(os.getenv('ADMISSION_MAX_QUEUE', 64)),
+            queue_timeout=float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10)),
+            enabled=os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true',
+            queue=FairQueue(
+                weights=parse_weights(os.getenv('TENANT_WEIGHTS')),
+                aging=float(os.getenv('ADMISSION_AGING', 5)),
+                shortest_first=scheduler == 'sjf',
+            ) if scheduler in ('fair', 'sjf') else FifoQueue(),
+            batch_share=float(os.getenv('ADMISSION_BATCH_SHARE', 0.75)),
+        )
+
+    def estimated_wait(self):
+        """
+        新请求预计的排队时长（秒）：排队请求的预计耗时之和加上在途请求平均剩余一半，
+        按当前单位耗时换算后由 limit 个名额并行消化
+        """
+        work = self.queue.cost + self.in_flight_cost / 2
+        return work * (self.limit.slowdown or 1.0) / max(1.0, self.limit.limit)
+
+    def _reject(self, reason, retry_after):
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.labels(reason).inc()
+        return Overloaded(reason, max(1.0, retry_after))
+
+    def batch_capacity(self):
+        """批量任务当前可同时占用的名额数（未启用准入控制时不限）"""
+        if not self.enabled:
+            return float('inf')
+        return max(1.0, self.limit.limit * self.batch_share)
+
+    def _eligible(self, waiter):
+        if self.in_flight >= self.limit.limit:
+            return False
+        if waiter.priority == BATCH:
+            return self.in_flight_by_priority[BATCH] < self.batch_capacity()
+        return True
+
+    def _dispatch(self):
+        """按队列顺序把空闲名额分给等待者（名额直接转交，不会被新到的请求抢占）"""
+        while self.in_flight < self.limit.limit:
+            waiter = self.queue.pop(self._eligible)
+            if waiter is None:
+                break
+            waiter.granted = True
+            self.in_flight += 1
+            self.in_flight_cost += waiter.cost
+            self.in_flight_by_priority[waiter.priority] += 1
+            self.admitted += 1
+            ADMISSION_QUEUE_SECONDS.labels(waiter.priority).observe(time.monotonic() - waiter.enqueued_at)
+            waiter.event.set()
+
+    def acquire(self, timeout=None, tenant=None, priority=INTERACTIVE, cost=1.0):
+        """
+        获取一个上游调用名额，调用方必须在结束后 release()
+        :param timeout: 本次请求在队列中最多等待的秒数，默认 queue_timeout
+        :param tenant: 租户标识（见 tenant_id），同类别内按租户公平排队
+        :param priority: 请求类别（INTERACTIVE/SEGMENT/BATCH）
+        :param cost: 预计耗时（秒，见 latency_model），不提供时按 1 个单位计
+        :raises Overloaded: 队列已满或无法在截止时间前开始
+        """
+        if not self.enabled:
+            return Permit(_NoopController, priority, cost)
+        timeout = self.queue_timeout if timeout is None else timeout
+        waiter = _Waiter(tenant, priority, cost)
+        with self._lock:
+            expected = self.estimated_wait()
+            if len(self.queue) >= self.max_queue:
+                worst = self.queue.worst()
+                if worst is None or not self.queue.outranks(waiter, worst):
+                    raise self._reject('queue_full', expected)
+                # 队列已满时挤出排在最后的低优先级请求
+                self.queue.remove(worst)
+                worst.rejected = True
+                worst.event.set()
+            self.queue.push(waiter)
+            self._dispatch()
+            if waiter.granted:
+                return Permit(self, priority, cost)
+            if expected > timeout:
+                # 按当前吞吐量排不到：立即拒绝，而不是占着线程等到超时
+                self.queue.remove(waiter)
+                raise self._reject('deadline', expected)
+        waiter.event.wait(timeout)
+        with self._lock:
+            if waiter.granted:
+                return Permit(self, priority, cost)
+            if waiter.rejected:
+                raise self._reject('queue_full', self.estimated_wait())
+            self.queue.remove(waiter)
+            raise self._reject('deadline', self.estimated_wait())
+
+    def try_acquire(self, tenant=None, priority=INTERACTIVE, cost=1.0):
+        """非阻塞获取名额（用于对冲请求）：有请求在排队或没有空闲名额时返回 None，不排队也不计入拒绝"""
+        if not self.enabled:
+            return Permit(_NoopController, priority, cost)
+        with self._lock:
+            waiter = _Waiter(tenant, priority, cost)
+            if len(self.queue) or not self._eligible(waiter):
+                return None
+            self.in_flight += 1
+            self.in_flight_cost += cost
+            self.in_flight_by_priority[priority] += 1
+            self.admitted += 1
+            return Permit(self, priority, cost)
+
+    def _release(self, permit, elapsed, dropped, sample):
+        with self._lock:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            self.in_flight_cost -= permit.cost
+            self.in_flight_by_priority[permit.priority] -= 1
+            if dropped:
+                self.limit.on_drop()
+            elif sample:
+                self.limit.on_sample(elapsed / permit.cost, in_flight)
+            ADMISSION_LIMIT.set(self.limit.limit)
+            self._dispatch()
+
+    def call(self, fn, dropped=None, timeout=None, tenant=None, priority=INTERACTIVE, cost=1.0):
+        """
+        在准入名额内执行 fn()
+        :param dropped: 判断异常是否表示上游过载的函数
+        """
+        permit = self.acquire(timeout, tenant=tenant, priority=priority, cost=cost)
+        try:
+            result = fn()
+        except BaseException as e:
+            permit.release(dropped=bool(dropped and dropped(e)), sample=False)
+            raise
+        permit.release()
+        return result
+
+    def stats(self):
+        with self._lock:
+            slowdown = self.limit.slowdown
+            return {
+                "enabled": self.enabled,
+                "scheduler": type(self.queue).__name__,
+                "limit": round(self.limit.limit, 2),
+                "in_flight": self.in_flight,
+                "in_flight_by_priority": {priority: self.in_flight_by_priority[priority] for priority in PRIORITIES},
+                "queued": len(self.queue),
+                "queued_work_seconds": round(self.queue.cost, 2),
+                "slowdown": round(slowdown, 3) if slowdown is not None else None,
+                "estimated_wait_seconds": round(self.estimated_wait(), 2),
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+            }
+
+
+class _NoopController:
+    @staticmethod
+    def _release(permit, elapsed, dropped, sample):
+        pass
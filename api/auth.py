@@ -1,8 +1,9 @@
 # api/auth.py - API认证模块
 from flask_httpauth import HTTPTokenAuth
 import os
-from dotenv import load_dotenv
-load_dotenv()
+from utils.metrics import time_stage
+from utils.env import load_env
+load_env()
 # 初始化认证器（使用Bearer Token）
 auth = HTTPTokenAuth(scheme='Bearer')
 # 从环境变量或数据库加载合法API密钥（支持多密钥）
@@ -10,9 +11,10 @@ VALID_API_KEYS = set(os.getenv("TTS_API_KEY", "sk-nanoai-default-key").split(","
 @auth.verify_token
 def verify_token(token):
     """验证API密钥"""
-    if token in VALID_API_KEYS:
-        return token  # 返回密钥用于后续权限控制
-    return None  # 认证失败
+    with time_stage('auth'):
+        if token in VALID_API_KEYS:
+            return token  # 返回密钥用于后续权限控制
+        return None  # 认证失败
 @auth.error_handler
 def unauthorized():
     """认证失败响应"""
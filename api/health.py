@@ -0,0 +1,202 @@
+# api/health.py - /livez 与 /readyz：由后台探测线程维护状态，探针请求只读取快照
+import logging
+import os
+import threading
+import time
+from flask import g, jsonify, request
+from api.auth import auth
+from long_text import executor_stats
+from utils.metrics import process_rss_bytes
+
+logger = logging.getLogger('HealthProber')
+
+# 探针端点本身不计入在途请求
+_PROBE_ENDPOINTS = ('livez', 'readyz', 'health_check', 'prometheus_metrics')
+
+
+class HealthProber:
+    def __init__(self, tts_engine, model_cache=None, job_manager=None, interval=10.0,
+                 request_threads=8, max_utilization=0.85, max_rss_mb=0, max_synth_queue=None):
+        """
+        :param interval: 后台探测周期（秒）
+        :param request_threads: 每个 worker 处理请求的线程数（gunicorn threads）
+        :param max_utilization: 在途请求数占线程数的比例达到该值即报告未就绪，给探针和已接收的请求留出余量
+        :param max_rss_mb: 常驻内存上限（MB），0 表示不检查
+        :param max_synth_queue: 分段合成线程池排队数上限，默认等于线程池大小
+        """
+        self.tts_engine = tts_engine
+        self.model_cache = model_cache
+        self.job_manager = job_manager
+        self.interval = interval
+        self.request_threads = request_threads
+        self.max_in_flight = max(1, int(request_threads * max_utilization))
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self.max_synth_queue = max_synth_queue
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._snapshot = {}
+        self._last_tick = 0.0
+        self._upstream_failures = 0
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, tts_engine, model_cache=None, job_manager=None):
+        return cls(
+            tts_engine, model_cache, job_manager,
+            interval=float(os.getenv('PROBE_INTERVAL', 10)),
+            request_threads=int(os.getenv('GUNICORN_THREADS', 8)),
+            max_utilization=float(os.getenv('READY_MAX_UTILIZATION', 0.85)),
+            max_rss_mb=int(os.getenv('READY_MAX_RSS_MB', 0)),
+        )
+
+    def start(self):
+        if self._thread is None:
+            # 首次探测也在后台进行，不阻塞 worker 启动
+            self._last_tick = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name='health-prober', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                self._probe()
+            except Exception as e:
+                logger.warning(f"健康探测失败: {str(e)}")
+            time.sleep(self.interval)
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _probe_upstream(self):
+        started = time.perf_counter()
+        try:
+            status, _, _, _ = self.tts_engine.http.fetch('HEAD', f'{self.tts_engine.base_url}/')
+        except Exception as e:
+            self._upstream_failures += 1
+            return {"reachable": False, "error": str(e), "consecutive_failures": self._upstream_failures}
+        latency = time.perf_counter() - started
+        reachable = status < 500
+        self._upstream_failures = 0 if reachable else self._upstream_failures + 1
+        return {
+            "reachable": reachable,
+            "status": status,
+            "latency_ms": round(latency * 1000, 1),
+            "consecutive_failures": self._upstream_failures,
+        }
+
+    def _probe(self):
+        """采集一次状态并整体替换快照（只在后台线程中调用，不会阻塞探针请求）"""
+        snapshot = {"checked_at": int(time.time())}
+        snapshot["upstream"] = self._probe_upstream() if self.tts_engine else {"reachable": False}
+        snapshot["rss_bytes"] = process_rss_bytes()
+        snapshot["synth_pool"] = executor_stats()
+        if self.model_cache:
+            snapshot["model_cache"] = self.model_cache.stats()
+        if self.tts_engine:
+            snapshot["connection_pool"] = self.tts_engine.http.stats()
+            snapshot["upstream_resilience"] = self.tts_engine.resilience.stats()
+            snapshot["admission"] = self.tts_engine.admission.stats()
+            snapshot["hedging"] = self.tts_engine.hedger.stats()
+            snapshot["latency_model"] = self.tts_engine.latency_model.stats()
+            snapshot["singleflight"] = self.tts_engine.flights.stats()
+            if self.tts_engine.audio_cache:
+                snapshot["audio_cache"] = self.tts_engine.audio_cache.stats()
+        if self.job_manager:
+            try:
+                snapshot["job_queue_depth"] = self.job_manager.queue_depth()
+            except Exception as e:
+                snapshot["job_queue_depth"] = None
+                logger.warning(f"读取批量任务队列长度失败: {str(e)}")
+        self._snapshot = snapshot
+        self._last_tick = time.monotonic()
+
+    def alive(self):
+        """探测线程仍在按周期运行（单次上游探测最长可能阻塞到读超时）"""
+        return self._thread is not None and time.monotonic() - self._last_tick < self.interval * 3 + 60
+
+    def readiness(self):
+        """
+        根据最近一次快照与实时在途请求数判断是否就绪
+        :return: (是否就绪, 未就绪原因列表, 详情)
+        """
+        snapshot = self._snapshot
+        reasons = []
+        if not self.tts_engine:
+            reasons.append("tts_engine_unavailable")
+        if self.model_cache and not self.model_cache.ready:
+            reasons.append("warming")
+        in_flight = self.in_flight
+        if in_flight >= self.max_in_flight:
+            reasons.append("saturated")
+        admission = self.tts_engine.admission if self.tts_engine else None
+        if admission and admission.enabled and len(admission.queue) >= admission.max_queue:
+            reasons.append("admission_queue_full")
+        synth_pool = snapshot.get("synth_pool") or {}
+        max_synth_queue = self.max_synth_queue or synth_pool.get("max_workers") or 0
+        if max_synth_queue and synth_pool.get("queued", 0) > max_synth_queue:
+            reasons.append("synth_queue_full")
+        rss = snapshot.get("rss_bytes")
+        if self.max_rss_bytes and rss and rss > self.max_rss_bytes:
+            reasons.append("memory")
+        detail = dict(snapshot)
+        detail["in_flight"] = in_flight
+        detail["max_in_flight"] = self.max_in_flight
+        # 上游不可达或熔断时所有 worker 同样受影响，只标记 degraded，不摘除流量
+        detail["degraded"] = (not snapshot.get("upstream", {}).get("reachable", True)
+                              or bool(self.tts_engine and self.tts_engine.resilience.any_open()))
+        return not reasons, reasons, detail
+
+    def snapshot(self):
+        return self._snapshot
+
+
+def init_health(app, prober):
+    """注册在途请求计数钩子和 /livez、/readyz 端点"""
+
+    @app.before_request
+    def _count_in_flight():
+        if request.endpoint not in _PROBE_ENDPOINTS:
+            g.health_counted = True
+            prober.enter()
+
+    @app.after_request
+    def _release_in_flight(response):
+        # 流式响应在响应体发送完毕后才释放
+        if g.pop('health_counted', False):
+            response.call_on_close(prober.leave)
+        return response
+
+    @app.teardown_request
+    def _teardown_in_flight(exc):
+        # after_request 未执行（未处理的异常）时在这里释放
+        if g.pop('health_counted', False):
+            prober.leave()
+
+    @app.route('/livez', methods=['GET'])
+    def livez():
+        if not prober.alive():
+            return jsonify({"status": "dead", "message": "health prober stopped"}), 503
+        return jsonify({"status": "alive"}), 200
+
+    @app.route('/readyz', methods=['GET'])
+    @auth.login_required(optional=True)
+    def readyz():
+        ready, reasons, detail = prober.readiness()
+        # 负载均衡探针不带密钥，只需要状态和原因代码；上游错误、连接池、队列等内部状态需要 API 密钥
+        body = {"status": "ready" if ready else "not_ready"}
+        if not ready:
+            body["reasons"] = reasons
+        if auth.current_user():
+            body.update(detail)
+        if ready:
+            return jsonify(body), 200
+        logger.debug(f"未就绪: {', '.join(reasons)}")
+        return jsonify(body), 503, {"Retry-After": "5"}
+
+    return app
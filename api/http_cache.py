@@ -0,0 +1,53 @@
+# api/http_cache.py - 语音与模型列表响应的 HTTP 缓存语义（ETag / Cache-Control / Vary）
+import os
+from flask import Response
+from audio_cache import AudioCache
+
+
+class CachePolicy:
+    def __init__(self, cache_control=None, vary=None):
+        """
+        :param cache_control: Cache-Control 头，空值表示不设置
+        :param vary: 逗号分隔的 Vary 头字段
+        """
+        self.cache_control = cache_control or None
+        self.vary = [field.strip() for field in (vary or '').split(',') if field.strip()]
+
+    @classmethod
+    def from_env(cls, prefix, cache_control, vary):
+        return cls(
+            os.getenv(f'{prefix}_CACHE_CONTROL', cache_control),
+            os.getenv(f'{prefix}_VARY', vary),
+        )
+
+    def apply(self, response, etag):
+        """设置 ETag（弱校验）与缓存头"""
+        response.set_etag(etag, weak=True)
+        if self.cache_control:
+            response.headers['Cache-Control'] = self.cache_control
+        for field in self.vary:
+            response.vary.add(field)
+        return response
+
+    def conditional(self, request, etag):
+        """
+        If-None-Match 命中时返回条件请求的响应，否则返回 None
+        RFC 9110 13.1.2：只有 GET/HEAD 返回 304，其他方法（如 POST）返回 412
+        """
+        if etag and request.if_none_match.contains_weak(etag):
+            status = 304 if request.method in ('GET', 'HEAD') else 412
+            return self.apply(Response(status=status), etag)
+        return None
+
+
+def speech_etag(voice, speed, pitch, text, variant=''):
+    """
+    语音响应的 ETag：与音频缓存键同样由 (voice, speed, pitch, text) 推导，variant 区分输出方式不同的路径
+    上游每次合成的字节不保证完全一致，因此作为弱 ETag 使用
+    """
+    return AudioCache.make_key(voice, speed, pitch, f'{variant}\0{text}' if variant else text)[:32]
+
+
+# 语音与模型列表都需要鉴权：默认 private，由运营方决定是否允许共享缓存（public + Vary: Authorization）
+SPEECH_CACHE = CachePolicy.from_env('SPEECH', 'private, max-age=86400', 'Authorization')
+MODELS_CACHE = CachePolicy.from_env('MODELS', 'private, max-age=300', 'Authorization')
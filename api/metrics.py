@@ -0,0 +1,77 @@
+# api/metrics.py - /metrics 端点与请求级指标
+import time
+from flask import Response, g, request
+from utils import metrics
+
+
+def _counting(iterable, endpoint, started):
+    """包装流式响应体：统计发送字节数与响应体传输耗时"""
+    total = 0
+    try:
+        for chunk in iterable:
+            total += len(chunk)
+            yield chunk
+    finally:
+        metrics.BYTES_SERVED.labels(endpoint).inc(total)
+        metrics.observe_stage('response_write', time.perf_counter() - started)
+        close = getattr(iterable, 'close', None)
+        if close:
+            close()
+
+
+def _render_metrics():
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY, generate_latest
+    if metrics.MULTIPROCESS:
+        # 多进程模式：汇总所有 gunicorn worker 写入 PROMETHEUS_MULTIPROC_DIR 的数据
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    """注册请求级指标钩子和 /metrics 端点"""
+
+    @app.before_request
+    def _start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_endpoint = request.endpoint or 'unknown'
+        g.metrics_in_flight = True
+        metrics.IN_FLIGHT.labels(g.metrics_endpoint).inc()
+
+    @app.after_request
+    def _finish_request_metrics(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        endpoint = g.metrics_endpoint
+        handled = time.perf_counter()
+        metrics.HTTP_SECONDS.labels(endpoint).observe(handled - started)
+        metrics.HTTP_REQUESTS.labels(endpoint, str(response.status_code)).inc()
+        if response.is_streamed and not (response.direct_passthrough and response.content_length is not None):
+            # send_file 的文件响应（direct_passthrough）保持原样，服务器才能识别 file_wrapper 走 sendfile
+            response.response = _counting(response.response, endpoint, handled)
+        else:
+            metrics.BYTES_SERVED.labels(endpoint).inc(response.content_length or 0)
+            response.call_on_close(lambda: metrics.observe_stage('response_write', time.perf_counter() - handled))
+        # 请求在响应体发送完毕后才算结束（流式响应尤其如此）
+        g.metrics_in_flight = False
+        response.call_on_close(lambda: metrics.IN_FLIGHT.labels(endpoint).dec())
+        return response
+
+    @app.teardown_request
+    def _teardown_request_metrics(exc):
+        # after_request 未执行（未处理的异常）时在这里结束计数
+        if g.get('metrics_in_flight'):
+            g.metrics_in_flight = False
+            metrics.IN_FLIGHT.labels(g.metrics_endpoint).dec()
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        if not metrics.PROMETHEUS_AVAILABLE:
+            return {"error": "prometheus_client is not installed"}, 501
+        return _render_metrics()
+
+    return app
@@ -1,5 +1,6 @@
 # api/rate_limit.py - API限流模块
 import os
+from flask import request
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
@@ -25,5 +26,13 @@ def init_limiter(app):
     # 为不同接口设置差异化限流
     limiter.limit("30 per minute")(app.view_functions["create_speech"])  # TTS接口放宽到30次/分钟
     limiter.limit("60 per minute")(app.view_functions["list_models"])  # 模型列表接口60次/分钟
+    if "prometheus_metrics" in app.view_functions:
+        limiter.exempt(app.view_functions["prometheus_metrics"])  # 指标抓取不限流
+    if "livez" in app.view_functions:
+        limiter.exempt(app.view_functions["livez"])  # 负载均衡探针不限流
+    if "readyz" in app.view_functions:
+        # 不带密钥的探针不限流；带密钥查看详情的请求限流，避免被用来无限次尝试密钥
+        limiter.limit("60 per minute", exempt_when=lambda: "Authorization" not in request.headers)(
+            app.view_functions["readyz"])
     
     return limiter
@@ -0,0 +1,55 @@
+# api/static_page.py - 预压缩的静态页面（启动时计算一次，请求时只做协商和写出）
+import gzip
+import hashlib
+import os
+from flask import Response
+
+try:
+    import brotli  # 可选依赖，未安装时只提供 gzip
+    BROTLI_AVAILABLE = True
+except ImportError:  # pragma: no cover - 未安装 brotli
+    BROTLI_AVAILABLE = False
+
+# 页面内容随部署变化，ETag 保证更新后能重新校验；默认缓存一天
+STATIC_CACHE_MAX_AGE = int(os.getenv('STATIC_CACHE_MAX_AGE', 86400))
+
+
+class StaticPage:
+    def __init__(self, content, mimetype='text/html', max_age=STATIC_CACHE_MAX_AGE):
+        """
+        :param content: 页面内容（str 或 bytes），不做模板渲染
+        :param max_age: Cache-Control max-age（秒）
+        """
+        body = content.encode('utf-8') if isinstance(content, str) else content
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.mimetype = mimetype
+        self.cache_control = f'public, max-age={max_age}'
+        # 每种编码是不同的表示，各自使用强 ETag
+        self.variants = {None: (body, digest)}
+        self.variants['gzip'] = (gzip.compress(body, compresslevel=9, mtime=0), f'{digest}-gz')
+        if BROTLI_AVAILABLE:
+            self.variants['br'] = (brotli.compress(body, quality=11), f'{digest}-br')
+        self._etags = [etag for _, etag in self.variants.values()]
+
+    def _select(self, accept_encodings):
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding
+        return None
+
+    def response(self, request):
+        encoding = self._select(request.accept_encodings)
+        body, etag = self.variants[encoding]
+        if any(request.if_none_match.contains_weak(tag) for tag in self._etags):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=self.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = self.cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    def stats(self):
+        return {encoding or 'identity': len(body) for encoding, (body, _) in self.variants.items()}
@@ -0,0 +1,29 @@
+# api/voice_params.py - 语音合成请求参数的解析（app.py 与 api/index.py 共用）
+import math
+
+# 情绪对应的上游 speed/pitch；neutral 使用请求中的语速
+EMOTION_PARAMS = {
+    'happy': {'speed': 1.1, 'pitch': 1.2},
+    'sad': {'speed': 0.9, 'pitch': 0.8},
+    'angry': {'speed': 1.2, 'pitch': 1.1},
+}
+
+
+def parse_speed(value):
+    """客户端传入的 speed 转为 float（兼容 "1.2" 这类字符串），缺省为 1.0；无法解析或非正数时抛出 ValueError"""
+    if value is None:
+        return 1.0
+    if isinstance(value, bool):
+        raise ValueError(f"invalid speed: {value!r}")
+    try:
+        speed = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid speed: {value!r}")
+    if not math.isfinite(speed) or speed <= 0:
+        raise ValueError(f"invalid speed: {value!r}")
+    return speed
+
+
+def resolve_voice_params(speed, emotion):
+    """情绪参数映射为上游的 speed/pitch，未知情绪按 neutral 处理"""
+    return dict(EMOTION_PARAMS.get(emotion) or {'speed': speed, 'pitch': 1.0})
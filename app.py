@@ -1,7 +1,18 @@
 # app.py - 纳米AI TTS主应用
-from flask import Flask, request, Response, jsonify, render_template_string
+from utils.env import load_env
+# 先加载 .env，导入时读取环境变量的模块（指标、认证等）才能看到其中的配置
+load_env()
+from flask import Flask, request, Response, jsonify, send_file
 from flask_cors import CORS
 from nano_tts import NanoAITTS
+from long_text import LongTextSynthesizer
+from model_cache import ModelCache
+from jobs import JobManager, owner_id
+from resilience import UpstreamError, UpstreamUnavailable
+from admission import Overloaded, tenant_id
+import json
+import math
+import itertools
 import threading
 import time
 import os
@@ -9,52 +20,53 @@ import logging
 from datetime import datetime
 import random
 import io
-from dotenv import load_dotenv
-from utils.logger import get_logger
+from utils.logger import get_logger, init_sentry
 from api.auth import auth
 from api.rate_limit import init_limiter
-from deploy.config import DeployConfig
-# 加载环境变量
-load_dotenv()
+from api.metrics import init_metrics
+from api.health import HealthProber, init_health
+from api.static_page import StaticPage
+from api.http_cache import MODELS_CACHE, SPEECH_CACHE, speech_etag
+from api.voice_params import parse_speed, resolve_voice_params
 logger = get_logger()
+init_sentry()
 # --- 配置 ---
 STATIC_API_KEY = os.getenv("TTS_API_KEY", "sk-nanoai-your-secret-key")
 CACHE_DURATION_SECONDS = int(os.getenv("CACHE_DURATION", 2 * 60 * 60))
 PORT = int(os.getenv("PORT", 5001))
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
-# --- 缓存管理器 ---
-class ModelCache:
-    def __init__(self, tts_engine):
-        self._tts_engine = tts_engine
-        self._cache = {}
-        self._last_updated = 0
-        self._lock = threading.Lock()
-        self.logger = logging.getLogger('ModelCache')
-    def get_models(self):
-        with self._lock:
-            current_time = time.time()
-            if not self._cache or (current_time - self._last_updated > CACHE_DURATION_SECONDS):
-                self.logger.info("缓存过期或为空，正在刷新模型列表...")
-                try:
-                    self._tts_engine.load_voices()
-                    self._cache = {tag: info['name'] for tag, info in self._tts_engine.voices.items()}
-                    self._last_updated = current_time
-                    self.logger.info(f"模型列表刷新成功，共找到 {len(self._cache)} 个模型。")
-                except Exception as e:
-                    self.logger.error(f"刷新模型列表失败: {str(e)}", exc_info=True)
-            return self._cache
+STREAM_AUDIO_DEFAULT = os.getenv("STREAM_AUDIO", "False").lower() == "true"
+# 单个批量任务的最大条目数（JSON 与 NDJSON 上传共用）
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+# 批量任务音频文件的客户端缓存时长（秒）
+ARTIFACT_MAX_AGE = 3600
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonlines', 'application/x-jsonlines')
+# 超过该长度的文本分段并行合成（不超过上游单次上限）
+LONG_TEXT_THRESHOLD = min(int(os.getenv("LONG_TEXT_THRESHOLD", NanoAITTS.MAX_TEXT_LENGTH)), NanoAITTS.MAX_TEXT_LENGTH)
 # --- 初始化 ---
 app = Flask(__name__)
 CORS(app)
 try:
     logger.info("正在初始化 TTS 引擎...")
-    tts_engine = NanoAITTS()
+    # 声音列表在后台加载，导入与 worker 启动不等待网络
+    tts_engine = NanoAITTS(lazy=True)
     logger.info("TTS 引擎初始化完毕。")
-    model_cache = ModelCache(tts_engine)
+    model_cache = ModelCache(tts_engine, ttl=CACHE_DURATION_SECONDS)
+    long_text_synthesizer = LongTextSynthesizer(tts_engine)
 except Exception as e:
     logger.critical(f"TTS 引擎初始化失败: {str(e)}", exc_info=True)
     tts_engine = None
     model_cache = None
+    long_text_synthesizer = None
+job_manager = None
+if tts_engine:
+    try:
+        job_manager = JobManager.from_env(tts_engine, tts_engine.cache_dir, long_text_synthesizer)
+        job_manager.start()
+    except Exception as e:
+        logger.error(f"批量任务引擎初始化失败: {str(e)}", exc_info=True)
+# 后台探测上游与本进程负载，/livez、/readyz 只读取探测结果
+health_prober = HealthProber.from_env(tts_engine, model_cache, job_manager).start()
 # HTML模板（完整前端界面）
 HTML_TEMPLATE = """<!DOCTYPE html>
 <html lang="zh-CN">
@@ -589,7 +601,9 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             showStatus('正在生成语音...', 'info');
             cleanupAudioUrl();
             try {
-                if (textInput.length > 500) {
+                // Serverless 部署不支持批量任务（501），改为直接合成（长文本由服务端分段）
+                let useBatch = textInput.length > 500;
+                if (useBatch) {
                     const response = await fetch(`${apiBase}/v1/audio/speech/batch`, {
                         method: 'POST',
                         headers: {
@@ -602,11 +616,16 @@ HTML_TEMPLATE = """<!DOCTYPE html>
                             params: { speed, emotion }
                         })
                     });
-                    const taskData = await response.json();
-                    currentTaskId = taskData.task_id;
-                    showTaskProgress(taskData.estimated_time || 30);
-                    startTaskPolling();
-                } else {
+                    if (response.status === 501) {
+                        useBatch = false;
+                    } else {
+                        const taskData = await response.json();
+                        currentTaskId = taskData.task_id;
+                        showTaskProgress(taskData.estimated_time || 30);
+                        startTaskPolling();
+                    }
+                }
+                if (!useBatch) {
                     const controller = new AbortController();
                     const timeoutId = setTimeout(() => controller.abort(), 30000);
                     const response = await fetch(`${apiBase}/v1/audio/speech`, {
@@ -722,7 +741,17 @@ HTML_TEMPLATE = """<!DOCTYPE html>
         async function displayTaskResults(results) {
             if (results && results.length > 0) {
                 const result = results[0];
-                currentAudioBlob = await fetch(result.audio_url).then(r => r.blob());
+                const apiBase = document.getElementById('apiBase').value;
+                const apiKey = document.getElementById('apiKey').value;
+                // 批量任务的音频下载需要鉴权
+                const audioResponse = await fetch(`${apiBase}${result.audio_url}`, {
+                    headers: { 'Authorization': `Bearer ${apiKey}` }
+                });
+                if (!audioResponse.ok) {
+                    showStatus(`❌ 下载音频失败: HTTP ${audioResponse.status}`, 'error');
+                    return;
+                }
+                currentAudioBlob = await audioResponse.blob();
                 currentAudioUrl = (window.URL || window.webkitURL).createObjectURL(currentAudioBlob);
                 const audioElement = document.getElementById('audio');
                 audioElement.src = currentAudioUrl;
@@ -829,10 +858,12 @@ HTML_TEMPLATE = """<!DOCTYPE html>
     </script>
 </body>
 </html>"""
+# 页面没有模板变量：启动时编码并预压缩一次，请求时只做内容协商和 304 判断
+INDEX_PAGE = StaticPage(HTML_TEMPLATE)
 # --- 路由和API端点 ---
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    return INDEX_PAGE.response(request)
 @app.route('/v1/audio/speech', methods=['POST'])
 @auth.login_required
 def create_speech():
@@ -848,97 +879,171 @@ def create_speech():
     
     model_id = data.get('model')
     text_input = data.get('input')
-    speed = data.get('speed', 1.0)
+    try:
+        speed = parse_speed(data.get('speed'))
+    except ValueError:
+        return jsonify({"error": "Invalid 'speed': must be a positive number"}), 400
     emotion = data.get('emotion', 'neutral')
+    stream = bool(data.get('stream', STREAM_AUDIO_DEFAULT))
     
     if not model_id or not text_input:
         logger.warning("请求缺少必填字段: 'model'或'input'")
         return jsonify({"error": "Missing required fields: 'model' and 'input'"}), 400
     
-    available_models = model_cache.get_models()
-    if model_id not in available_models:
+    # 声音列表加载完成前（warming）直接放行，由上游校验
+    if model_cache.ready and model_id not in model_cache.get_models():
         logger.warning(f"请求了不存在的模型: {model_id}")
         return jsonify({"error": f"Model '{model_id}' not found. Please use the /v1/models endpoint to see available models."}), 404
     
     logger.info(f"收到语音合成请求: model='{model_id}', input='{text_input[:30]}...', speed={speed}, emotion={emotion}")
     
     try:
-        # 情绪参数映射
-        emotion_params = {
-            'happy': {'speed': 1.1, 'pitch': 1.2},
-            'sad': {'speed': 0.9, 'pitch': 0.8},
-            'angry': {'speed': 1.2, 'pitch': 1.1},
-            'neutral': {'speed': speed, 'pitch': 1.0}
-        }
-        params = emotion_params.get(emotion, emotion_params['neutral'])
+        params = resolve_voice_params(speed, emotion)
+        # 上游名额紧张时按 API 密钥公平排队
+        tenant = tenant_id(auth.current_user())
+        long_text = len(text_input) > LONG_TEXT_THRESHOLD
+        # 长文本的输出取决于分段方式，流式与非流式拼接结果也不同，分别计算 ETag
+        variant = f"{'long-stream' if stream else 'long'}:{long_text_synthesizer.processor.max_chunk_length}" if long_text else ''
+        etag = speech_etag(model_id, params['speed'], params['pitch'], text_input, variant)
+        precondition = SPEECH_CACHE.conditional(request, etag)
+        if precondition:
+            # POST 不能返回 304：客户端已持有相同音频时返回 412，同样不请求上游
+            logger.info(f"语音合成请求的 If-None-Match 命中（{precondition.status_code}），模型: {model_id}")
+            return precondition
         
-        audio_data = tts_engine.get_audio(text_input, voice=model_id, **params)
+        if long_text and stream:
+            # 长文本渐进式流式返回：第一段就绪即开始发送
+            audio_stream = long_text_synthesizer.stream(text_input, model_id, tenant=tenant, **params)
+            first_chunk = next(audio_stream, b'')
+            logger.info(f"长文本语音合成开始流式返回，模型: {model_id}, 文本长度: {len(text_input)}")
+            return SPEECH_CACHE.apply(Response(
+                itertools.chain([first_chunk], audio_stream),
+                mimetype='audio/mpeg',
+                headers={'X-Accel-Buffering': 'no'}
+            ), etag)
+        
+        if long_text:
+            audio_data = long_text_synthesizer.synthesize(text_input, model_id, tenant=tenant, **params)
+            logger.info(f"长文本语音合成成功，模型: {model_id}, 文本长度: {len(text_input)}")
+            return SPEECH_CACHE.apply(Response(audio_data, mimetype='audio/mpeg'), etag)
+        
+        if stream:
+            # 先取第一块：上游错误在此处抛出，仍可返回 JSON 错误响应
+            audio_stream = tts_engine.stream_audio(text_input, voice=model_id, tenant=tenant, **params)
+            first_chunk = next(audio_stream, b'')
+            logger.info(f"语音合成开始流式返回，模型: {model_id}, 文本长度: {len(text_input)}")
+            return SPEECH_CACHE.apply(Response(
+                itertools.chain([first_chunk], audio_stream),
+                mimetype='audio/mpeg',
+                headers={'X-Accel-Buffering': 'no'}
+            ), etag)
+        
+        audio_data = tts_engine.get_audio(text_input, voice=model_id, tenant=tenant, **params)
         logger.info(f"语音合成成功，模型: {model_id}, 文本长度: {len(text_input)}")
-        return Response(audio_data, mimetype='audio/mpeg')
+        return SPEECH_CACHE.apply(Response(audio_data, mimetype='audio/mpeg'), etag)
+    except Overloaded as e:
+        # 上游并发名额已满且无法在截止时间前排到：尽早拒绝，避免请求堆积到 gunicorn 超时
+        logger.warning(f"准入控制拒绝语音合成请求: {str(e)}")
+        return jsonify({"error": str(e)}), e.status, {"Retry-After": str(math.ceil(e.retry_after))}
+    except UpstreamUnavailable as e:
+        # 熔断期间快速失败，不占用线程等待上游
+        logger.warning(f"上游熔断中，拒绝语音合成请求: {str(e)}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(math.ceil(e.retry_after))}
+    except UpstreamError as e:
+        logger.error(f"上游错误: {str(e)}")
+        return jsonify({"error": f"Failed to generate audio: {str(e)}"}), 502
+    except ValueError as e:
+        # 文本为空、声音模型无效等客户端参数错误
+        logger.warning(f"语音合成请求参数无效: {str(e)}")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"TTS引擎错误: {str(e)}", exc_info=True)
         return jsonify({"error": f"Failed to generate audio: {str(e)}"}), 500
 @app.route('/v1/audio/speech/batch', methods=['POST'])
 @auth.login_required
 def batch_create_speech():
-    if not tts_engine:
-        return jsonify({"error": "TTS engine is not available due to initialization failure."}), 503
-    
-    try:
-        data = request.get_json()
-    except Exception as e:
-        logger.error(f"解析请求JSON失败: {str(e)}", exc_info=True)
-        return jsonify({"error": "Invalid JSON body"}), 400
+    if not tts_engine or not job_manager:
+        return jsonify({"error": "Batch processing is not available due to initialization failure."}), 503
     
-    texts = data.get('texts', [])
-    model_id = data.get('model')
-    params = data.get('params', {})
+    if request.mimetype in NDJSON_MIMETYPES:
+        # NDJSON 批量上传：每行一个 JSON 字符串或 {"input": "..."}，模型和参数放在查询字符串中
+        model_id = request.args.get('model')
+        try:
+            speed = parse_speed(request.args.get('speed'))
+        except ValueError:
+            return jsonify({"error": "Invalid 'speed' query parameter"}), 400
+        emotion = request.args.get('emotion', 'neutral')
+        texts = []
+        for line_no, line in enumerate(request.get_data(as_text=True).splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                return jsonify({"error": f"Invalid JSON on line {line_no}"}), 400
+            texts.append(item.get('input') or item.get('text') if isinstance(item, dict) else item)
+            if len(texts) > BATCH_MAX_ITEMS:
+                break
+    else:
+        try:
+            data = request.get_json()
+        except Exception as e:
+            logger.error(f"解析请求JSON失败: {str(e)}", exc_info=True)
+            return jsonify({"error": "Invalid JSON body"}), 400
+        
+        texts = data.get('texts', [])
+        model_id = data.get('model')
+        params = data.get('params', {})
+        try:
+            speed = parse_speed(params.get('speed'))
+        except ValueError:
+            return jsonify({"error": "Invalid 'speed': must be a positive number"}), 400
+        emotion = params.get('emotion', 'neutral')
     
     if not texts or not model_id:
         return jsonify({"error": "Missing required fields: 'texts' and 'model'"}), 400
     
-    if len(texts) > 10:
-        return jsonify({"error": "Batch task supports maximum 10 texts"}), 400
+    if len(texts) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Batch task supports maximum {BATCH_MAX_ITEMS} texts"}), 400
     
-    task_id = f"batch_{int(time.time())}_{random.randint(1000, 9999)}"
-    logger.info(f"创建批量任务: {task_id}, 文本数量: {len(texts)}")
+    if not all(isinstance(text, str) and text.strip() for text in texts):
+        return jsonify({"error": "Every batch item must be a non-empty string"}), 400
+    
+    if model_cache.ready and model_id not in model_cache.get_models():
+        return jsonify({"error": f"Model '{model_id}' not found. Please use the /v1/models endpoint to see available models."}), 404
     
-    # 这里应该使用任务队列（如Celery或RQ），简化版直接处理
     try:
-        results = []
-        for i, text in enumerate(texts):
-            logger.info(f"处理批量任务 {task_id} 的第 {i+1}/{len(texts)} 段文本")
-            audio_data = tts_engine.get_audio(text, voice=model_id, **params)
-            # 保存音频到临时文件或对象存储
-            audio_url = f"/audio/{task_id}_{i}.mp3"
-            results.append({
-                "text": text[:50] + "..." if len(text) > 50 else text,
-                "audio_url": audio_url
-            })
-        
-        return jsonify({
-            "task_id": task_id,
-            "status": "completed",
-            "results": results,
-            "estimated_time": len(texts) * 5
-        }), 202
+        task_id = job_manager.submit(texts, model_id, resolve_voice_params(speed, emotion), owner_id(auth.current_user()))
     except Exception as e:
-        logger.error(f"批量任务处理失败: {str(e)}", exc_info=True)
+        logger.error(f"批量任务创建失败: {str(e)}", exc_info=True)
         return jsonify({"error": f"Batch processing failed: {str(e)}"}), 500
+    
+    task = job_manager.get(task_id, owner_id(auth.current_user()))
+    task["status_url"] = f"/v1/tasks/{task_id}"
+    return jsonify(task), 202
 @app.route('/v1/tasks/<task_id>', methods=['GET'])
 @auth.login_required
 def get_task_status(task_id):
-    # 简化版：直接返回完成状态
-    return jsonify({
-        "task_id": task_id,
-        "status": "completed",
-        "results": [
-            {
-                "text": "示例文本",
-                "audio_url": "/audio/sample.mp3"
-            }
-        ]
-    })
+    if not job_manager:
+        return jsonify({"error": "Batch processing is not available due to initialization failure."}), 503
+    task = job_manager.get(task_id, owner_id(auth.current_user()))
+    if task is None:
+        return jsonify({"error": f"Task '{task_id}' not found or expired"}), 404
+    return jsonify(task)
+@app.route('/audio/<task_id>_<int:index>.mp3', methods=['GET'])
+@auth.login_required
+def get_task_audio(task_id, index):
+    path = job_manager.result_path(task_id, index, owner_id(auth.current_user())) if job_manager else None
+    if path is None:
+        return jsonify({"error": "Audio not found or expired"}), 404
+    # conditional=True：支持 Range/If-Range、If-None-Match/If-Modified-Since，文件内容经 wsgi.file_wrapper
+    # 发送（gunicorn 下为 sendfile 零拷贝），不会整体读入内存
+    response = send_file(path, mimetype='audio/mpeg', conditional=True, etag=True)
+    # 结果文件写入后不再变化；需要鉴权，只允许客户端私有缓存
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    response.cache_control.max_age = ARTIFACT_MAX_AGE
+    return response
 @app.route('/v1/models', methods=['GET'])
 @auth.login_required
 def list_models():
@@ -946,48 +1051,48 @@ def list_models():
         logger.error("模型缓存未初始化，无法列出模型")
         return jsonify({"error": "TTS engine is not available due to initialization failure."}), 503
     
-    available_models = model_cache.get_models()
-    logger.info(f"列出可用模型，共 {len(available_models)} 个")
-    
-    models_data = [
-        {
-            "id": model_id,
-            "object": "model",
-            "created": int(model_cache._last_updated),
-            "owned_by": "nanoai",
-            "description": model_name
-        }
-        for model_id, model_name in available_models.items()
-    ]
-    return jsonify({"object": "list", "data": models_data})
+    # 快照中已预先序列化好响应体，无需逐个构建
+    if not model_cache.ready:
+        return jsonify({"error": "Model list is warming up, please retry shortly."}), 503, {"Retry-After": "1"}
+    registry = model_cache.registry
+    not_modified = MODELS_CACHE.conditional(request, registry.etag)
+    if not_modified:
+        return not_modified
+    logger.debug(f"列出可用模型，共 {len(registry)} 个")
+    if request.accept_encodings['gzip']:
+        response = Response(registry.models_payload_gzip, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(registry.models_payload, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    return MODELS_CACHE.apply(response, registry.etag)
 @app.route('/health', methods=['GET'])
 def health_check():
+    # 探针每个周期都会访问：只读取模型列表状态，各子系统的统计见 /readyz（后台探测快照）与 /metrics
     if tts_engine and model_cache:
-        model_count = len(model_cache.get_models())
-        logger.info(f"健康检查: 服务正常，模型数量: {model_count}")
+        # stats() 只读当前快照，不会像 registry 那样触发刷新
+        cache_stats = model_cache.stats()
         return jsonify({
-            "status": "ok", 
-            "models_in_cache": model_count,
+            "status": "ok" if cache_stats["state"] != "warming" else "warming",
+            "models_in_cache": cache_stats["models"],
             "timestamp": int(time.time()),
-            "version": "1.0.0",
-            "checks": {
-                "tts_engine": "healthy",
-                "cache": f"healthy ({model_count} models)",
-                "memory": "45% used"
-            }
+            "version": "1.0.0"
         }), 200
     else:
         logger.error("健康检查失败: TTS引擎未初始化")
         return jsonify({"status": "error", "message": "TTS engine not initialized"}), 503
 
 # 初始化限流器（必须在所有路由定义之后）
+init_metrics(app)
+init_health(app, health_prober)
 limiter = init_limiter(app)
 
 # --- 启动服务 ---
 if __name__ == '__main__':
     if tts_engine:
         logger.info("正在预热模型缓存...")
-        model_cache.get_models()
+        # get_models() 不会阻塞等待加载，启动时同步刷新一次
+        model_cache.refresh_now()
         logger.info(f"服务准备就绪，监听端口 {PORT}")
         app.run(host='0.0.0.0', port=PORT, debug=DEBUG)
     else:
@@ -0,0 +1,282 @@
+# audio_cache.py - 基于内容寻址的磁盘音频缓存
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from utils.metrics import AUDIO_CACHE_EVENTS
+
+try:
+    import fcntl  # 仅 POSIX 可用，用于跨 gunicorn worker 串行化淘汰
+except ImportError:  # pragma: no cover - Windows 本地开发
+    fcntl = None
+
+logger = logging.getLogger('AudioCache')
+
+# 缓存键格式版本，修改键的组成方式时递增，旧文件会自然被 LRU 淘汰
+KEY_VERSION = 'v1'
+
+
+class AudioCache:
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024, low_watermark=0.9):
+        """
+        :param cache_dir: 音频缓存根目录（每个条目一个 .mp3 文件）
+        :param max_bytes: 磁盘占用上限（字节），超过后按 LRU 淘汰
+        :param low_watermark: 淘汰后保留的容量比例，避免每次写入都触发淘汰
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.low_watermark = low_watermark
+        self.enabled = self._ensure_dir()
+        self._lock = threading.Lock()
+        self._approx_bytes = None  # 本进程对目录大小的估计，其他 worker 的写入在下次扫描时校正
+        self._writes_since_scan = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls, base_dir):
+        """根据环境变量创建缓存，AUDIO_CACHE_ENABLED=false 时返回 None"""
+        if os.getenv('AUDIO_CACHE_ENABLED', 'true').lower() != 'true':
+            return None
+        max_mb = int(os.getenv('AUDIO_CACHE_MAX_MB', 512))
+        cache = cls(os.path.join(base_dir, 'audio'), max_bytes=max_mb * 1024 * 1024)
+        return cache if cache.enabled else None
+
+    def _ensure_dir(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            return os.access(self.cache_dir, os.W_OK)
+        except (OSError, IOError) as e:
+            logger.warning(f"无法创建音频缓存目录: {str(e)}，音频缓存已禁用")
+            return False
+
+    @staticmethod
+    def make_key(voice, speed, pitch, text):
+        """缓存键：(voice, speed, pitch, text) 的 SHA-256"""
+        raw = f"{KEY_VERSION}\0{voice}\0{float(speed)!r}\0{float(pitch)!r}\0{text}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        # 两级目录分片，避免单目录下文件过多
+        return os.path.join(self.cache_dir, key[:2], f"{key}.mp3")
+
+    def get(self, key, record=True):
+        """
+        命中时返回音频字节并刷新 LRU 时间戳，未命中返回 None
+        :param record: 是否计入命中/未命中统计（内部复查时传 False）
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            if record:
+                AUDIO_CACHE_EVENTS.labels('miss').inc()
+                with self._lock:
+                    self.misses += 1
+            return None
+        except OSError as e:
+            logger.warning(f"读取音频缓存失败: {str(e)}")
+            with self._lock:
+                self.misses += int(record)
+                self.errors += 1
+            return None
+        try:
+            # 用 mtime 记录最近访问时间（atime 在 noatime 挂载下不可靠）
+            os.utime(path, None)
+        except OSError:
+            pass
+        AUDIO_CACHE_EVENTS.labels('hit').inc()
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """原子写入：先写同目录临时文件，再 os.replace，多个 worker 并发写同一键也安全"""
+        if not data:
+            return False
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-', suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                self._discard(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning(f"写入音频缓存失败: {str(e)}")
+            with self._lock:
+                self.errors += 1
+            return False
+        self._account(len(data))
+        return True
+
+    def writer(self, key):
+        """返回增量写入器，适用于边流式转发边写缓存的场景"""
+        return AudioCacheWriter(self, key)
+
+    def _account(self, size):
+        with self._lock:
+            self.writes += 1
+            self._writes_since_scan += 1
+            if self._approx_bytes is not None:
+                self._approx_bytes += size
+            # 首次写入或累计一定次数后重新扫描，以纳入其他 worker 的写入
+            need_scan = self._approx_bytes is None or self._writes_since_scan >= 256
+            over_budget = self._approx_bytes is not None and self._approx_bytes > self.max_bytes
+        if need_scan or over_budget:
+            self.evict()
+
+    @staticmethod
+    def _discard(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _scan(self):
+        entries = []
+        total = 0
+        now = time.time()
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith('.tmp-'):
+                    # 清理崩溃 worker 遗留的临时文件
+                    if now - st.st_mtime > 3600:
+                        self._discard(entry.path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        return entries, total
+
+    def evict(self):
+        """扫描缓存目录，超出容量时按 mtime 从旧到新删除，直到低于低水位"""
+        lock_file = None
+        try:
+            if fcntl is not None:
+                lock_file = open(os.path.join(self.cache_dir, '.evict.lock'), 'a')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # 其他 worker 正在淘汰，本次跳过
+                    return 0
+            entries, total = self._scan()
+            removed = 0
+            if total > self.max_bytes:
+                target = int(self.max_bytes * self.low_watermark)
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        logger.warning(f"淘汰音频缓存失败: {str(e)}")
+                        continue
+                    total -= size
+                    removed += 1
+                if removed:
+                    logger.info(f"音频缓存淘汰 {removed} 个文件，当前占用 {total} 字节")
+            AUDIO_CACHE_EVENTS.labels('eviction').inc(removed)
+            with self._lock:
+                self._approx_bytes = total
+                self._writes_since_scan = 0
+                self.evictions += removed
+            return removed
+        except OSError as e:
+            logger.warning(f"扫描音频缓存失败: {str(e)}")
+            return 0
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "writes": self.writes,
+                "errors": self.errors,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "approx_bytes": self._approx_bytes or 0,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class AudioCacheWriter:
+    """增量写入临时文件，commit() 时原子替换为正式缓存文件，abort() 丢弃"""
+
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._path = cache._path(key)
+        self._file = None
+        self._tmp_path = None
+        self.size = 0
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(self._path), prefix='.tmp-', suffix='.part')
+            self._file = os.fdopen(fd, 'wb')
+        except OSError as e:
+            logger.warning(f"创建音频缓存临时文件失败: {str(e)}")
+            self._fail()
+
+    def _fail(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._tmp_path:
+            AudioCache._discard(self._tmp_path)
+            self._tmp_path = None
+        with self._cache._lock:
+            self._cache.errors += 1
+
+    def write(self, chunk):
+        if self._file is None:
+            return
+        try:
+            self._file.write(chunk)
+            self.size += len(chunk)
+        except OSError as e:
+            logger.warning(f"写入音频缓存失败: {str(e)}")
+            self._fail()
+
+    def commit(self):
+        if self._file is None:
+            return False
+        try:
+            self._file.close()
+            self._file = None
+            os.replace(self._tmp_path, self._path)
+            self._tmp_path = None
+        except OSError as e:
+            logger.warning(f"写入音频缓存失败: {str(e)}")
+            self._fail()
+            return False
+        self._cache._account(self.size)
+        return True
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._tmp_path:
+            AudioCache._discard(self._tmp_path)
+            self._tmp_path = None
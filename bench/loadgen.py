@@ -0,0 +1,225 @@
+# bench/loadgen.py - 端到端压测：驱动 /v1/audio/speech、/v1/audio/speech/batch、/v1/models
+"""
+用法:
+    python -m bench.loadgen --target http://127.0.0.1:5001 --api-key sk-... \\
+        --concurrency 32 --duration 60 --mix speech=0.85,batch=0.05,models=0.10 \\
+        --output bench_result.json
+
+输出 JSON：各端点的吞吐量、延迟与首字节时间（TTFB）的 p50/p95/p99、状态码分布。
+"""
+import argparse
+import http.client
+import json
+import math
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+# 文本长度分布：名称 -> (权重, 最短字符数, 最长字符数)
+DEFAULT_TEXT_MIX = 'short=0.6:5-40,medium=0.3:80-300,long=0.1:800-3000'
+_SENTENCES = [
+    '今天天气晴朗，适合出门散步。',
+    '列车即将进站，请站在黄线以外候车。',
+    '欢迎使用纳米AI语音合成服务！',
+    '请注意，会议将在五分钟后开始。',
+    '人工智能正在改变我们的生活方式；',
+    'The quick brown fox jumps over the lazy dog. ',
+]
+
+
+def parse_mix(spec):
+    """解析 'a=0.5,b=0.5' 形式的权重表"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def parse_text_mix(spec):
+    mix = []
+    for part in spec.split(','):
+        name, _, rest = part.partition('=')
+        weight, _, span = rest.partition(':')
+        low, _, high = span.partition('-')
+        mix.append((name.strip(), float(weight), int(low), int(high or low)))
+    return mix
+
+
+def make_text(length):
+    parts = []
+    total = 0
+    while total < length:
+        sentence = random.choice(_SENTENCES)
+        parts.append(sentence)
+        total += len(sentence)
+    return ''.join(parts)[:length]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    # nearest-rank 百分位
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return round(ordered[index] * 1000, 2)
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, name, status, latency, ttfb, size):
+        with self._lock:
+            entry = self.samples.setdefault(name, {'latency': [], 'ttfb': [], 'status': {}, 'bytes': 0})
+            entry['status'][str(status)] = entry['status'].get(str(status), 0) + 1
+            entry['bytes'] += size
+            if status and status < 400:
+                entry['latency'].append(latency)
+                if ttfb is not None:
+                    entry['ttfb'].append(ttfb)
+
+    def report(self, elapsed):
+        result = {}
+        for name, entry in sorted(self.samples.items()):
+            count = sum(entry['status'].values())
+            ok = len(entry['latency'])
+            result[name] = {
+                'requests': count,
+                'ok': ok,
+                'error_rate': round(1 - ok / count, 4) if count else 0.0,
+                'throughput_rps': round(ok / elapsed, 3) if elapsed else 0.0,
+                'bytes': entry['bytes'],
+                'status': entry['status'],
+                'latency_ms': {p: percentile(entry['latency'], q) for p, q in (('p50', 50), ('p95', 95), ('p99', 99))},
+                'ttfb_ms': {p: percentile(entry['ttfb'], q) for p, q in (('p50', 50), ('p95', 95), ('p99', 99))},
+            }
+        return result
+
+
+class LoadGenerator:
+    def __init__(self, target, api_key, model='DeepSeek', mix=None, text_mix=None, stream=False, timeout=130):
+        parts = urllib.parse.urlsplit(target)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.api_key = api_key
+        self.model = model
+        self.mix = mix or parse_mix('speech=0.85,batch=0.05,models=0.10')
+        self.text_mix = text_mix or parse_text_mix(DEFAULT_TEXT_MIX)
+        self.stream = stream
+        self.timeout = timeout
+        self.stats = Stats()
+
+    def _connection(self):
+        cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def _pick_text(self):
+        names, weights = zip(*[(m, m[1]) for m in self.text_mix])
+        name, _, low, high = random.choices(names, weights=weights)[0]
+        return name, make_text(random.randint(low, high))
+
+    def _request(self, conn, method, path, body=None, content_type='application/json'):
+        headers = {'Authorization': f'Bearer {self.api_key}'}
+        if body is not None:
+            headers['Content-Type'] = content_type
+        start = time.perf_counter()
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        first = response.read1(65536) if hasattr(response, 'read1') else response.read(65536)
+        ttfb = time.perf_counter() - start
+        size = len(first) + len(response.read())
+        return response.status, time.perf_counter() - start, ttfb, size
+
+    def one(self, conn):
+        kind = random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if kind == 'models':
+            name, args = 'models', ('GET', '/v1/models')
+        elif kind == 'batch':
+            texts = [self._pick_text()[1] for _ in range(random.randint(2, 10))]
+            name = 'batch'
+            args = ('POST', '/v1/audio/speech/batch', json.dumps({'texts': texts, 'model': self.model}).encode('utf-8'))
+        else:
+            bucket, text = self._pick_text()
+            name = f'speech_{bucket}'
+            payload = {'model': self.model, 'input': text, 'stream': self.stream}
+            args = ('POST', '/v1/audio/speech', json.dumps(payload).encode('utf-8'))
+        try:
+            status, latency, ttfb, size = self._request(conn, *args)
+        except (OSError, http.client.HTTPException):
+            self.stats.record(name, 0, 0, None, 0)
+            return False
+        self.stats.record(name, status, latency, ttfb, size)
+        return True
+
+    def _worker(self, deadline, remaining):
+        conn = self._connection()
+        while time.monotonic() < deadline:
+            if remaining is not None:
+                with remaining['lock']:
+                    if remaining['count'] <= 0:
+                        break
+                    remaining['count'] -= 1
+            if not self.one(conn):
+                conn.close()
+                conn = self._connection()
+        conn.close()
+
+    def run(self, concurrency=16, duration=30.0, requests=None):
+        deadline = time.monotonic() + duration
+        remaining = {'count': requests, 'lock': threading.Lock()} if requests else None
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._worker, args=(deadline, remaining), daemon=True) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        return {
+            'config': {
+                'target': f'{self.scheme}://{self.host}:{self.port}',
+                'concurrency': concurrency,
+                'duration_s': round(elapsed, 3),
+                'mix': self.mix,
+                'stream': self.stream,
+                'text_mix': {name: {'weight': w, 'chars': [low, high]} for name, w, low, high in self.text_mix},
+            },
+            'endpoints': self.stats.report(elapsed),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='纳米AI TTS 端到端压测')
+    parser.add_argument('--target', default='http://127.0.0.1:5001')
+    parser.add_argument('--api-key', default='sk-nanoai-default-key')
+    parser.add_argument('--model', default='DeepSeek')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0, help='压测时长（秒）')
+    parser.add_argument('--requests', type=int, default=None, help='总请求数（与时长先到者为准）')
+    parser.add_argument('--mix', default='speech=0.85,batch=0.05,models=0.10', help='端点权重')
+    parser.add_argument('--text-mix', default=DEFAULT_TEXT_MIX, help='文本长度分布 name=权重:最短-最长')
+    parser.add_argument('--stream', action='store_true', help='语音请求使用流式返回')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default=None, help='结果 JSON 输出文件（默认输出到 stdout）')
+    args = parser.parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+    generator = LoadGenerator(
+        args.target, args.api_key, model=args.model, mix=parse_mix(args.mix),
+        text_mix=parse_text_mix(args.text_mix), stream=args.stream
+    )
+    report = generator.run(concurrency=args.concurrency, duration=args.duration, requests=args.requests)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
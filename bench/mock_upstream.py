@@ -0,0 +1,179 @@
+# bench/mock_upstream.py - 本地模拟 bot.n.cn 上游，用于压测
+"""
+用法:
+    python -m bench.mock_upstream --port 9100 --latency lognormal:0.0,0.5 --error-rate 0.01
+
+然后让服务指向模拟上游（建议使用独立的缓存目录）:
+    NANOAI_BASE_URL=http://127.0.0.1:9100 CACHE_DIR=/tmp/nanoai-bench gunicorn app:app
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger('MockUpstream')
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, 立体声，无填充：每帧 417 字节，约 26 ms
+_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0x00])
+FRAME_SIZE = 417
+FRAME_DURATION = 1152 / 44100
+
+
+def make_mp3(num_bytes):
+    """生成指定大小（向上取整到整帧）的合法静音 MP3 帧序列"""
+    frames = max(1, -(-num_bytes // FRAME_SIZE))
+    return (_FRAME_HEADER + bytes(FRAME_SIZE - 4)) * frames
+
+
+class LatencyDistribution:
+    """
+    延迟分布（秒），格式:
+        fixed:0.8
+        uniform:0.5,1.5
+        normal:1.0,0.2
+        lognormal:mu,sigma   （exp(N(mu, sigma))，适合模拟长尾）
+    """
+
+    def __init__(self, spec):
+        kind, _, args = spec.partition(':')
+        self.kind = kind
+        self.args = [float(x) for x in args.split(',') if x]
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f"未知的延迟分布: {spec}")
+
+    def sample(self):
+        if self.kind == 'fixed':
+            value = self.args[0]
+        elif self.kind == 'uniform':
+            value = random.uniform(*self.args)
+        elif self.kind == 'normal':
+            value = random.gauss(*self.args)
+        else:
+            value = random.lognormvariate(*self.args)
+        return max(0.0, value)
+
+
+class MockUpstreamConfig:
+    def __init__(self, latency='lognormal:-0.2,0.4', ms_per_char=2.0, ttfb_fraction=0.3,
+                 error_rate=0.0, error_status=500, bytes_per_char=600, voices=20, chunk_size=8192):
+        self.latency = LatencyDistribution(latency)
+        self.ms_per_char = ms_per_char
+        self.ttfb_fraction = ttfb_fraction
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.bytes_per_char = bytes_per_char
+        self.voices = voices
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def robot_list(self):
+        items = [{'tag': 'DeepSeek', 'title': 'DeepSeek (默认)', 'icon': ''}]
+        items += [{'tag': f'voice{i}', 'title': f'模拟声音 {i}', 'icon': ''} for i in range(1, self.voices)]
+        return {'code': 0, 'data': {'list': items}}
+
+
+class MockUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None  # 由 make_server 注入
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/api/robot/platform':
+            self._send_json(200, self.config.robot_list())
+        else:
+            self._send_json(404, {'code': 404, 'message': 'not found'})
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        parts = urllib.parse.urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if parts.path != '/api/tts/v1':
+            self._send_json(404, {'code': 404, 'message': 'not found'})
+            return
+        config = self.config
+        form = urllib.parse.parse_qs(body.decode('utf-8'))
+        text = form.get('text', [''])[0]
+        with config._lock:
+            config.requests += 1
+            failed = random.random() < config.error_rate
+            config.errors += int(failed)
+        total_latency = config.latency.sample() + len(text) * config.ms_per_char / 1000
+        if failed:
+            time.sleep(total_latency * config.ttfb_fraction)
+            self._send_json(config.error_status, {'code': config.error_status, 'message': 'mock upstream error'})
+            return
+        audio = make_mp3(max(200, len(text) * config.bytes_per_char))
+        # 首字节前等待一部分延迟，其余延迟均匀分摊在各数据块之间，模拟流式输出
+        time.sleep(total_latency * config.ttfb_fraction)
+        chunks = [audio[i:i + config.chunk_size] for i in range(0, len(audio), config.chunk_size)]
+        gap = total_latency * (1 - config.ttfb_fraction) / max(1, len(chunks))
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.send_header('Content-Length', str(len(audio)))
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            if gap:
+                time.sleep(gap)
+
+
+def make_server(host='127.0.0.1', port=0, config=None):
+    """创建模拟上游服务器（port=0 时自动分配端口，可在测试中使用）"""
+    handler = type('ConfiguredHandler', (MockUpstreamHandler,), {'config': config or MockUpstreamConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地模拟 bot.n.cn 上游')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', default='lognormal:-0.2,0.4', help='基础延迟分布，如 fixed:0.8 / lognormal:-0.2,0.4')
+    parser.add_argument('--ms-per-char', type=float, default=2.0, help='每字符额外延迟（毫秒）')
+    parser.add_argument('--ttfb-fraction', type=float, default=0.3, help='首字节前消耗的延迟比例')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回错误的概率（0-1）')
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--bytes-per-char', type=int, default=600, help='每字符对应的 MP3 字节数')
+    parser.add_argument('--voices', type=int, default=20)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    config = MockUpstreamConfig(
+        latency=args.latency, ms_per_char=args.ms_per_char, ttfb_fraction=args.ttfb_fraction,
+        error_rate=args.error_rate, error_status=args.error_status,
+        bytes_per_char=args.bytes_per_char, voices=args.voices
+    )
+    server = make_server(args.host, args.port, config)
+    logger.info(f"模拟上游已启动: http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# bench/startup.py - 冷启动耗时基准：入口模块导入耗时与逐模块导入分析
+"""
+用法:
+    python -m bench.startup --module wsgi --module api.index --runs 5 --budget-ms 1000 --top 15
+
+每次在全新子进程中以 `python -X importtime` 导入入口模块，记录导入墙钟耗时（取中位数）
+和各模块的导入耗时（self/cumulative，单位毫秒）。导入耗时中位数超出 --budget-ms 时退出码为 1，
+可直接用作 CI 检查。
+
+子进程默认把上游地址指向不可达的本地端口、缓存目录指向临时目录，避免访问真实上游或写入工作目录。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', 1000))
+_PROBE = 'import time; t = time.perf_counter(); import {module}; print("IMPORT_SECONDS", time.perf_counter() - t)'
+
+
+def parse_importtime(stderr):
+    """
+    解析 -X importtime 输出
+    :return: [(模块名, self 毫秒, cumulative 毫秒, 嵌套深度)]
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        raw_name = fields[2].rstrip()
+        name = raw_name.lstrip()
+        depth = (len(raw_name) - len(name) - 1) // 2
+        rows.append((name, int(fields[0]) / 1000, int(fields[1]) / 1000, depth))
+    return rows
+
+
+def run_once(module, env):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE.format(module=module)],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    process_seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f'导入 {module} 失败:\n{proc.stderr[-2000:]}')
+    import_seconds = None
+    for line in proc.stdout.splitlines():
+        if line.startswith('IMPORT_SECONDS'):
+            import_seconds = float(line.split()[1])
+    return import_seconds, process_seconds, parse_importtime(proc.stderr)
+
+
+def profile(module, runs=5, top=15, env=None):
+    env = dict(os.environ if env is None else env)
+    env.setdefault('NANOAI_BASE_URL', 'http://127.0.0.1:9')
+    env.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='nanoai-startup-'))
+    import_times, process_times, modules = [], [], None
+    for _ in range(runs):
+        import_seconds, process_seconds, rows = run_once(module, env)
+        import_times.append(import_seconds)
+        process_times.append(process_seconds)
+        # 逐模块耗时取最后一次（.pyc 已生成，接近稳定的冷启动）
+        modules = rows
+    # 入口模块直接导入的包（深度 1），按累计耗时排序
+    direct = sorted((r for r in modules if r[3] == 1), key=lambda r: r[2], reverse=True)
+    by_self = sorted(modules, key=lambda r: r[1], reverse=True)
+    return {
+        'module': module,
+        'runs': runs,
+        'import_ms': {
+            'median': round(statistics.median(import_times) * 1000, 2),
+            'min': round(min(import_times) * 1000, 2),
+            'max': round(max(import_times) * 1000, 2),
+        },
+        'process_ms': {'median': round(statistics.median(process_times) * 1000, 2)},
+        'modules_imported': len(modules),
+        'top_cumulative_ms': [[name, round(cum, 2)] for name, _, cum, _ in direct[:top]],
+        'top_self_ms': [[name, round(own, 2)] for name, own, _, _ in by_self[:top]],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='入口模块冷启动耗时基准')
+    parser.add_argument('--module', action='append', help='入口模块（可重复），默认 wsgi 与 api.index')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='报告中列出的最慢模块数')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='导入耗时中位数预算（毫秒），超出时退出码为 1；0 表示不检查')
+    parser.add_argument('--output', default=None, help='结果 JSON 输出文件（默认输出到 stdout）')
+    args = parser.parse_args(argv)
+    results = [profile(module, runs=args.runs, top=args.top) for module in (args.module or ['wsgi', 'api.index'])]
+    over_budget = [r['module'] for r in results if args.budget_ms and r['import_ms']['median'] > args.budget_ms]
+    report = {'budget_ms': args.budget_ms, 'over_budget': over_budget, 'results': results}
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+    for module in over_budget:
+        sys.stderr.write(f'{module} 导入耗时超出预算 {args.budget_ms} ms\n')
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
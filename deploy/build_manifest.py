@@ -0,0 +1,59 @@
+# deploy/build_manifest.py - 构建时生成声音清单，打包进部署产物
+"""
+用法:
+    python -m deploy.build_manifest [--output deploy/voices.manifest.json] [--optional]
+
+冷启动时 NanoAITTS 直接读取该清单（无需请求上游），随后在后台用清单中记录的
+ETag/Last-Modified 向上游发起条件请求重新校验。
+"""
+import argparse
+import logging
+import os
+import sys
+
+from nano_tts import NanoAITTS
+from voice_registry import VoiceRegistry, dump_manifest, load_manifest
+
+
+def build(output, base_url=None):
+    engine = NanoAITTS(base_url, lazy=True)
+    # 不沿用旧清单的校验器，强制获取完整列表
+    engine._voices_etag = engine._voices_last_modified = None
+    engine.registry = VoiceRegistry({}, updated_at=0)
+    engine.load_voices(refresh=True)
+    if engine.voices_fallback:
+        raise RuntimeError("无法从上游获取声音列表")
+    payload = dump_manifest(
+        engine.registry,
+        source=f'{engine.base_url}/api/robot/platform',
+        etag=engine._voices_etag,
+        last_modified=engine._voices_last_modified,
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp_path = f'{output}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, output)
+    # 写入后立即回读校验
+    registry, _ = load_manifest(output)
+    return registry, len(payload)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成构建时声音清单')
+    parser.add_argument('--output', default=NanoAITTS.DEFAULT_MANIFEST_PATH)
+    parser.add_argument('--base-url', default=None, help='上游地址（默认取 NANOAI_BASE_URL）')
+    parser.add_argument('--optional', action='store_true', help='获取失败时保留已有清单并正常退出，不中断构建')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        registry, size = build(args.output, args.base_url)
+    except Exception as e:
+        sys.stderr.write(f'生成声音清单失败: {e}\n')
+        return 0 if args.optional else 1
+    sys.stdout.write(f'已写入 {args.output}: {len(registry)} 个声音, {size} 字节\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,7 @@
 # deploy/config.py - 统一部署配置
 import os
-from dotenv import load_dotenv
-load_dotenv()
+from utils.env import load_env
+load_env()
 class DeployConfig:
     # 基础配置
     PROJECT_NAME = "nanoai-tts"
@@ -0,0 +1,30 @@
+# gunicorn.conf.py - gunicorn 配置（与 Dockerfile 中的参数保持一致）
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5001)}"
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+accesslog = '-'
+errorlog = '-'
+
+# Prometheus 多进程模式：各 worker 把指标写入共享目录，/metrics 汇总所有 worker
+# 必须在 worker 导入 prometheus_client 之前设置，这里由 master 设置后被 worker 继承
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'nanoai-prometheus'))
+
+
+def on_starting(server):
+    # 清理上次运行遗留的指标文件，避免计数器从旧值继续累加
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,214 @@
+# hedging.py - 上游请求对冲：首次尝试迟迟没有首字节时并行发出第二次请求，先完成者胜出
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from upstream_client import RequestHandle
+from utils.metrics import HEDGED
+
+logger = logging.getLogger('Hedging')
+
+# 文本长度分桶边界（字符数）：合成耗时随长度增长，各桶分别统计延迟分布
+LENGTH_BUCKETS = (50, 200, 500)
+
+
+def length_bucket(length):
+    return bisect.bisect_left(LENGTH_BUCKETS, length)
+
+
+class LatencyTracker:
+    """按 key 保存最近的首字节耗时样本，估计分位数"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, seconds):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def quantile(self, key, q):
+        """样本不足 min_samples 时返回 None"""
+        with self._lock:
+            samples = self._samples.get(key)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self):
+        with self._lock:
+            return {f"{key[0]}:{key[1]}": len(samples) for key, samples in self._samples.items()}
+
+
+class HedgeBudget:
+    """令牌桶：每个请求存入 ratio 个令牌，每次对冲消耗 1 个，额外请求量不超过流量的 ratio"""
+
+    def __init__(self, ratio=0.05, burst=10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class _Attempt:
+    def __init__(self, future, handle, started):
+        self.future = future
+        self.handle = handle
+        self.started = started
+
+
+class Hedger:
+    def __init__(self, enabled=False, quantile=0.95, min_delay=0.2, budget=0.05, pool_size=64, tracker=None):
+        """
+        :param enabled: 是否启用对冲（关闭时仍统计延迟样本）
+        :param quantile: 对冲阈值取该分位的首字节耗时
+        :param min_delay: 阈值下限（秒），避免对快速请求对冲
+        :param budget: 对冲请求占总请求的比例上限
+        :param pool_size: 执行尝试的线程池大小
+        """
+        self.enabled = enabled
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.tracker = tracker or LatencyTracker()
+        self.budget = HedgeBudget(ratio=budget)
+        self.pool_size = pool_size
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        self.budget_exhausted = 0
+        self.no_capacity = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv('HEDGE_ENABLED', 'false').lower() == 'true',
+            quantile=float(os.getenv('HEDGE_QUANTILE', 0.95)),
+            min_delay=float(os.getenv('HEDGE_MIN_DELAY', 0.2)),
+            budget=float(os.getenv('HEDGE_BUDGET', 0.05)),
+        )
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='hedge')
+        return self._executor
+
+    def threshold(self, key):
+        """对冲等待阈值（秒），样本不足时返回 None（不对冲）"""
+        estimate = self.tracker.quantile(key, self.quantile)
+        return None if estimate is None else max(self.min_delay, estimate)
+
+    def _observe(self, key, handle):
+        if handle.ttfb is not None and not handle.cancelled:
+            self.tracker.observe(key, handle.ttfb)
+
+    def _launch(self, attempt, key, permit=None):
+        handle = RequestHandle()
+
+        def run():
+            try:
+                return attempt(handle)
+            finally:
+                self._observe(key, handle)
+                if permit is not None:
+                    # 对冲请求可能被中止，耗时不作为延迟样本
+                    permit.release(sample=False)
+
+        return _Attempt(self.executor.submit(run), handle, time.perf_counter())
+
+    def run(self, attempt, key, acquire=None):
+        """
+        执行 attempt(handle)（一次完整的上游请求），必要时对冲
+        :param key: 延迟统计分组，如 (voice, length_bucket)
+        :param acquire: 为对冲请求非阻塞地获取准入名额的函数，返回 Permit 或 None（无空闲名额时不对冲），
+            使对冲请求同样计入上游并发上限
+        """
+        with self._stats_lock:
+            self.requests += 1
+        self.budget.deposit()
+        threshold = self.threshold(key) if self.enabled else None
+        if threshold is None:
+            handle = RequestHandle()
+            try:
+                return attempt(handle)
+            finally:
+                self._observe(key, handle)
+
+        primary = self._launch(attempt, key)
+        if primary.handle.first_byte.wait(threshold) or primary.future.done():
+            return primary.future.result()
+        permit = acquire() if acquire is not None else None
+        if acquire is not None and permit is None:
+            with self._stats_lock:
+                self.no_capacity += 1
+            HEDGED.labels('no_capacity').inc()
+            return primary.future.result()
+        if not self.budget.try_spend():
+            if permit is not None:
+                permit.release(sample=False)
+            with self._stats_lock:
+                self.budget_exhausted += 1
+            HEDGED.labels('budget_exhausted').inc()
+            return primary.future.result()
+
+        with self._stats_lock:
+            self.fired += 1
+        HEDGED.labels('fired').inc()
+        logger.debug(f"首字节超过 {threshold:.2f}s，发出对冲请求: {key}")
+        hedge = self._launch(attempt, key, permit)
+        pending = {primary.future: primary, hedge.future: hedge}
+        errors = []
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                winner = pending.pop(future)
+                if future.exception() is not None:
+                    errors.append((winner is primary, future.exception()))
+                    continue
+                # 先成功者胜出，中止另一次尝试
+                for loser in pending.values():
+                    loser.handle.cancel()
+                if winner is hedge:
+                    with self._stats_lock:
+                        self.won += 1
+                    HEDGED.labels('won').inc()
+                return future.result()
+        # 两次都失败时优先抛出首次尝试的错误
+        errors.sort(key=lambda item: not item[0])
+        raise errors[0][1]
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "enabled": self.enabled,
+                "requests": self.requests,
+                "fired": self.fired,
+                "won": self.won,
+                "budget_exhausted": self.budget_exhausted,
+                "no_capacity": self.no_capacity,
+            }
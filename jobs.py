@@ -0,0 +1,389 @@
+# jobs.py - 异步批量合成任务引擎（SQLite 持久化 + 工作线程池）
+import json
+import logging
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from admission import BATCH, Overloaded, tenant_id
+from resilience import UpstreamUnavailable
+
+logger = logging.getLogger('JobManager')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    model TEXT NOT NULL,
+    params TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    size INTEGER,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    finished_at REAL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    capacity REAL NOT NULL,
+    heartbeat REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_until);
+CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires_at);
+"""
+
+# 单个条目失败重试次数上限（含首次）
+MAX_ATTEMPTS = 3
+# 各进程在 workers 表登记处理能力的间隔（秒），超过 3 个间隔未更新视为已退出
+HEARTBEAT_INTERVAL = 30
+# 过期任务清理间隔（秒）
+PURGE_INTERVAL = 600
+
+
+def owner_id(api_key):
+    """任务归属：只保存 API 密钥的摘要（与准入控制的租户标识一致）"""
+    return tenant_id(api_key)
+
+
+class JobManager:
+    def __init__(self, tts_engine, base_dir, workers=4, result_ttl=24 * 3600, lease_seconds=300, poll_interval=1.0,
+                 long_text=None):
+        """
+        :param tts_engine: NanoAITTS 实例
+        :param long_text: LongTextSynthesizer，超过上游单次长度上限的条目分段合成，而不是被截断
+        :param base_dir: 任务数据库与结果音频目录，多个 gunicorn worker 共享
+        :param workers: 本进程的任务工作线程数
+        :param result_ttl: 任务与结果音频保留时长（秒）
+        :param lease_seconds: 条目租约时长，持有条目的 worker 崩溃后条目会被重新领取
+        """
+        self.tts_engine = tts_engine
+        self.long_text = long_text
+        self.base_dir = base_dir
+        self.results_dir = os.path.join(base_dir, 'results')
+        self.db_path = os.path.join(base_dir, 'jobs.db')
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self.worker_id = f"{os.getpid()}-{os.urandom(4).hex()}"
+        os.makedirs(self.results_dir, exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    @classmethod
+    def from_env(cls, tts_engine, cache_dir, long_text=None):
+        base_dir = os.getenv('JOBS_DIR') or os.path.join(cache_dir, 'jobs')
+        kwargs = dict(
+            workers=int(os.getenv('JOB_WORKERS', 4)),
+            result_ttl=int(os.getenv('JOB_RESULT_TTL', 24 * 3600)),
+            long_text=long_text,
+        )
+        try:
+            return cls(tts_engine, base_dir, **kwargs)
+        except (OSError, sqlite3.Error) as e:
+            # 只读文件系统回退到临时目录，仅适用于单实例部署（Serverless 环境不启用批量任务，见 api/index.py）
+            fallback = os.path.join(tempfile.gettempdir(), 'nanoai-jobs')
+            logger.warning(f"无法使用任务目录 {base_dir}: {str(e)}，改用 {fallback}")
+            return cls(tts_engine, fallback, **kwargs)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        if self._threads:
+            return
+        self._heartbeat()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work_loop, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        janitor = threading.Thread(target=self._janitor_loop, name='job-janitor', daemon=True)
+        janitor.start()
+        self._threads.append(janitor)
+        logger.info(f"批量任务引擎已启动，工作线程: {self.workers}，数据目录: {self.base_dir}")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        try:
+            self._connect().execute('DELETE FROM workers WHERE id = ?', (self.worker_id,))
+        except sqlite3.Error:
+            pass
+
+    # --- 提交与查询 ---
+    def submit(self, texts, model, params, owner):
+        job_id = f"batch_{int(time.time())}_{random.randint(1000, 9999)}{os.urandom(2).hex()}"
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT INTO jobs (id, owner, model, params, total, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, owner, model, json.dumps(params), len(texts), now, now + self.result_ttl)
+            )
+            conn.executemany(
+                "INSERT INTO items (job_id, idx, text, status) VALUES (?, ?, ?, 'queued')",
+                [(job_id, i, text) for i, text in enumerate(texts)]
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._wakeup.set()
+        logger.info(f"创建批量任务: {job_id}, 文本数量: {len(texts)}")
+        return job_id
+
+    def get(self, job_id, owner):
+        """返回任务详情；任务不存在、已过期或不属于该密钥时返回 None"""
+        conn = self._connect()
+        job = conn.execute(
+            'SELECT * FROM jobs WHERE id = ? AND owner = ? AND expires_at > ?', (job_id, owner, time.time())
+        ).fetchone()
+        if job is None:
+            return None
+        items = conn.execute(
+            'SELECT idx, text, status, error, size FROM items WHERE job_id = ? ORDER BY idx', (job_id,)
+        ).fetchall()
+        counts = {'queued': 0, 'running': 0, 'completed': 0, 'failed': 0}
+        results = []
+        pending = []
+        for item in items:
+            counts[item['status']] += 1
+            if item['status'] in ('queued', 'running'):
+                pending.append(item['text'])
+            text = item['text']
+            result = {
+                "index": item['idx'],
+                "text": text[:50] + "..." if len(text) > 50 else text,
+                "status": item['status'],
+            }
+            if item['status'] == 'completed':
+                result["audio_url"] = f"/audio/{job_id}_{item['idx']}.mp3"
+                result["size"] = item['size']
+            elif item['status'] == 'failed':
+                result["error"] = item['error']
+            results.append(result)
+        finished = counts['completed'] + counts['failed']
+        if finished == job['total']:
+            status = 'failed' if counts['completed'] == 0 else ('completed' if counts['failed'] == 0 else 'partial')
+        else:
+            status = 'running' if finished or counts['running'] else 'queued'
+        return {
+            "task_id": job_id,
+            "status": status,
+            "model": job['model'],
+            "total": job['total'],
+            "progress": round(finished / job['total'], 4) if job['total'] else 1.0,
+            "counts": counts,
+            "estimated_time": self.estimate_seconds(job['model'], json.loads(job['params']), pending) if pending else 0,
+            "created_at": int(job['created_at']),
+            "expires_at": int(job['expires_at']),
+            "results": results,
+        }
+
+    def result_path(self, job_id, index, owner):
+        """已完成条目的音频文件路径，不可访问时返回 None"""
+        row = self._connect().execute(
+            "SELECT 1 FROM jobs JOIN items ON items.job_id = jobs.id "
+            "WHERE jobs.id = ? AND jobs.owner = ? AND jobs.expires_at > ? AND items.idx = ? AND items.status = 'completed'",
+            (job_id, owner, time.time(), index)
+        ).fetchone()
+        if row is None:
+            return None
+        path = self._result_file(job_id, index)
+        return path if os.path.exists(path) else None
+
+    def _result_file(self, job_id, index):
+        return os.path.join(self.results_dir, job_id, f"{index}.mp3")
+
+    def queue_depth(self):
+        row = self._connect().execute("SELECT COUNT(*) FROM items WHERE status = 'queued'").fetchone()
+        return row[0]
+
+    def capacity(self):
+        """本进程可并行处理的条目数：工作线程数，且不超过准入控制留给批量任务的名额"""
+        return min(self.workers, self.tts_engine.admission.batch_capacity())
+
+    def cluster_capacity(self):
+        """共享同一数据库的所有进程的处理能力之和（来自 workers 表的心跳）"""
+        row = self._connect().execute(
+            'SELECT SUM(capacity) FROM workers WHERE heartbeat >= ?', (time.time() - 3 * HEARTBEAT_INTERVAL,)
+        ).fetchone()
+        return row[0] or self.capacity()
+
+    def estimate_seconds(self, model, params, texts):
+        """
+        按延迟模型估计合成 texts 还需要的时间（秒）：
+        条目按租户轮流领取，有 n 个租户同时排队时本任务约占 1/n 的处理能力
+        """
+        speed = params.get('speed', 1.0)
+        work = sum(self.tts_engine.latency_model.predict(model, len(text), speed) for text in texts)
+        row = self._connect().execute(
+            "SELECT COUNT(DISTINCT jobs.owner) FROM items JOIN jobs ON jobs.id = items.job_id "
+            "WHERE items.status IN ('queued', 'running')"
+        ).fetchone()
+        return math.ceil(work * max(1, row[0]) / max(1.0, self.cluster_capacity()))
+
+    # --- 工作线程 ---
+    def _claim(self):
+        """
+        原子领取一个排队条目（或租约已过期的条目），多个进程共享同一数据库
+        优先领取正在执行条目最少的租户，一个租户的大批量任务不会让其他租户的任务一直排在后面
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT items.job_id, items.idx, items.text, items.attempts, jobs.model, jobs.params, jobs.owner "
+                "FROM items JOIN jobs ON jobs.id = items.job_id "
+                "WHERE items.status = 'queued' OR (items.status = 'running' AND items.lease_until < ?) "
+                "ORDER BY (SELECT COUNT(*) FROM items AS running JOIN jobs AS owned ON owned.id = running.job_id "
+                "WHERE running.status = 'running' AND running.lease_until >= ? AND owned.owner = jobs.owner), "
+                "jobs.created_at, items.idx LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE items SET status = 'running', lease_until = ?, attempts = attempts + 1 "
+                    "WHERE job_id = ? AND idx = ?",
+                    (now + self.lease_seconds, row['job_id'], row['idx'])
+                )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return row
+
+    def _finish(self, job_id, index, status, size=None, error=None):
+        self._connect().execute(
+            'UPDATE items SET status = ?, size = ?, error = ?, lease_until = NULL, finished_at = ? '
+            'WHERE job_id = ? AND idx = ?',
+            (status, size, error, time.time(), job_id, index)
+        )
+
+    def _requeue(self, job_id, index):
+        self._connect().execute(
+            "UPDATE items SET status = 'queued', lease_until = NULL, attempts = attempts - 1 "
+            "WHERE job_id = ? AND idx = ?",
+            (job_id, index)
+        )
+
+    def _process(self, item):
+        job_id, index = item['job_id'], item['idx']
+        params = json.loads(item['params'])
+        logger.info(f"处理批量任务 {job_id} 的第 {index + 1} 段文本")
+        try:
+            if self.long_text is not None and len(item['text']) > self.tts_engine.MAX_TEXT_LENGTH:
+                audio_data = self.long_text.synthesize(
+                    item['text'], item['model'], tenant=item['owner'], priority=BATCH, **params
+                )
+            else:
+                audio_data = self.tts_engine.get_audio(
+                    item['text'], voice=item['model'], tenant=item['owner'], priority=BATCH, **params
+                )
+        except (UpstreamUnavailable, Overloaded) as e:
+            # 熔断或准入拒绝时不消耗重试次数：放回队列，本线程等待建议的时长后再领取
+            self._requeue(job_id, index)
+            logger.warning(f"批量任务 {job_id} 第 {index + 1} 段暂时无法执行，放回队列: {str(e)}")
+            self._stop.wait(e.retry_after)
+            return
+        except Exception as e:
+            if item['attempts'] + 1 < MAX_ATTEMPTS and not isinstance(e, ValueError) and getattr(e, 'retryable', True):
+                # 释放条目等待重试
+                self._finish(job_id, index, 'queued', error=str(e))
+            else:
+                self._finish(job_id, index, 'failed', error=str(e))
+            logger.warning(f"批量任务 {job_id} 第 {index + 1} 段失败: {str(e)}")
+            return
+        path = self._result_file(job_id, index)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(audio_data)
+        os.replace(tmp_path, path)
+        self._finish(job_id, index, 'completed', size=len(audio_data))
+
+    def _work_loop(self):
+        while not self._stop.is_set():
+            try:
+                item = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"领取批量任务失败: {str(e)}", exc_info=True)
+                item = None
+            if item is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self._process(item)
+            except Exception as e:
+                logger.error(f"批量任务条目处理异常: {str(e)}", exc_info=True)
+
+    def _heartbeat(self):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO workers (id, capacity, heartbeat) VALUES (?, ?, ?)',
+            (self.worker_id, self.capacity(), now)
+        )
+        conn.execute('DELETE FROM workers WHERE heartbeat < ?', (now - 3 * HEARTBEAT_INTERVAL,))
+
+    def _janitor_loop(self):
+        last_purge = time.monotonic()
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                self._heartbeat()
+            except sqlite3.Error as e:
+                logger.error(f"更新批量任务心跳失败: {str(e)}", exc_info=True)
+            if time.monotonic() - last_purge < PURGE_INTERVAL:
+                continue
+            last_purge = time.monotonic()
+            try:
+                self.purge_expired()
+            except Exception as e:
+                logger.error(f"清理过期批量任务失败: {str(e)}", exc_info=True)
+
+    def purge_expired(self):
+        """删除过期任务及其结果音频"""
+        conn = self._connect()
+        expired = [row[0] for row in conn.execute('SELECT id FROM jobs WHERE expires_at <= ?', (time.time(),))]
+        for job_id in expired:
+            job_dir = os.path.join(self.results_dir, job_id)
+            if os.path.isdir(job_dir):
+                for name in os.listdir(job_dir):
+                    try:
+                        os.remove(os.path.join(job_dir, name))
+                    except OSError:
+                        pass
+                try:
+                    os.rmdir(job_dir)
+                except OSError:
+                    pass
+            conn.execute('DELETE FROM items WHERE job_id = ?', (job_id,))
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        if expired:
+            logger.info(f"已清理 {len(expired)} 个过期批量任务")
+        return len(expired)
@@ -0,0 +1,138 @@
+# latency_model.py - 上游合成耗时的在线预测：按声音对文本长度做线性回归（带遗忘的递推最小二乘），
+# 用于准入控制的短作业优先排序、排队等待估计（Retry-After）与批量任务的 estimated_time
+import math
+import os
+import threading
+
+# 特征尺度：文本长度以 100 字符为单位，避免各维数值相差过大
+_CHARS_UNIT = 100.0
+
+
+def features(chars, speed=1.0):
+    """[常数项, 文本长度, 文本长度 × 语速修正]：语速为 1 时第三项为 0，语速越慢音频越长"""
+    length = chars / _CHARS_UNIT
+    try:
+        speed = float(speed)
+    except (TypeError, ValueError):
+        speed = 1.0
+    if not math.isfinite(speed) or speed <= 0:
+        speed = 1.0
+    return [1.0, length, length * (1.0 / max(0.1, speed) - 1.0)]
+
+
+class OnlineRegression:
+    """递推最小二乘（RLS）：每个样本 O(n²) 更新，forgetting < 1 时旧样本权重指数衰减，能跟上上游性能变化"""
+
+    def __init__(self, prior, forgetting=0.995, confidence=10.0):
+        """
+        :param prior: 初始系数（无样本时的预测）
+        :param confidence: 初始协方差，越大越快被样本覆盖；协方差的迹不会超过 n × confidence
+        """
+        n = len(prior)
+        self.theta = list(prior)
+        self.forgetting = forgetting
+        self.max_trace = n * confidence
+        self.p = [[confidence if i == j else 0.0 for j in range(n)] for i in range(n)]
+        self.samples = 0
+
+    def predict(self, x):
+        return sum(t * v for t, v in zip(self.theta, x))
+
+    def update(self, x, y):
+        """
+        更新系数；分母非正或结果非有限时丢弃该样本，返回是否被采纳
+        没有样本覆盖的方向（如语速恒为 1 时的第三个特征）上，遗忘会让协方差按 1/forgetting 无限增长，
+        最终数值溢出，因此每次更新后把协方差的迹限制在 max_trace 以内
+        """
+        if not math.isfinite(y):
+            return False
+        n = len(x)
+        px = [sum(self.p[i][j] * x[j] for j in range(n)) for i in range(n)]
+        denom = self.forgetting + sum(x[i] * px[i] for i in range(n))
+        if not math.isfinite(denom) or denom <= 0:
+            return False
+        gain = [v / denom for v in px]
+        error = y - self.predict(x)
+        theta = [self.theta[i] + gain[i] * error for i in range(n)]
+        p = [[(self.p[i][j] - gain[i] * px[j]) / self.forgetting for j in range(n)] for i in range(n)]
+        # 对称化，抵消浮点误差的累积
+        p = [[(p[i][j] + p[j][i]) / 2 for j in range(n)] for i in range(n)]
+        trace = sum(p[i][i] for i in range(n))
+        if not all(math.isfinite(v) for v in theta) or not math.isfinite(trace) or trace <= 0:
+            return False
+        if trace > self.max_trace:
+            scale = self.max_trace / trace
+            p = [[v * scale for v in row] for row in p]
+        self.theta = theta
+        self.p = p
+        self.samples += 1
+        return True
+
+
+class LatencyModel:
+    def __init__(self, base_seconds=1.0, seconds_per_char=0.005, forgetting=0.995, min_samples=10,
+                 max_voices=256, floor=0.05, ceiling=120.0):
+        """
+        :param base_seconds: 先验的固定耗时（秒），尚无样本时使用
+        :param seconds_per_char: 先验的每字符耗时（秒）
+        :param min_samples: 单个声音的样本数达到该值后才使用该声音自己的模型，之前使用全局模型
+        :param max_voices: 单独建模的声音数量上限
+        :param floor: 预测值下限（秒）
+        :param ceiling: 预测值上限（秒），也是接受的观测值上限
+        """
+        self.prior = [base_seconds, seconds_per_char * _CHARS_UNIT, seconds_per_char * _CHARS_UNIT]
+        self.forgetting = forgetting
+        self.min_samples = min_samples
+        self.max_voices = max_voices
+        self.floor = floor
+        self.ceiling = ceiling
+        self._global = OnlineRegression(self.prior, forgetting)
+        self._voices = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            base_seconds=float(os.getenv('LATENCY_PRIOR_SECONDS', 1.0)),
+            seconds_per_char=float(os.getenv('LATENCY_PRIOR_PER_CHAR', 0.005)),
+            floor=float(os.getenv('LATENCY_MIN_SECONDS', 0.05)),
+            ceiling=float(os.getenv('LATENCY_MAX_SECONDS', 120)),
+        )
+
+    def _model_for(self, voice):
+        model = self._voices.get(voice)
+        if model is not None and model.samples >= self.min_samples:
+            return model
+        return self._global
+
+    def predict(self, voice, chars, speed=1.0):
+        """预计的上游合成耗时（秒）"""
+        x = features(chars, speed)
+        with self._lock:
+            estimate = self._model_for(voice).predict(x)
+        if not math.isfinite(estimate):
+            return self.ceiling
+        return min(self.ceiling, max(self.floor, estimate))
+
+    def observe(self, voice, chars, speed, seconds):
+        if not math.isfinite(seconds) or seconds <= 0 or seconds > self.ceiling:
+            return
+        x = features(chars, speed)
+        with self._lock:
+            self._global.update(x, seconds)
+            model = self._voices.get(voice)
+            if model is None and len(self._voices) < self.max_voices:
+                # 新声音从全局模型的当前系数开始学习
+                model = self._voices[voice] = OnlineRegression(self._global.theta, self.forgetting)
+            if model is not None:
+                model.update(x, seconds)
+
+    def stats(self):
+        with self._lock:
+            theta = self._global.theta
+            return {
+                "samples": self._global.samples,
+                "voices": len(self._voices),
+                "base_seconds": round(theta[0], 3),
+                "seconds_per_100_chars": round(theta[1], 3),
+            }
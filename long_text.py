@@ -0,0 +1,138 @@
+# long_text.py - 长文本分段并行合成
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import mp3_frames
+from admission import SEGMENT
+from text_processor import TextProcessor
+
+logger = logging.getLogger('LongTextSynthesizer')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """进程内共享的分段合成线程池（gunicorn 每个 worker 各一个）"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('SYNTH_POOL_SIZE', 16)),
+                    thread_name_prefix='synth'
+                )
+    return _executor
+
+
+def executor_stats():
+    """共享线程池的占用情况：排队数持续大于 0 说明分段合成已饱和"""
+    executor = _executor
+    if executor is None:
+        return {"max_workers": int(os.getenv('SYNTH_POOL_SIZE', 16)), "threads": 0, "queued": 0}
+    return {
+        "max_workers": executor._max_workers,
+        "threads": len(executor._threads),
+        "queued": executor._work_queue.qsize(),
+    }
+
+
+class LongTextSynthesizer:
+    def __init__(self, tts_engine, processor=None, executor=None, fanout=None):
+        """
+        :param tts_engine: NanoAITTS 实例
+        :param processor: 文本分段/音频合并工具
+        :param executor: 共享线程池，默认使用 get_executor()
+        :param fanout: 单个请求同时在途的分段数上限
+        """
+        self.tts_engine = tts_engine
+        self.processor = processor or TextProcessor(
+            max_chunk_length=int(os.getenv('LONG_TEXT_SEGMENT_LENGTH', 200))
+        )
+        self._executor = executor
+        self.fanout = max(1, fanout or int(os.getenv('LONG_TEXT_FANOUT', 4)))
+
+    @property
+    def executor(self):
+        return self._executor or get_executor()
+
+    def synthesize_segments(self, segments, voice, speed=1.0, pitch=1.0, tenant=None, priority=SEGMENT):
+        """
+        并行合成各分段（最多 fanout 个同时在途），按原顺序返回音频列表
+        :param priority: 分段在准入队列中的类别，批量任务中的长条目使用 BATCH
+        """
+        results = [None] * len(segments)
+        pending = {}
+        next_index = 0
+        try:
+            while next_index < len(segments) or pending:
+                # 滑动窗口：补足在途分段
+                while next_index < len(segments) and len(pending) < self.fanout:
+                    future = self.executor.submit(
+                        self.tts_engine.get_audio, segments[next_index], voice=voice, speed=speed, pitch=pitch,
+                        tenant=tenant, priority=priority
+                    )
+                    pending[future] = next_index
+                    next_index += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    results[index] = future.result()
+        finally:
+            # 任一分段失败时取消尚未开始的分段
+            for future in pending:
+                future.cancel()
+        return results
+
+    def synthesize(self, text, voice, speed=1.0, pitch=1.0, tenant=None, priority=SEGMENT):
+        segments = self.processor.split_text(text)
+        if not segments:
+            raise ValueError("文本不能为空")
+        logger.info(f"长文本并行合成 - 模型: {voice}, 分段数: {len(segments)}, 并发: {min(self.fanout, len(segments))}")
+        audio_chunks = self.synthesize_segments(segments, voice, speed=speed, pitch=pitch, tenant=tenant,
+                                                priority=priority)
+        return self.processor.merge_audio(audio_chunks)
+
+    def stream(self, text, voice, speed=1.0, pitch=1.0, tenant=None):
+        """
+        渐进式输出：第一段合成完成即开始产出，后续分段在后台并行合成并按顺序释放
+        在途与已完成未输出的分段总数不超过 fanout，内存占用与文本长度无关
+        """
+        segments = self.processor.split_text(text)
+        if not segments:
+            raise ValueError("文本不能为空")
+        logger.info(f"长文本流式合成 - 模型: {voice}, 分段数: {len(segments)}, 并发: {min(self.fanout, len(segments))}")
+        pending = {}
+        ready = {}
+        next_index = 0
+        emit_index = 0
+        try:
+            while emit_index < len(segments):
+                while next_index < len(segments) and len(pending) + len(ready) < self.fanout:
+                    future = self.executor.submit(
+                        self.tts_engine.get_audio, segments[next_index], voice=voice, speed=speed, pitch=pitch,
+                        tenant=tenant, priority=SEGMENT
+                    )
+                    pending[future] = next_index
+                    next_index += 1
+                if emit_index in ready:
+                    yield self._frames_for_stream(ready.pop(emit_index), first=emit_index == 0)
+                    emit_index += 1
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ready[pending.pop(future)] = future.result()
+        finally:
+            # 客户端断开或分段失败时取消尚未开始的分段
+            for future in pending:
+                future.cancel()
+
+    @staticmethod
+    def _frames_for_stream(audio, first):
+        """去掉各段的 Xing/Info 帧（其时长只描述单段），第一段之外同时去掉 ID3 标签"""
+        try:
+            tag, frames, _ = mp3_frames.parse(audio)
+        except mp3_frames.Mp3FormatError:
+            return audio
+        return (tag + bytes(frames)) if first else bytes(frames)
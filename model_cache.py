@@ -0,0 +1,115 @@
+# model_cache.py - 模型列表缓存（stale-while-revalidate）
+import logging
+import random
+import threading
+import time
+from utils.metrics import time_stage
+
+
+class ModelCache:
+    def __init__(self, tts_engine, ttl=2 * 60 * 60, min_backoff=30, max_backoff=None):
+        """
+        :param tts_engine: NanoAITTS 实例
+        :param ttl: 模型列表有效期（秒），过期后在后台刷新，期间继续返回旧列表
+        :param min_backoff: 刷新失败后的首次重试间隔（秒），之后指数增长
+        :param max_backoff: 重试间隔上限（秒），默认等于 ttl
+        """
+        self._tts_engine = tts_engine
+        self.ttl = ttl
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff or ttl
+        self._registry = tts_engine.registry
+        self._next_refresh = 0
+        self._failures = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger('ModelCache')
+        self._publish()
+        if not tts_engine.ready:
+            # 引擎以 lazy 模式创建且没有本地缓存文件：立即在后台加载
+            self._trigger_refresh()
+
+    @property
+    def last_updated(self):
+        return self._registry.updated_at
+
+    @property
+    def ready(self):
+        return self._tts_engine.ready
+
+    @property
+    def state(self):
+        """warming：首次加载未完成；degraded：仅有默认声音；ready：正常"""
+        if not self.ready:
+            return "warming"
+        return "degraded" if self._registry.fallback else "ready"
+
+    @property
+    def registry(self):
+        """当前声音列表快照（VoiceRegistry），过期时触发后台刷新"""
+        if time.time() >= self._next_refresh:
+            self._trigger_refresh()
+        return self._registry
+
+    def _publish(self):
+        """切换到引擎当前的声音列表快照"""
+        registry = self._tts_engine.registry
+        self._registry = registry
+        if registry.fallback:
+            # 仅有默认声音（初始加载失败）时尽快重试
+            self._next_refresh = time.time() + self.min_backoff
+        else:
+            # 从磁盘缓存文件加载时以文件修改时间为准，旧文件会尽快触发刷新
+            self._next_refresh = registry.updated_at + self.ttl
+
+    def get_models(self):
+        """始终立即返回当前快照；过期时触发一次后台刷新，不阻塞调用方"""
+        with time_stage('get_models'):
+            return self.registry.names
+
+    def _trigger_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='model-cache-refresh', daemon=True).start()
+
+    def _refresh(self):
+        self.logger.info("正在后台刷新模型列表..." if self.ready else "正在后台加载模型列表...")
+        try:
+            self._tts_engine.load_voices(refresh=True)
+            self._publish()
+            self._failures = 0
+            self.logger.info(
+                f"模型列表刷新成功，共找到 {len(self._registry)} 个模型（版本 {self._registry.version}）。"
+            )
+        except Exception as e:
+            self._failures += 1
+            backoff = min(self.max_backoff, self.min_backoff * 2 ** (self._failures - 1))
+            # 加入抖动，避免多个 worker 同时重试
+            backoff *= random.uniform(0.8, 1.2)
+            self._next_refresh = time.time() + backoff
+            self.logger.error(
+                f"刷新模型列表失败（第 {self._failures} 次），继续使用旧列表，{backoff:.0f} 秒后重试: {str(e)}"
+            )
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def refresh_now(self):
+        """同步刷新（用于启动预热）"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        self._refresh()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "models": len(self._registry),
+            "version": self._registry.version,
+            "age_seconds": int(time.time() - self._registry.updated_at),
+            "refreshing": self._refreshing,
+            "consecutive_failures": self._failures,
+        }
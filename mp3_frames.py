@@ -0,0 +1,133 @@
+# mp3_frames.py - MP3 帧级拼接（无需解码/重新编码）
+import logging
+
+logger = logging.getLogger('Mp3Frames')
+
+# 比特率表（kbps），按 (MPEG1?, layer) 索引
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# 采样率表，按版本位索引：0=MPEG2.5, 2=MPEG2, 3=MPEG1
+_SAMPLE_RATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+
+
+class Mp3FormatError(ValueError):
+    """无法按帧解析，或各段编码参数不一致，需要回退到解码合并"""
+
+
+def _parse_header(data, offset):
+    """解析 offset 处的帧头，返回 (帧长度, 格式元组, 是否带 CRC)，无效时返回 None"""
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset], data[offset + 1], data[offset + 2], data[offset + 3]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer_bits = (b1 >> 1) & 0x03
+    bitrate_index = b2 >> 4
+    sample_index = (b2 >> 2) & 0x03
+    if version == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_index == 3:
+        return None
+    layer = 4 - layer_bits
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_index]
+    padding = (b2 >> 1) & 0x01
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and not mpeg1:
+        length = 72 * bitrate // sample_rate + padding
+    else:
+        length = 144 * bitrate // sample_rate + padding
+    channel_mode = b3 >> 6
+    fmt = (version, layer, sample_rate, channel_mode == 3)
+    return length, fmt, not (b1 & 0x01)
+
+
+def _id3v2_size(data):
+    if len(data) >= 10 and data[:3] == b'ID3':
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def _is_vbr_header_frame(data, offset, fmt, has_crc):
+    """首帧是否为 Xing/Info/VBRI 信息帧（不含音频，记录的时长仅对单段有效）"""
+    version, _, _, mono = fmt
+    if version == 3:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    xing_at = offset + 4 + (2 if has_crc else 0) + side_info
+    if data[xing_at:xing_at + 4] in (b'Xing', b'Info'):
+        return True
+    return data[offset + 36:offset + 40] == b'VBRI'
+
+
+def parse(data):
+    """
+    定位音频帧区间
+    :return: (ID3v2 标签字节, 帧数据 memoryview, 格式元组)
+    """
+    view = memoryview(data)
+    tag_end = _id3v2_size(data)
+    offset = tag_end
+    # 跳过标签后的填充/杂散字节，寻找第一个后面紧跟有效帧的同步字
+    first = None
+    limit = min(len(data), tag_end + 64 * 1024)
+    while offset < limit:
+        header = _parse_header(data, offset)
+        if header:
+            length = header[0]
+            following = offset + length
+            if following >= len(data) or _parse_header(data, following):
+                first = header
+                break
+        offset += 1
+    if first is None:
+        raise Mp3FormatError("未找到有效的 MP3 帧")
+
+    length, fmt, has_crc = first
+    start = offset
+    if _is_vbr_header_frame(data, offset, fmt, has_crc):
+        start = offset + length
+    offset += length
+    # 逐帧前进，直到数据结束或遇到非帧数据（如 ID3v1/APE 尾部标签）
+    while offset < len(data):
+        header = _parse_header(data, offset)
+        if not header or header[1][:3] != fmt[:3]:
+            break
+        offset += header[0]
+    end = min(offset, len(data))
+    return bytes(view[:tag_end]), view[start:end], fmt
+
+
+def strip_headers(data):
+    """去除 ID3 标签和 Xing/Info 信息帧，只保留音频帧"""
+    _, frames, _ = parse(data)
+    return bytes(frames)
+
+
+def concat(segments):
+    """
+    按帧拼接同一编码器输出的多段 MP3
+    保留第一段的 ID3v2 标签；所有段的 Xing/Info 帧都会去除，因为其中的帧数和时长只描述单段
+    """
+    if not segments:
+        raise ValueError("音频片段列表为空")
+    parsed = [parse(segment) for segment in segments]
+    fmt = parsed[0][2]
+    for index, (_, _, segment_fmt) in enumerate(parsed[1:], start=2):
+        if segment_fmt != fmt:
+            raise Mp3FormatError(f"第{index}段音频编码参数不一致: {segment_fmt} != {fmt}")
+    return parsed[0][0] + b''.join(frames for _, frames, _ in parsed)
@@ -1,5 +1,5 @@
 # nano_tts.py - TTS引擎实现
-import urllib.request
+import http.client
 import urllib.parse
 import hashlib
 import json
@@ -7,20 +7,73 @@ import os
 import logging
 from datetime import datetime
 import random
+import threading
 import time
+from audio_cache import AudioCache
+from upstream_client import UpstreamPool, classify_error, status_error_type
+from utils.metrics import time_stage, upstream_error
+from singleflight import SingleFlight
+from voice_registry import VoiceRegistry, load_manifest
+from hedging import Hedger, length_bucket
+from resilience import UpstreamError, UpstreamResilience, is_overload
+from admission import AdmissionController, INTERACTIVE
+from latency_model import LatencyModel
 class NanoAITTS:
-    def __init__(self):
+    # 上游单次合成支持的最大文本长度
+    MAX_TEXT_LENGTH = 1000
+    DEFAULT_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deploy', 'voices.manifest.json')
+    
+    def __init__(self, base_url=None, lazy=False):
+        """
+        :param base_url: 上游地址，默认取 NANOAI_BASE_URL（压测时可指向本地模拟上游）
+        :param lazy: True 时构造函数不访问网络，只读取本地缓存的声音列表；
+                     网络加载由调用方在后台完成（见 ModelCache），加载前处于 warming 状态
+        """
+        self.base_url = (base_url or os.getenv('NANOAI_BASE_URL', 'https://bot.n.cn')).rstrip('/')
         self.name = '纳米AI'
         self.id = 'bot.n.cn'
         self.author = 'TTS Server'
         self.icon_url = 'https://bot.n.cn/favicon.ico'
         self.version = 2
         self.ua = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36"
-        self.voices = {}
+        # 声音列表快照，刷新时整体替换引用（读取无需加锁）
+        self.registry = VoiceRegistry({}, updated_at=0)
+        self._voices_etag = None
+        self._voices_last_modified = None
         self.logger = logging.getLogger('NanoAITTS')
         self.cache_dir = os.getenv('CACHE_DIR', 'cache')
+        # 构建时生成的声音清单（见 deploy/build_manifest.py），只读文件系统上也能免网络冷启动
+        self.manifest_path = os.getenv('VOICE_MANIFEST', self.DEFAULT_MANIFEST_PATH)
         self.cache_enabled = self._ensure_cache_dir()
-        self.load_voices()
+        self.audio_cache = AudioCache.from_env(self.cache_dir) if self.cache_enabled else None
+        self.http = UpstreamPool.from_env()
+        self.flights = SingleFlight.from_env(self.cache_dir if self.cache_enabled else None)
+        self.hedger = Hedger.from_env()
+        self.resilience = UpstreamResilience.from_env()
+        self.admission = AdmissionController.from_env()
+        self.latency_model = LatencyModel.from_env()
+        self._warm_connections(int(os.getenv('UPSTREAM_WARM_CONNECTIONS', 0)))
+        if lazy:
+            self.load_cached_voices()
+        else:
+            self.load_voices()
+    
+    @property
+    def ready(self):
+        """声音列表是否已加载（从缓存文件、网络或默认列表）"""
+        return self.registry.version > 0
+    
+    @property
+    def voices(self):
+        return self.registry.voices
+    
+    @property
+    def voices_fallback(self):
+        return self.registry.fallback
+    
+    @property
+    def voices_updated_at(self):
+        return self.registry.updated_at
     
     def _ensure_cache_dir(self):
         try:
@@ -32,6 +85,15 @@ class NanoAITTS:
             self.logger.warning(f"无法创建缓存目录: {str(e)}，缓存功能已禁用")
             return False
     
+    def _warm_connections(self, count):
+        if count <= 0:
+            return
+        # 后台预热，避免阻塞启动
+        threading.Thread(
+            target=self.http.warm, args=(f'{self.base_url}/', count),
+            name='upstream-warmup', daemon=True
+        ).start()
+    
     def md5(self, msg):
         return hashlib.md5(msg.encode('utf-8')).hexdigest()
     
@@ -79,6 +141,10 @@ class NanoAITTS:
         return now.strftime('%Y-%m-%dT%H:%M:%S+08:00')
     
     def get_headers(self):
+        with time_stage('sign_headers'):
+            return self._sign_headers()
+    
+    def _sign_headers(self):
         device = "Web"
         ver = "1.2"
         timestamp = self.get_iso8601_time()
@@ -98,110 +164,343 @@ class NanoAITTS:
             'User-Agent': self.ua
         }
     
-    def http_get(self, url, headers):
-        req = urllib.request.Request(url, headers=headers)
+    def http_post(self, url, data, headers, handle=None):
+        data_bytes = data.encode('utf-8')
         try:
-            with urllib.request.urlopen(req, timeout=30) as response:
-                return response.read().decode('utf-8')
-        except urllib.error.HTTPError as e:
-            self.logger.error(f"HTTP GET请求失败 - HTTP错误: {e.code} - {e.reason}", exc_info=True)
-            raise Exception(f"HTTP GET请求失败: {e.code} - {e.reason}")
-        except urllib.error.URLError as e:
-            self.logger.error(f"HTTP GET请求失败 - URL错误: {e.reason}", exc_info=True)
-            raise Exception(f"HTTP GET请求失败: {e.reason}")
+            status, reason, _, body = self.http.fetch('POST', url, body=data_bytes, headers=headers, handle=handle)
+        except http.client.InvalidURL as e:
+            # 请求参数构造出的 URL 非法：属于客户端错误，不计入上游失败和熔断
+            raise ValueError(f"无效的请求参数: {str(e)}")
+        except (OSError, http.client.HTTPException) as e:
+            if handle is not None and handle.cancelled:
+                # 对冲中落败被中止的请求，不计为上游错误
+                raise
+            error_type = classify_error(e)
+            upstream_error(urllib.parse.urlsplit(url).path, error_type)
+            self.logger.error(f"HTTP POST请求失败 - 连接错误: {str(e)}", exc_info=True)
+            raise UpstreamError(f"HTTP POST请求失败: {str(e)}", error_type)
         except Exception as e:
-            self.logger.error(f"HTTP GET请求失败 - 未知错误: {str(e)}", exc_info=True)
-            raise Exception(f"HTTP GET请求失败: {str(e)}")
+            upstream_error(urllib.parse.urlsplit(url).path, 'unknown')
+            self.logger.error(f"HTTP POST请求失败 - 未知错误: {str(e)}", exc_info=True)
+            raise UpstreamError(f"HTTP POST请求失败: {str(e)}")
+        if status >= 400:
+            upstream_error(urllib.parse.urlsplit(url).path, status_error_type(status))
+            self.logger.error(f"HTTP POST请求失败 - HTTP错误: {status} - {reason}")
+            raise UpstreamError(f"HTTP POST请求失败: {status} - {reason}", status_error_type(status), status)
+        return body
     
-    def http_post(self, url, data, headers):
-        data_bytes = data.encode('utf-8')
-        req = urllib.request.Request(url, data=data_bytes, headers=headers, method='POST')
+    def _fetch_voice_list(self):
+        """
+        从上游获取声音列表；若上次响应带有 ETag/Last-Modified 则发送条件请求
+        :return: 解析后的 JSON，上游返回 304 未修改时返回 None
+        """
+        url = f'{self.base_url}/api/robot/platform'
+        headers = self.get_headers()
+        if self._voices_etag:
+            headers['If-None-Match'] = self._voices_etag
+        if self._voices_last_modified:
+            headers['If-Modified-Since'] = self._voices_last_modified
+        try:
+            status, reason, response_headers, body = self.http.fetch('GET', url, headers=headers)
+        except (OSError, http.client.HTTPException) as e:
+            error_type = classify_error(e)
+            upstream_error('/api/robot/platform', error_type)
+            raise UpstreamError(f"HTTP GET请求失败: {str(e)}", error_type)
+        if status == 304:
+            return None
+        if status >= 400:
+            upstream_error('/api/robot/platform', status_error_type(status))
+            raise UpstreamError(f"HTTP GET请求失败: {status} - {reason}", status_error_type(status), status)
+        self._voices_etag = response_headers.get('ETag')
+        self._voices_last_modified = response_headers.get('Last-Modified')
+        return json.loads(body.decode('utf-8'))
+    
+    def _save_voice_list(self, filename, data):
+        # 多个 worker 可能同时刷新，先写临时文件再原子替换
+        tmp_path = f"{filename}.{os.getpid()}.tmp"
         try:
-            with urllib.request.urlopen(req, timeout=30) as response:
-                return response.read()
-        except urllib.error.HTTPError as e:
-            self.logger.error(f"HTTP POST请求失败 - HTTP错误: {e.code} - {e.reason}", exc_info=True)
-            raise Exception(f"HTTP POST请求失败: {e.code} - {e.reason}")
-        except urllib.error.URLError as e:
-            self.logger.error(f"HTTP POST请求失败 - URL错误: {e.reason}", exc_info=True)
-            raise Exception(f"HTTP POST请求失败: {e.reason}")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, filename)
+            self.logger.info(f"声音列表已缓存到: {filename}")
         except Exception as e:
-            self.logger.error(f"HTTP POST请求失败 - 未知错误: {str(e)}", exc_info=True)
-            raise Exception(f"HTTP POST请求失败: {str(e)}")
+            self.logger.warning(f"保存缓存文件失败: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    
+    def _read_cache_file(self):
+        filename = os.path.join(self.cache_dir, 'robots.json')
+        if not self.cache_enabled or not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return VoiceRegistry.from_platform_data(data, updated_at=os.path.getmtime(filename)), filename, {}
+        except Exception as e:
+            self.logger.warning(f"读取声音列表缓存文件失败: {str(e)}")
+            return None
+    
+    def _read_manifest(self):
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return None
+        try:
+            registry, meta = load_manifest(self.manifest_path)
+        except Exception as e:
+            self.logger.warning(f"读取声音清单失败: {str(e)}")
+            return None
+        return registry, self.manifest_path, meta
+    
+    def load_cached_voices(self):
+        """
+        仅从本地加载声音列表（运行时缓存文件或构建时生成的声音清单，取较新者），不访问网络
+        :return: 是否加载成功
+        """
+        candidates = [c for c in (self._read_cache_file(), self._read_manifest()) if c]
+        if not candidates:
+            return False
+        registry, source, meta = max(candidates, key=lambda c: c[0].updated_at)
+        if meta.get('etag') or meta.get('last_modified'):
+            # 用构建时记录的校验器发起后台条件请求，列表未变时上游只需返回 304
+            self._voices_etag = meta.get('etag')
+            self._voices_last_modified = meta.get('last_modified')
+        self.registry = VoiceRegistry(
+            registry.voices, version=self.registry.version + 1, updated_at=registry.updated_at
+        )
+        self.logger.info(f"从本地加载 {len(registry)} 个声音模型: {source}")
+        return True
     
-    def load_voices(self):
+    def load_voices(self, refresh=False):
+        """
+        加载声音列表
+        :param refresh: True 时跳过本地缓存文件，直接向上游发起（条件）请求；失败时保留当前列表并抛出异常
+        :return: 列表是否有更新（上游返回 304 时为 False）
+        """
+        if not refresh and self.load_cached_voices():
+            return True
+        
         filename = os.path.join(self.cache_dir, 'robots.json')
+        current = self.registry
         
         try:
-            # 尝试从缓存文件加载（仅在缓存可用时）
-            if self.cache_enabled and os.path.exists(filename):
-                self.logger.info(f"从缓存文件加载声音列表: {filename}")
-                with open(filename, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            else:
-                self.logger.info("从网络获取声音列表...")
-                response_text = self.http_get('https://bot.n.cn/api/robot/platform', self.get_headers())
-                data = json.loads(response_text)
-                
-                # 尝试保存到缓存（仅在缓存可用时）
-                if self.cache_enabled:
-                    try:
-                        with open(filename, 'w', encoding='utf-8') as f:
-                            json.dump(data, f, ensure_ascii=False, indent=2)
-                        self.logger.info(f"声音列表已缓存到: {filename}")
-                    except Exception as e:
-                        self.logger.warning(f"保存缓存文件失败: {str(e)}")
+            self.logger.info("从网络获取声音列表...")
+            data = self.resilience.call('/api/robot/platform', self._fetch_voice_list)
+            if data is None:
+                self.logger.info("声音列表未变化（304 Not Modified）")
+                self.registry = current.touched()
+                return False
+            
+            # 尝试保存到缓存（仅在缓存可用时）
+            if self.cache_enabled:
+                self._save_voice_list(filename, data)
             
-            self.voices.clear()
-            if 'data' in data and 'list' in data['data']:
-                for item in data['data']['list']:
-                    self.voices[item['tag']] = {
-                        'name': item['title'],
-                        'iconUrl': item['icon']
-                    }
-                self.logger.info(f"成功加载 {len(self.voices)} 个声音模型")
-            else:
+            try:
+                registry = VoiceRegistry.from_platform_data(data, version=current.version + 1)
+            except (ValueError, KeyError, TypeError):
                 self.logger.warning("API返回的数据格式不正确")
                 raise Exception("API返回的数据格式不正确")
+            # 新快照完整构建后再替换引用，读者不会看到清空/半填充的状态
+            self.registry = registry
+            self.logger.info(f"成功加载 {len(registry)} 个声音模型（版本 {registry.version}）")
+            return True
                 
         except json.JSONDecodeError as e:
             self.logger.error(f"解析JSON数据失败: {str(e)}", exc_info=True)
             raise Exception(f"解析JSON数据失败: {str(e)}")
         except Exception as e:
             self.logger.error(f"加载声音列表失败: {str(e)}", exc_info=True)
-            self.voices.clear()
-            self.voices['DeepSeek'] = {'name': 'DeepSeek (默认)', 'iconUrl': ''}
+            if refresh and len(current):
+                # 刷新失败时继续使用上一次成功加载的列表
+                raise
+            self.registry = VoiceRegistry.default(version=current.version + 1)
             self.logger.warning("使用默认声音模型")
+            return True
     
-    def get_audio(self, text, voice='DeepSeek', speed=1.0, pitch=1.0):
+    def _prepare_tts_request(self, text, voice, speed, pitch):
         if not text or not text.strip():
             raise ValueError("文本不能为空")
         
-        if voice not in self.voices:
+        if not isinstance(voice, str) or not voice or not voice.isprintable():
+            raise ValueError(f"无效的声音模型: {voice!r}")
+        # 声音列表尚未加载（warming）时不做校验，由上游判断
+        if self.ready and voice not in self.voices:
             raise ValueError(f"不支持的声音模型: {voice}")
         
-        url = f'https://bot.n.cn/api/tts/v1?roleid={voice}&speed={speed}&pitch={pitch}'
+        # 参数可能来自客户端，转义后才能拼入查询字符串（防止 & 注入额外参数、空格导致 InvalidURL）
+        query = urllib.parse.urlencode({'roleid': voice, 'speed': speed, 'pitch': pitch}, quote_via=urllib.parse.quote)
+        url = f'{self.base_url}/api/tts/v1?{query}'
         
         headers = self.get_headers()
         headers['Content-Type'] = 'application/x-www-form-urlencoded'
         
-        max_length = 1000
+        max_length = self.MAX_TEXT_LENGTH
         if len(text) > max_length:
             self.logger.warning(f"文本过长（最大支持{max_length}字符），将被截断")
             text = text[:max_length]
         
         form_data = f'&text={urllib.parse.quote(text)}&audio_type=mp3&format=stream'
+        return url, headers, form_data, text
+    
+    @staticmethod
+    def _flight_key(voice, speed, pitch, text):
+        """请求合并键：空白归一化后的文本，与音频缓存键同样取 SHA-256"""
+        return AudioCache.make_key(voice, speed, pitch, ' '.join(text.split()))
+    
+    def _cached_audio(self, cache_key, voice, text, record=True):
+        if not cache_key:
+            return None
+        cached = self.audio_cache.get(cache_key, record=record)
+        if cached:
+            self.logger.info(f"音频缓存命中 - 模型: {voice}, 文本长度: {len(text)}, 数据大小: {len(cached)} 字节")
+        return cached
+    
+    def get_audio(self, text, voice='DeepSeek', speed=1.0, pitch=1.0, use_cache=True, tenant=None, priority=INTERACTIVE):
+        """
+        :param tenant: 租户标识（admission.tenant_id），上游名额紧张时同类请求按租户公平排队
+        :param priority: 请求类别（interactive/segment/batch），决定排队优先级
+        """
+        url, headers, form_data, text = self._prepare_tts_request(text, voice, speed, pitch)
+        
+        cache_key = AudioCache.make_key(voice, speed, pitch, text) if use_cache and self.audio_cache else None
+        cached = self._cached_audio(cache_key, voice, text)
+        if cached:
+            return cached
         
+        # 并发的相同请求只向上游发起一次
+        return self.flights.do(
+            self._flight_key(voice, speed, pitch, text),
+            lambda: self._synthesize(url, form_data, headers, cache_key, voice, text, speed, pitch, tenant, priority)
+        )
+    
+    def _synthesize(self, url, form_data, headers, cache_key, voice, text, speed, pitch, tenant=None, priority=INTERACTIVE):
+        # 可能刚等待过其他 worker 的跨进程锁，先复查缓存
+        cached = self._cached_audio(cache_key, voice, text, record=False)
+        if cached:
+            return cached
         try:
             self.logger.info(f"开始生成音频 - 模型: {voice}, 文本长度: {len(text)}, 语速: {speed}, 音调: {pitch}")
-            audio_data = self.http_post(url, form_data, headers)
+            # 可重试的错误按退避重试，连续失败时熔断
+            audio_data = self.resilience.call(
+                '/api/tts/v1',
+                lambda: self._post_tts(url, form_data, headers, voice, text, speed, tenant, priority)
+            )
             
             if not audio_data or len(audio_data) < 100:
+                upstream_error('/api/tts/v1', 'invalid_audio')
                 raise Exception("返回的音频数据无效")
             
             self.logger.info(f"音频生成成功 - 数据大小: {len(audio_data)} 字节")
+            if cache_key:
+                self.audio_cache.put(cache_key, audio_data)
             return audio_data
             
         except Exception as e:
             self.logger.error(f"获取音频失败: {str(e)}", exc_info=True)
             raise
+    
+    def _post_tts(self, url, form_data, headers, voice, text, speed, tenant=None, priority=INTERACTIVE):
+        """
+        单次上游合成：在准入控制的并发名额内执行（按预计耗时排队），
+        首字节超过该声音/长度分组的 p95 时并行发出对冲请求（HEDGE_ENABLED）
+        """
+        key = (voice, length_bucket(len(text)))
+        cost = self.latency_model.predict(voice, len(text), speed)
+        
+        def attempt():
+            started = time.perf_counter()
+            audio_data = self.hedger.run(
+                lambda handle: self.http_post(url, form_data, headers, handle=handle), key,
+                # 对冲请求另占一个名额，上游实际并发不超过准入控制的上限
+                acquire=lambda: self.admission.try_acquire(tenant=tenant, priority=priority, cost=cost)
+            )
+            self.latency_model.observe(voice, len(text), speed, time.perf_counter() - started)
+            return audio_data
+        
+        return self.admission.call(attempt, dropped=is_overload, tenant=tenant, priority=priority, cost=cost)
+    
+    def _open_stream(self, url, form_data, headers, cost, tenant=None, priority=INTERACTIVE):
+        """获取准入名额并打开上游流，返回 (response, permit)；名额在流读取结束后释放"""
+        permit = self.admission.acquire(tenant=tenant, priority=priority, cost=cost)
+        try:
+            response = self.http.request('POST', url, body=form_data.encode('utf-8'), headers=headers)
+        except http.client.InvalidURL as e:
+            permit.release(sample=False)
+            raise ValueError(f"无效的请求参数: {str(e)}")
+        except Exception as e:
+            error_type = classify_error(e)
+            upstream_error('/api/tts/v1', error_type)
+            self.logger.error(f"HTTP POST请求失败 - 连接错误: {str(e)}", exc_info=True)
+            error = UpstreamError(f"HTTP POST请求失败: {str(e)}", error_type)
+            permit.release(dropped=is_overload(error), sample=False)
+            raise error
+        if response.status >= 400:
+            response.close(reusable=False)
+            upstream_error('/api/tts/v1', status_error_type(response.status))
+            self.logger.error(f"HTTP POST请求失败 - HTTP错误: {response.status} - {response.reason}")
+            error = UpstreamError(f"HTTP POST请求失败: {response.status} - {response.reason}",
+                                  status_error_type(response.status), response.status)
+            permit.release(dropped=is_overload(error), sample=False)
+            raise error
+        return response, permit
+    
+    def stream_audio(self, text, voice='DeepSeek', speed=1.0, pitch=1.0, use_cache=True, chunk_size=16 * 1024,
+                     tenant=None, priority=INTERACTIVE):
+        """流式生成音频：上游数据到达即按块产出，同时写入音频缓存"""
+        url, headers, form_data, text = self._prepare_tts_request(text, voice, speed, pitch)
+        
+        cache_key = AudioCache.make_key(voice, speed, pitch, text) if use_cache and self.audio_cache else None
+        cached = self._cached_audio(cache_key, voice, text)
+        if cached:
+            for offset in range(0, len(cached), chunk_size):
+                yield cached[offset:offset + chunk_size]
+            return
+        
+        # 并发的相同请求共享同一条上游流
+        yield from self.flights.stream(
+            self._flight_key(voice, speed, pitch, text),
+            lambda: self._stream_upstream(url, form_data, headers, cache_key, voice, text, speed, pitch, chunk_size,
+                                          tenant, priority)
+        )
+    
+    def _stream_upstream(self, url, form_data, headers, cache_key, voice, text, speed, pitch, chunk_size,
+                         tenant=None, priority=INTERACTIVE):
+        cached = self._cached_audio(cache_key, voice, text, record=False)
+        if cached:
+            for offset in range(0, len(cached), chunk_size):
+                yield cached[offset:offset + chunk_size]
+            return
+        
+        self.logger.info(f"开始流式生成音频 - 模型: {voice}, 文本长度: {len(text)}, 语速: {speed}, 音调: {pitch}")
+        # 开始向客户端输出之前的错误（连接失败、HTTP 错误状态）可以安全重试
+        cost = self.latency_model.predict(voice, len(text), speed)
+        response, permit = self.resilience.call(
+            '/api/tts/v1', lambda: self._open_stream(url, form_data, headers, cost, tenant, priority)
+        )
+        
+        writer = self.audio_cache.writer(cache_key) if cache_key else None
+        completed = False
+        try:
+            total = 0
+            for chunk in response.iter_chunks(chunk_size):
+                total += len(chunk)
+                if writer:
+                    writer.write(chunk)
+                yield chunk
+            completed = True
+            self.latency_model.observe(voice, len(text), speed, time.monotonic() - permit.started)
+        finally:
+            # 中途出错时丢弃缓存写入，连接不再复用
+            response.close(reusable=completed)
+            # 数据由 single-flight 后台线程读取，耗时不受客户端读取速度影响，可作为延迟样本
+            permit.release(sample=completed)
+            if writer:
+                if completed and total >= 100:
+                    writer.commit()
+                else:
+                    writer.abort()
+        
+        if total < 100:
+            self.logger.warning(f"流式音频数据过短: {total} 字节，未写入缓存")
+        else:
+            self.logger.info(f"流式音频生成完成 - 数据大小: {total} 字节")
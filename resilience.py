@@ -0,0 +1,250 @@
+# resilience.py - 上游容错：错误分类、带抖动的指数退避重试（全局重试预算）与按端点的熔断器
+import logging
+import os
+import random
+import threading
+import time
+from utils.metrics import CIRCUIT_REJECTED, CIRCUIT_STATE, UPSTREAM_RETRIES
+
+logger = logging.getLogger('Resilience')
+
+# 连接层可重试的错误类型（见 upstream_client.classify_error）；tls/unknown 通常是配置问题，重试无益
+RETRYABLE_ERRORS = frozenset({'timeout', 'connection_reset', 'connection_refused', 'network', 'protocol'})
+# 可重试的上游 HTTP 状态码
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class UpstreamError(Exception):
+    """上游请求失败；retryable 表示换一次请求可能成功"""
+
+    def __init__(self, message, kind='unknown', status=None):
+        super().__init__(message)
+        self.kind = kind
+        self.status = status
+
+    @property
+    def retryable(self):
+        if self.status is not None:
+            return self.status in RETRYABLE_STATUSES
+        return self.kind in RETRYABLE_ERRORS
+
+    @property
+    def counts_as_failure(self):
+        """是否说明上游不健康（计入熔断）：4xx（429 除外）只与单个请求有关，不计入"""
+        return self.status is None or self.status >= 500 or self.status == 429
+
+
+class UpstreamUnavailable(UpstreamError):
+    """熔断器打开，请求未发往上游"""
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"上游暂时不可用（{endpoint} 熔断中），请 {retry_after:.0f} 秒后重试", kind='circuit_open')
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return False
+
+
+def is_overload(exc):
+    """上游明确过载（超时、429/503），供并发上限收缩使用"""
+    return isinstance(exc, UpstreamError) and (exc.kind == 'timeout' or exc.status in (429, 503))
+
+
+class RetryBudget:
+    """令牌桶：每个请求存入 ratio 个令牌，每次重试消耗 1 个，上游故障时重试量不超过正常流量的 ratio"""
+
+    def __init__(self, ratio=0.1, burst=10.0):
+        self.ratio = ratio
+        self.burst = burst
+        # 初始满额：冷启动或低流量时仍允许少量重试
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+
+class CircuitBreaker:
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30.0):
+        """
+        :param failure_threshold: 连续失败达到该次数即打开熔断
+        :param reset_timeout: 打开后经过该时长（秒）进入半开状态，放行一个试探请求
+        """
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.labels(endpoint).set(0)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning(f"熔断器 {self.endpoint}: {self.state} -> {state}")
+            self.state = state
+            CIRCUIT_STATE.labels(self.endpoint).set(_STATE_VALUES[state])
+
+    def retry_after(self):
+        """距离下一次试探的剩余秒数"""
+        return max(1.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        """熔断打开时抛出 UpstreamUnavailable；半开状态只允许一个试探请求在途"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise self._reject()
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    raise self._reject()
+                self._probing = True
+
+    def _reject(self):
+        CIRCUIT_REJECTED.labels(self.endpoint).inc()
+        return UpstreamUnavailable(self.endpoint, self.retry_after())
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+                self._probing = False
+                self._set_state(OPEN)
+
+    def release(self):
+        """请求以与上游健康无关的原因结束（如 4xx），释放半开试探名额"""
+        with self._lock:
+            self._probing = False
+
+    def stats(self):
+        with self._lock:
+            stats = {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips}
+            if self.state == OPEN:
+                stats["retry_after"] = round(self.retry_after(), 1)
+            return stats
+
+
+class UpstreamResilience:
+    def __init__(self, max_retries=2, base_delay=0.1, max_delay=2.0, deadline=60.0, retry_budget=0.1,
+                 failure_threshold=5, reset_timeout=30.0):
+        """
+        :param max_retries: 单个请求最多重试次数
+        :param base_delay: 退避基准（秒），第 n 次重试等待 [0, base_delay * 2^n] 内的随机时长
+        :param max_delay: 单次退避上限（秒）
+        :param deadline: 超过该总耗时（秒）后不再重试，避免逼近 gunicorn 超时
+        :param retry_budget: 重试请求占总请求的比例上限
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.budget = RetryBudget(ratio=retry_budget)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_retries=int(os.getenv('UPSTREAM_MAX_RETRIES', 2)),
+            base_delay=float(os.getenv('UPSTREAM_RETRY_BASE_DELAY', 0.1)),
+            max_delay=float(os.getenv('UPSTREAM_RETRY_MAX_DELAY', 2.0)),
+            deadline=float(os.getenv('UPSTREAM_RETRY_DEADLINE', 60)),
+            retry_budget=float(os.getenv('UPSTREAM_RETRY_BUDGET', 0.1)),
+            failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5)),
+            reset_timeout=float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30)),
+        )
+
+    def breaker(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                # 只在首次使用时创建：构造函数会把 CIRCUIT_STATE 重置为 closed
+                breaker = self._breakers.get(endpoint)
+                if breaker is None:
+                    breaker = self._breakers[endpoint] = CircuitBreaker(
+                        endpoint, self.failure_threshold, self.reset_timeout
+                    )
+        return breaker
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, endpoint, fn):
+        """
+        经熔断器执行 fn()，可重试的 UpstreamError 按退避重试
+        :raises UpstreamUnavailable: 熔断打开
+        """
+        breaker = self.breaker(endpoint)
+        self.budget.deposit()
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            breaker.allow()
+            try:
+                result = fn()
+            except UpstreamError as e:
+                if e.counts_as_failure:
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                if time.monotonic() - started + delay > self.deadline:
+                    UPSTREAM_RETRIES.labels(endpoint, 'deadline').inc()
+                    raise
+                if not self.budget.try_spend():
+                    UPSTREAM_RETRIES.labels(endpoint, 'budget_exhausted').inc()
+                    raise
+                attempt += 1
+                UPSTREAM_RETRIES.labels(endpoint, 'retried').inc()
+                logger.warning(f"上游请求失败（{e.kind}），{delay:.2f}s 后第 {attempt} 次重试: {endpoint}")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return result
+
+    def any_open(self):
+        return any(breaker.state == OPEN for breaker in list(self._breakers.values()))
+
+    def stats(self):
+        return {
+            "retry_budget_tokens": round(self.budget.tokens, 2),
+            "breakers": {endpoint: breaker.stats() for endpoint, breaker in list(self._breakers.items())},
+        }
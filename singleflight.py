@@ -0,0 +1,297 @@
+# singleflight.py - 相同合成请求的合并（single-flight）
+import collections
+import contextlib
+import logging
+import os
+import threading
+import time
+import uuid
+import weakref
+from utils.metrics import COALESCED
+
+try:
+    import fcntl  # 仅 POSIX 可用
+except ImportError:  # pragma: no cover - Windows 本地开发
+    fcntl = None
+
+logger = logging.getLogger('SingleFlight')
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Reader:
+    __slots__ = ('offset', '__weakref__')
+
+    def __init__(self, offset=0):
+        self.offset = offset
+
+
+class _StreamCall:
+    """
+    共享的上游流：chunks 只保留尚有读者未读的数据块（base 为 chunks[0] 的序号）
+    开头的 window 字节内允许新读者加入，此后不再接受新读者，所有读者都读过的块即被丢弃
+    """
+
+    def __init__(self, window):
+        self.cond = threading.Condition()
+        self.chunks = collections.deque()
+        self.base = 0
+        self.buffered = 0
+        self.produced = 0
+        self.window = window
+        self.joinable = True
+        # 弱引用：读者的生成器未被迭代就被丢弃时，不会一直占住缓冲区
+        self.readers = weakref.WeakSet()
+        self.finished = False
+        self.error = None
+
+    def add_reader(self):
+        reader = _Reader()
+        self.readers.add(reader)
+        return reader
+
+    def trim(self):
+        """丢弃所有读者都已读过的数据块（调用方持有 cond）"""
+        if self.joinable:
+            return
+        low = min((reader.offset for reader in list(self.readers)), default=self.base + len(self.chunks))
+        while self.base < low:
+            self.buffered -= len(self.chunks.popleft())
+            self.base += 1
+
+
+class FileLockBackend:
+    """跨 gunicorn worker 的文件锁（flock），按键哈希分桶，锁文件数量有上限"""
+
+    def __init__(self, lock_dir, timeout=60.0, stripes=4096):
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self.stripes = stripes
+        os.makedirs(lock_dir, exist_ok=True)
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        """获取锁；返回值表示是否曾被其他进程持有（调用方应重新检查缓存）"""
+        stripe = int(key[:8], 16) % self.stripes if len(key) >= 8 else hash(key) % self.stripes
+        with open(os.path.join(self.lock_dir, f"{stripe:04x}.lock"), 'a') as f:
+            contended = False
+            deadline = time.monotonic() + self.timeout
+            while True:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except OSError:
+                    contended = True
+                    if time.monotonic() >= deadline:
+                        logger.warning(f"等待跨进程锁超时，直接请求上游: {key[:12]}")
+                        yield contended
+                        return
+                    time.sleep(0.05)
+            try:
+                yield contended
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RedisLockBackend:
+    """基于 Redis SET NX 的跨进程/跨主机锁"""
+
+    _RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, redis_url, timeout=60.0, ttl=90.0):
+        import redis  # 可选依赖，仅在启用 Redis 锁时需要
+        self._client = redis.Redis.from_url(redis_url)
+        self.timeout = timeout
+        self.ttl_ms = int(ttl * 1000)
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        name = f"nanoai:tts:flight:{key}"
+        token = uuid.uuid4().hex
+        contended = False
+        acquired = False
+        deadline = time.monotonic() + self.timeout
+        try:
+            while True:
+                if self._client.set(name, token, nx=True, px=self.ttl_ms):
+                    acquired = True
+                    break
+                contended = True
+                if time.monotonic() >= deadline:
+                    logger.warning(f"等待 Redis 锁超时，直接请求上游: {key[:12]}")
+                    break
+                time.sleep(0.05)
+        except Exception as e:
+            logger.warning(f"Redis 锁不可用，直接请求上游: {str(e)}")
+        try:
+            yield contended
+        finally:
+            if acquired:
+                try:
+                    self._client.eval(self._RELEASE_SCRIPT, 1, name, token)
+                except Exception as e:
+                    logger.warning(f"释放 Redis 锁失败: {str(e)}")
+
+
+class SingleFlight:
+    def __init__(self, lock_backend=None, stream_window=512 * 1024):
+        """
+        :param lock_backend: 可选的跨进程锁（FileLockBackend/RedisLockBackend），None 时只在进程内合并
+        :param stream_window: 流式合并的窗口（字节）：上游流开头这么多数据内的相同请求可加入共享，
+            也是每个共享流在内存中缓冲的上限（超过时按最慢的读者限速）
+        """
+        self.lock_backend = lock_backend
+        self.stream_window = stream_window
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.leaders = 0
+        self.collapsed = 0
+        self.cross_process_waits = 0
+
+    @classmethod
+    def from_env(cls, cache_dir=None):
+        backend = os.getenv('SINGLEFLIGHT_BACKEND', 'local').lower()
+        timeout = float(os.getenv('SINGLEFLIGHT_LOCK_TIMEOUT', 60))
+        stream_window = int(float(os.getenv('SINGLEFLIGHT_STREAM_WINDOW_KB', 512)) * 1024)
+        try:
+            if backend == 'file' and fcntl is not None and cache_dir:
+                return cls(FileLockBackend(os.path.join(cache_dir, 'locks'), timeout=timeout), stream_window)
+            if backend == 'redis' and os.getenv('REDIS_URL'):
+                return cls(RedisLockBackend(os.getenv('REDIS_URL'), timeout=timeout), stream_window)
+        except Exception as e:
+            logger.warning(f"跨进程请求合并初始化失败，仅在进程内合并: {str(e)}")
+        return cls(stream_window=stream_window)
+
+    @contextlib.contextmanager
+    def _hold(self, key):
+        if self.lock_backend is None:
+            yield False
+            return
+        with self.lock_backend.hold(key) as contended:
+            if contended:
+                with self._lock:
+                    self.cross_process_waits += 1
+            yield contended
+
+    def do(self, key, fn):
+        """相同 key 的并发调用只执行一次 fn，其余调用等待并共享结果（或异常）"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.collapsed += 1
+        COALESCED.labels('leader' if leader else 'collapsed').inc()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            with self._hold(key):
+                call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stream(self, key, factory):
+        """
+        流式版本：由后台线程驱动 factory() 产出的数据块，所有并发读者按顺序读取同一份数据
+        任一读者提前断开不影响其他读者；只有上游流的前 stream_window 字节内到达的相同请求会加入共享，
+        缓冲区只保留尚未被所有读者读过的数据块，单个请求的内存占用不随音频长度增长
+        """
+        with self._lock:
+            call = self._streams.get(key)
+            COALESCED.labels('collapsed' if call else 'leader').inc()
+            if call is None:
+                call = self._streams[key] = _StreamCall(self.stream_window)
+                self.leaders += 1
+                reader = call.add_reader()
+                threading.Thread(
+                    target=self._pump, args=(key, call, factory), name='singleflight-pump', daemon=True
+                ).start()
+            else:
+                self.collapsed += 1
+                with call.cond:
+                    reader = call.add_reader()
+        return self._read(call, reader)
+
+    def _close_joins(self, key, call):
+        """共享窗口结束：之后的相同请求另起上游流"""
+        with self._lock:
+            if self._streams.get(key) is call:
+                del self._streams[key]
+            with call.cond:
+                call.joinable = False
+                call.trim()
+
+    def _pump(self, key, call, factory):
+        try:
+            with self._hold(key):
+                for chunk in factory():
+                    with call.cond:
+                        call.chunks.append(chunk)
+                        call.buffered += len(chunk)
+                        call.produced += len(chunk)
+                        call.trim()
+                        call.cond.notify_all()
+                    if call.joinable and call.produced > call.window:
+                        self._close_joins(key, call)
+                    with call.cond:
+                        # 缓冲超过窗口时等待最慢的读者，避免慢客户端让内存无限增长
+                        while not call.joinable and call.buffered > call.window and call.readers:
+                            call.cond.wait(1.0)
+                            call.trim()
+        except BaseException as e:
+            call.error = e
+        finally:
+            self._close_joins(key, call)
+            with call.cond:
+                call.finished = True
+                call.cond.notify_all()
+
+    @staticmethod
+    def _read(call, reader):
+        try:
+            while True:
+                with call.cond:
+                    while reader.offset >= call.base + len(call.chunks) and not call.finished:
+                        call.cond.wait()
+                    if reader.offset < call.base + len(call.chunks):
+                        chunk = call.chunks[reader.offset - call.base]
+                        reader.offset += 1
+                        call.trim()
+                        call.cond.notify_all()
+                    elif call.error is not None:
+                        raise call.error
+                    else:
+                        return
+                yield chunk
+        finally:
+            with call.cond:
+                call.readers.discard(reader)
+                call.trim()
+                call.cond.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "collapsed": self.collapsed,
+                "in_flight": len(self._calls) + len(self._streams),
+                "cross_process_waits": self.cross_process_waits,
+                "backend": type(self.lock_backend).__name__ if self.lock_backend else "local",
+            }
@@ -0,0 +1,41 @@
+import importlib
+import os
+import threading
+
+import pytest
+
+from bench.mock_upstream import MockUpstreamConfig, make_server
+
+API_KEY = 'sk-test-key'
+
+
+@pytest.fixture(scope='session')
+def mock_upstream():
+    server = make_server(config=MockUpstreamConfig(latency='fixed:0.01', ms_per_char=0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+@pytest.fixture(scope='session', params=['app', 'api.index'])
+def app_module(request, mock_upstream, tmp_path_factory):
+    """导入指向模拟上游的应用模块（app.py 与 api/index.py 各跑一遍）"""
+    # 这些模块在导入时读取配置，必须先设置环境变量
+    os.environ.update({
+        'TTS_API_KEY': API_KEY,
+        'NANOAI_BASE_URL': mock_upstream,
+        'CACHE_DIR': str(tmp_path_factory.mktemp('cache')),
+        'AUDIO_CACHE_ENABLED': 'false',
+        'PROBE_INTERVAL': '3600',
+    })
+    return importlib.import_module(request.param)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def auth_headers():
+    return {'Authorization': f'Bearer {API_KEY}'}
@@ -0,0 +1,198 @@
+import threading
+import time
+
+import pytest
+
+from admission import BATCH, INTERACTIVE, AdmissionController, FairQueue, Overloaded, VegasLimit, _Waiter
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            pytest.fail('条件未在超时前满足')
+        time.sleep(0.005)
+
+
+def _push(queue, tenant, priority=INTERACTIVE, cost=1.0, waited=0.0):
+    waiter = _Waiter(tenant, priority, cost)
+    waiter.enqueued_at -= waited
+    queue.push(waiter)
+    return waiter
+
+
+def _drain(queue):
+    order = []
+    while len(queue):
+        order.append(queue.pop())
+    return order
+
+
+def test_vegas_limit_grows_while_latency_stays_at_baseline():
+    limit = VegasLimit(initial=4, max_limit=64, smoothing=1)
+    for _ in range(50):
+        limit.on_sample(1.0, in_flight=int(limit.limit))
+    assert limit.limit > 4
+
+
+def test_vegas_limit_does_not_grow_when_underused():
+    limit = VegasLimit(initial=4, smoothing=1)
+    for _ in range(50):
+        limit.on_sample(1.0, in_flight=0)
+    assert limit.limit == 4
+
+
+def test_vegas_limit_shrinks_when_latency_rises():
+    limit = VegasLimit(initial=32, smoothing=1)
+    limit.on_sample(1.0, in_flight=32)
+    before = limit.limit
+    for _ in range(20):
+        # 延迟升到基准的 3 倍：估计排队数远超阈值
+        limit.on_sample(3.0, in_flight=32)
+    assert limit.limit < before
+
+
+def test_vegas_limit_backs_off_on_drop_and_respects_bounds():
+    limit = VegasLimit(initial=10, min_limit=2, backoff=0.5)
+    limit.on_drop()
+    assert limit.limit == 5
+    for _ in range(10):
+        limit.on_drop()
+    assert limit.limit == 2
+
+
+def test_queue_full_is_rejected_with_429():
+    controller = AdmissionController(limit=VegasLimit(initial=1), max_queue=1, queue_timeout=10)
+    held = controller.acquire()
+    granted = []
+    waiter = threading.Thread(target=lambda: granted.append(controller.acquire()))
+    waiter.start()
+    _wait_until(lambda: len(controller.queue) == 1)
+
+    with pytest.raises(Overloaded) as excinfo:
+        controller.acquire()
+    assert excinfo.value.reason == 'queue_full'
+    assert excinfo.value.status == 429
+    assert excinfo.value.retry_after >= 1
+
+    # 释放后名额直接转交给排队者
+    held.release()
+    waiter.join(2)
+    assert len(granted) == 1
+    granted[0].release()
+    assert controller.stats()['rejected'] == {'queue_full': 1}
+
+
+def test_expected_wait_over_deadline_is_rejected_immediately_with_503():
+    controller = AdmissionController(limit=VegasLimit(initial=1), queue_timeout=0.1)
+    held = controller.acquire(cost=10.0)
+    started = time.monotonic()
+    with pytest.raises(Overloaded) as excinfo:
+        controller.acquire()
+    assert time.monotonic() - started < 0.1
+    assert excinfo.value.status == 503
+    assert len(controller.queue) == 0
+    held.release()
+
+
+def test_waiter_not_started_before_timeout_is_rejected_with_503():
+    controller = AdmissionController(limit=VegasLimit(initial=1), queue_timeout=0.2)
+    held = controller.acquire(cost=0.1)
+    with pytest.raises(Overloaded) as excinfo:
+        controller.acquire(cost=0.1)
+    assert excinfo.value.reason == 'deadline'
+    assert len(controller.queue) == 0
+    held.release()
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_call_shrinks_limit_when_upstream_reports_overload():
+    controller = AdmissionController(limit=VegasLimit(initial=8, backoff=0.5))
+
+    def overloaded():
+        raise TimeoutError()
+
+    with pytest.raises(TimeoutError):
+        controller.call(overloaded, dropped=lambda e: isinstance(e, TimeoutError))
+    assert controller.limit.limit == 4
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_fair_queue_shares_capacity_by_tenant_weight():
+    queue = FairQueue(weights={'heavy': 3.0}, aging=0)
+    for _ in range(4):
+        _push(queue, 'heavy')
+        _push(queue, 'light')
+    first_four = [waiter.tenant for waiter in _drain(queue)[:4]]
+    assert first_four.count('heavy') == 3
+
+
+def test_fair_queue_backlog_does_not_starve_other_tenants():
+    queue = FairQueue(aging=0)
+    for _ in range(10):
+        _push(queue, 'backlog')
+    _push(queue, 'newcomer')
+    assert 'newcomer' in [waiter.tenant for waiter in _drain(queue)[:2]]
+
+
+def test_fair_queue_serves_higher_priority_first():
+    queue = FairQueue(aging=0)
+    _push(queue, 'a', BATCH)
+    _push(queue, 'a', INTERACTIVE)
+    assert [waiter.priority for waiter in _drain(queue)] == [INTERACTIVE, BATCH]
+
+
+def test_fair_queue_aging_promotes_waiting_low_priority_requests():
+    queue = FairQueue(aging=1.0)
+    _push(queue, 'a', INTERACTIVE, cost=2.0)
+    old_batch = _push(queue, 'b', BATCH, waited=3.0)
+    assert queue.pop() is old_batch
+
+
+def test_full_queue_evicts_lower_priority_waiter():
+    controller = AdmissionController(limit=VegasLimit(initial=1), max_queue=1, queue=FairQueue(aging=0))
+    held = controller.acquire()
+    results = []
+
+    def acquire(priority):
+        try:
+            results.append((priority, controller.acquire(priority=priority)))
+        except Overloaded as e:
+            results.append((priority, e))
+
+    batch = threading.Thread(target=acquire, args=(BATCH,))
+    batch.start()
+    _wait_until(lambda: len(controller.queue) == 1)
+    interactive = threading.Thread(target=acquire, args=(INTERACTIVE,))
+    interactive.start()
+    batch.join(2)
+    assert isinstance(results[0][1], Overloaded) and results[0][0] == BATCH
+
+    held.release()
+    interactive.join(2)
+    assert results[1][0] == INTERACTIVE
+    results[1][1].release()
+
+
+def test_batch_requests_leave_capacity_for_interactive():
+    controller = AdmissionController(limit=VegasLimit(initial=4), batch_share=0.5, queue=FairQueue())
+    batch = [controller.try_acquire(priority=BATCH) for _ in range(3)]
+    assert batch[2] is None
+    interactive = controller.try_acquire(priority=INTERACTIVE)
+    assert interactive is not None
+    for permit in batch[:2] + [interactive]:
+        permit.release()
+
+
+def test_shortest_first_orders_by_expected_cost():
+    queue = FairQueue(aging=10.0, shortest_first=True)
+    for cost in (5.0, 1.0, 3.0):
+        _push(queue, 'a', cost=cost)
+    assert [waiter.cost for waiter in _drain(queue)] == [1.0, 3.0, 5.0]
+
+
+def test_shortest_first_serves_long_waiting_requests_in_arrival_order():
+    queue = FairQueue(aging=1.0, shortest_first=True)
+    _push(queue, 'a', cost=0.5)
+    long_job = _push(queue, 'b', cost=30.0, waited=1.5)
+    assert queue.pop() is long_job
@@ -0,0 +1,41 @@
+import re
+import time
+
+import pytest
+
+
+def _wait_for_task(client, headers, task_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        task = client.get(f'/v1/tasks/{task_id}', headers=headers).get_json()
+        if task['status'] in ('completed', 'failed'):
+            return task
+        time.sleep(0.05)
+    pytest.fail(f'批量任务 {task_id} 未在 {timeout} 秒内完成')
+
+
+def test_ui_downloads_batch_audio_with_api_key(app_module):
+    """页面下载批量音频时必须带上与其他请求相同的 Bearer 头"""
+    match = re.search(r'async function displayTaskResults.*?\n            }\n', app_module.HTML_TEMPLATE, re.S)
+    assert match, 'displayTaskResults 未找到'
+    body = match.group(0)
+    assert 'fetch(`${apiBase}${result.audio_url}`' in body
+    assert "'Authorization': `Bearer ${apiKey}`" in body
+
+
+def test_batch_audio_route_as_called_by_ui(client, auth_headers):
+    response = client.post('/v1/audio/speech/batch', headers=auth_headers, json={
+        'texts': ['你好，世界。'], 'model': 'DeepSeek', 'params': {'speed': 1.0},
+    })
+    assert response.status_code == 202
+    task = _wait_for_task(client, auth_headers, response.get_json()['task_id'])
+    assert task['status'] == 'completed'
+    audio_url = task['results'][0]['audio_url']
+
+    response = client.get(audio_url, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'audio/mpeg'
+    assert response.data[:2] == b'\xff\xfb'
+
+    # 修复前页面不带鉴权头，路由返回 401
+    assert client.get(audio_url).status_code == 401
@@ -0,0 +1,18 @@
+def test_readyz_without_key_returns_only_status_and_reasons(client):
+    response = client.get('/readyz')
+    assert response.status_code in (200, 503)
+    body = response.get_json()
+    assert set(body) <= {'status', 'reasons'}
+    assert body['status'] in ('ready', 'not_ready')
+
+
+def test_readyz_with_invalid_key_does_not_expose_detail(client):
+    response = client.get('/readyz', headers={'Authorization': 'Bearer wrong-key'})
+    assert set(response.get_json()) <= {'status', 'reasons'}
+
+
+def test_readyz_with_key_includes_detail(client, auth_headers):
+    body = client.get('/readyz', headers=auth_headers).get_json()
+    assert body['status'] in ('ready', 'not_ready')
+    for field in ('in_flight', 'max_in_flight', 'degraded'):
+        assert field in body
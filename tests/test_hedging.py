@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, VegasLimit
+from hedging import Hedger, LatencyTracker
+
+KEY = ('DeepSeek', 0)
+
+
+def _hedger():
+    hedger = Hedger(enabled=True, min_delay=0.05, budget=1.0, tracker=LatencyTracker(min_samples=1))
+    hedger.tracker.observe(KEY, 0.01)
+    return hedger
+
+
+def _slow_then_fast(stall=2.0):
+    """第一次尝试在被取消或 stall 秒前不返回首字节，之后的尝试立即成功"""
+    lock = threading.Lock()
+    calls = []
+
+    def attempt(handle):
+        with lock:
+            calls.append(handle)
+            first = len(calls) == 1
+        if first:
+            deadline = time.monotonic() + stall
+            while not handle.cancelled and time.monotonic() < deadline:
+                time.sleep(0.005)
+            return 'primary'
+        handle.mark_first_byte(0.001)
+        return 'hedge'
+
+    return attempt, calls
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    hedger = _hedger()
+    controller = AdmissionController(limit=VegasLimit(initial=4))
+    attempt, calls = _slow_then_fast()
+    assert hedger.run(attempt, KEY, acquire=controller.try_acquire) == 'hedge'
+    assert len(calls) == 2
+    assert calls[0].cancelled
+    assert hedger.stats()['won'] == 1
+    # 对冲请求的名额在尝试结束后归还
+    deadline = time.monotonic() + 2
+    while controller.stats()['in_flight'] and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_no_hedge_without_latency_samples():
+    hedger = Hedger(enabled=True, budget=1.0)
+    attempt, calls = _slow_then_fast(stall=0.2)
+    assert hedger.run(attempt, KEY) == 'primary'
+    assert len(calls) == 1
+    assert hedger.stats()['fired'] == 0
+
+
+def test_no_hedge_without_free_admission_slot():
+    hedger = _hedger()
+    attempt, calls = _slow_then_fast(stall=0.2)
+    assert hedger.run(attempt, KEY, acquire=lambda: None) == 'primary'
+    assert len(calls) == 1
+    assert hedger.stats()['no_capacity'] == 1
+
+
+def test_primary_error_is_raised_when_both_attempts_fail():
+    hedger = _hedger()
+    calls = []
+
+    def attempt(handle):
+        calls.append(handle)
+        if len(calls) == 1:
+            time.sleep(0.2)
+            raise TimeoutError('primary')
+        raise ConnectionResetError('hedge')
+
+    with pytest.raises(TimeoutError):
+        hedger.run(attempt, KEY)
+    assert len(calls) == 2
@@ -0,0 +1,24 @@
+def test_speech_if_none_match_on_post_is_precondition_failed(client, auth_headers):
+    body = {'model': 'DeepSeek', 'input': '缓存测试。'}
+    response = client.post('/v1/audio/speech', headers=auth_headers, json=body)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+
+    # RFC 9110：POST 上的 If-None-Match 命中不能返回 304
+    response = client.post('/v1/audio/speech', headers={**auth_headers, 'If-None-Match': etag}, json=body)
+    assert response.status_code == 412
+    assert response.headers['ETag'] == etag
+    assert not response.data
+
+    response = client.post('/v1/audio/speech', headers={**auth_headers, 'If-None-Match': 'W/"other"'}, json=body)
+    assert response.status_code == 200
+
+
+def test_models_if_none_match_on_get_is_not_modified(client, auth_headers):
+    response = client.get('/v1/models', headers=auth_headers)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    response = client.get('/v1/models', headers={**auth_headers, 'If-None-Match': etag})
+    assert response.status_code == 304
@@ -0,0 +1,45 @@
+import math
+import random
+
+from latency_model import LatencyModel, OnlineRegression, features
+
+
+def test_long_run_constant_speed_stays_bounded():
+    """语速恒为 1 时第三个特征没有样本，协方差不能无限增长"""
+    rng = random.Random(0)
+    model = LatencyModel()
+    for _ in range(120_000):
+        chars = rng.choice((20, 80, 150, 300))
+        model.observe('v', chars, 1.0, 0.3 + 0.004 * chars + rng.gauss(0, 0.05))
+    for voice in ('v', 'other'):
+        for chars in (20, 80, 150, 300):
+            predicted = model.predict(voice, chars, 1.0)
+            assert abs(predicted - (0.3 + 0.004 * chars)) < 0.1
+    for regression in (model._global, model._voices['v']):
+        assert all(math.isfinite(v) for v in regression.theta)
+        assert sum(regression.p[i][i] for i in range(3)) <= regression.max_trace + 1e-9
+    assert model.floor <= model.predict('v', 300, 0.1) <= model.ceiling
+
+
+def test_rejects_non_finite_samples():
+    regression = OnlineRegression([1.0, 0.5, 0.5])
+    assert not regression.update([1.0, 1.0, 0.0], float('nan'))
+    assert not regression.update([1.0, float('inf'), 0.0], 1.0)
+    assert regression.theta == [1.0, 0.5, 0.5]
+    model = LatencyModel()
+    model.observe('v', 100, 1.0, float('inf'))
+    model.observe('v', 100, 1.0, -1.0)
+    assert model.stats()['samples'] == 0
+
+
+def test_prediction_clamped():
+    model = LatencyModel(base_seconds=-5, floor=0.1, ceiling=10)
+    assert model.predict('v', 10) == 0.1
+    model = LatencyModel(base_seconds=500, floor=0.1, ceiling=10)
+    assert model.predict('v', 10) == 10
+
+
+def test_features_accepts_string_or_bad_speed():
+    assert features(100, '2') == features(100, 2.0)
+    assert features(100, 'fast') == features(100, 1.0)
+    assert features(100, None) == features(100, 1.0)
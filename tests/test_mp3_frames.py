@@ -0,0 +1,66 @@
+import pytest
+
+import mp3_frames
+from mp3_frames import Mp3FormatError
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, 立体声：每帧 417 字节
+_HEADER = b'\xff\xfb\x90\x00'
+_FRAME_SIZE = 417
+
+
+def _frame(fill=0):
+    return _HEADER + bytes([fill]) * (_FRAME_SIZE - 4)
+
+
+def _xing_frame():
+    # MPEG1 立体声无 CRC：Xing 标记位于帧头 4 字节 + 32 字节 side info 之后
+    frame = bytearray(_frame())
+    frame[36:40] = b'Xing'
+    return bytes(frame)
+
+
+def _id3v2(payload=b'TIT2'):
+    size = len(payload)
+    syncsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b'ID3\x04\x00\x00' + syncsafe + payload
+
+
+def test_concat_joins_frames_and_keeps_first_id3_tag():
+    tag = _id3v2(b'first-tag')
+    first = tag + _frame(1) * 2
+    second = _id3v2(b'second') + _frame(2) * 3
+    merged = mp3_frames.concat([first, second])
+    assert merged == tag + _frame(1) * 2 + _frame(2) * 3
+
+
+def test_xing_info_frames_are_stripped_from_every_segment():
+    segment = _xing_frame() + _frame(1) * 2
+    assert mp3_frames.strip_headers(segment) == _frame(1) * 2
+    info = bytearray(_xing_frame())
+    info[36:40] = b'Info'
+    assert mp3_frames.concat([segment, bytes(info) + _frame(2)]) == _frame(1) * 2 + _frame(2)
+
+
+def test_id3v1_trailer_is_dropped():
+    trailer = b'TAG' + bytes(125)
+    assert mp3_frames.strip_headers(_frame(1) * 2 + trailer) == _frame(1) * 2
+
+
+def test_frame_sync_skips_junk_and_false_sync_words():
+    # 0xFFFB 伪同步字后面没有紧跟有效帧，不能被当作第一帧
+    junk = b'\x00\x01' + _HEADER + b'\x00' * 10
+    assert mp3_frames.strip_headers(_id3v2() + junk + _frame(1) * 2) == _frame(1) * 2
+
+
+def test_concat_rejects_mismatched_formats():
+    # 48 kHz 的帧与 44.1 kHz 的帧不能直接拼接
+    frame_48k = b'\xff\xfb\x94\x00' + bytes(380)
+    with pytest.raises(Mp3FormatError):
+        mp3_frames.concat([_frame() * 2, frame_48k * 2])
+
+
+def test_parse_rejects_data_without_frames():
+    with pytest.raises(Mp3FormatError):
+        mp3_frames.parse(b'not an mp3 file' * 10)
+    with pytest.raises(ValueError):
+        mp3_frames.concat([])
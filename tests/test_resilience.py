@@ -0,0 +1,45 @@
+from unittest import mock
+
+import pytest
+
+import resilience
+from resilience import OPEN, UpstreamError, UpstreamResilience, UpstreamUnavailable
+
+
+def test_breaker_created_once_per_endpoint():
+    policy = UpstreamResilience(failure_threshold=1)
+    with mock.patch.object(resilience, 'CircuitBreaker', wraps=resilience.CircuitBreaker) as factory:
+        first = policy.breaker('/api/tts/v1')
+        first.record_failure()
+        assert policy.breaker('/api/tts/v1') is first
+        assert factory.call_count == 1
+    assert first.state == OPEN
+
+
+def test_open_breaker_fails_fast_without_calling_upstream():
+    policy = UpstreamResilience(max_retries=0, failure_threshold=2, reset_timeout=30)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise UpstreamError('boom', status=502)
+
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            policy.call('/api/tts/v1', fail)
+    with pytest.raises(UpstreamUnavailable) as excinfo:
+        policy.call('/api/tts/v1', fail)
+    assert len(calls) == 2
+    assert excinfo.value.retry_after >= 1
+
+
+def test_client_errors_do_not_trip_breaker():
+    policy = UpstreamResilience(max_retries=0, failure_threshold=1)
+
+    def bad_request():
+        raise UpstreamError('bad', status=400)
+
+    for _ in range(3):
+        with pytest.raises(UpstreamError):
+            policy.call('/api/tts/v1', bad_request)
+    assert not policy.any_open()
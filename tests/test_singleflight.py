@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            pytest.fail('条件未在超时前满足')
+        time.sleep(0.005)
+
+
+def _run_followers(flight, key, fn, count):
+    """启动 count 个相同 key 的并发调用，返回 (线程列表, 结果列表)"""
+    results = []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def synthesize():
+        calls.append(1)
+        release.wait(2)
+        return b'audio'
+
+    threads, results = _run_followers(flight, 'key', synthesize, 5)
+    _wait_until(lambda: flight.stats()['collapsed'] == 4)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    assert results == [b'audio'] * 5
+    assert len(calls) == 1
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_leader_error_is_raised_in_every_follower():
+    flight = SingleFlight()
+    release = threading.Event()
+    error = ValueError('upstream failed')
+
+    def synthesize():
+        release.wait(2)
+        raise error
+
+    threads, results = _run_followers(flight, 'key', synthesize, 4)
+    _wait_until(lambda: flight.stats()['collapsed'] == 3)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    assert results == [error] * 4
+
+    # 失败的调用不会留下记录，下一次请求重新执行
+    assert flight.do('key', lambda: b'retry') == b'retry'
+
+
+def test_stream_readers_within_window_share_upstream():
+    flight = SingleFlight(stream_window=1024)
+    release = threading.Event()
+    started = []
+
+    def upstream():
+        started.append(1)
+        yield b'a' * 10
+        release.wait(2)
+        yield b'b' * 10
+
+    first = flight.stream('key', upstream)
+    second = flight.stream('key', upstream)
+    release.set()
+    assert b''.join(first) == b''.join(second) == b'a' * 10 + b'b' * 10
+    assert len(started) == 1
+
+
+def test_stream_past_window_starts_new_upstream():
+    flight = SingleFlight(stream_window=10)
+    release = threading.Event()
+
+    def upstream():
+        yield b'x' * 20
+        release.wait(2)
+
+    first = flight.stream('key', upstream)
+    _wait_until(lambda: flight.stats()['in_flight'] == 0)
+    second = flight.stream('key', upstream)
+    release.set()
+    assert b''.join(first) == b''.join(second) == b'x' * 20
+    assert flight.stats()['leaders'] == 2
+
+
+def test_stream_buffer_is_bounded_by_slow_reader():
+    flight = SingleFlight(stream_window=10)
+    produced = []
+
+    def upstream():
+        for index in range(100):
+            produced.append(index)
+            yield bytes([index]) * 5
+
+    reader = flight.stream('key', upstream)
+    time.sleep(0.2)
+    # 读者没有读取：上游最多超出窗口一个数据块后暂停
+    assert len(produced) <= 4
+    assert b''.join(reader) == b''.join(bytes([index]) * 5 for index in range(100))
+
+
+def test_stream_error_reaches_readers_after_buffered_data():
+    flight = SingleFlight()
+
+    def upstream():
+        yield b'partial'
+        raise ConnectionResetError('upstream reset')
+
+    reader = flight.stream('key', upstream)
+    assert next(reader) == b'partial'
+    with pytest.raises(ConnectionResetError):
+        next(reader)
@@ -0,0 +1,12 @@
+import json
+
+from bench import startup
+
+
+def test_entry_modules_import_within_budget(tmp_path):
+    """冷启动预算检查：wsgi 与 api.index 的导入耗时中位数不超过 STARTUP_BUDGET_MS"""
+    output = tmp_path / 'startup.json'
+    exit_code = startup.main(['--runs', '3', '--output', str(output)])
+    report = json.loads(output.read_text(encoding='utf-8'))
+    assert {r['module'] for r in report['results']} == {'wsgi', 'api.index'}
+    assert exit_code == 0, f"导入耗时超出预算: {report['over_budget']}"
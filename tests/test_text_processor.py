@@ -0,0 +1,38 @@
+import re
+
+import pytest
+
+from text_processor import AudioMergeError, TextProcessor
+
+# MPEG1 Layer III, 128 kbps, 44.1 kHz, stereo：每帧 417 字节
+_FRAME = b'\xff\xfb\x90\x00' + bytes(413)
+
+
+def test_split_keeps_every_character_and_respects_limit():
+    processor = TextProcessor(max_chunk_length=50)
+    text = ("This project provides comprehensive documentation for every endpoint. Version 1.5 is out. "
+            "这是一个很长的中文句子，" * 3 + "没有标点的超长中文" * 10)
+    segments = processor.split_text(text)
+    assert all(len(segment) <= 50 for segment in segments)
+    assert re.sub(r'\s', '', ''.join(segments)) == re.sub(r'\s', '', text)
+
+
+def test_split_english_on_periods_without_cutting_words():
+    processor = TextProcessor(max_chunk_length=40)
+    text = "This project provides comprehensive documentation for every endpoint and option. Short one."
+    words = set(text.replace('.', ' ').split())
+    for segment in processor.split_text(text):
+        for word in segment.replace('.', ' ').split():
+            assert word in words
+    assert processor.split_text("Pi is 3.14 today.") == ["Pi is 3.14 today."]
+
+
+def test_merge_concatenates_frames():
+    processor = TextProcessor()
+    assert processor.merge_audio([_FRAME * 3, _FRAME * 2]) == _FRAME * 5
+
+
+def test_merge_failure_raises_instead_of_truncating():
+    processor = TextProcessor()
+    with pytest.raises(AudioMergeError):
+        processor.merge_audio([_FRAME * 3, b'not an mp3 at all' * 10])
@@ -0,0 +1,28 @@
+from upstream_client import RequestHandle, UpstreamPool
+
+
+def test_cancel_after_close_does_not_touch_pooled_connection(mock_upstream):
+    pool = UpstreamPool()
+    url = f'{mock_upstream}/api/robot/platform'
+    handle = RequestHandle()
+    status, _, _, _ = pool.fetch('GET', url, handle=handle)
+    assert status == 200
+    assert pool.stats()['idle'] == 1
+
+    # 对冲的落败请求可能在响应结束、连接已归还后才被取消
+    with pool.request('GET', url) as response:
+        handle.cancel()
+        assert response.status == 200
+        assert response.read()
+    assert pool.stats() == {'idle': 1, 'created': 1, 'reused': 1}
+    pool.close_all()
+
+
+def test_cancelled_connection_is_not_returned_to_pool(mock_upstream):
+    pool = UpstreamPool()
+    handle = RequestHandle()
+    with pool.request('GET', f'{mock_upstream}/api/robot/platform', handle=handle) as response:
+        response.read()
+        handle.cancel()
+    assert handle.cancelled
+    assert pool.stats()['idle'] == 0
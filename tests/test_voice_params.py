@@ -0,0 +1,24 @@
+import pytest
+
+from api.voice_params import parse_speed, resolve_voice_params
+
+
+def test_parse_speed_accepts_numbers_and_numeric_strings():
+    assert parse_speed(None) == 1.0
+    assert parse_speed(1.5) == 1.5
+    assert parse_speed('1.2') == 1.2
+
+
+@pytest.mark.parametrize('value', [True, 'fast', 0, -1, float('nan'), float('inf'), [1]])
+def test_parse_speed_rejects_invalid_values(value):
+    with pytest.raises(ValueError):
+        parse_speed(value)
+
+
+def test_resolve_voice_params():
+    assert resolve_voice_params(1.3, 'neutral') == {'speed': 1.3, 'pitch': 1.0}
+    assert resolve_voice_params(1.3, 'unknown') == {'speed': 1.3, 'pitch': 1.0}
+    assert resolve_voice_params(1.3, 'sad') == {'speed': 0.9, 'pitch': 0.8}
+    # 返回副本，调用方修改不会影响映射表
+    resolve_voice_params(1.0, 'happy')['speed'] = 2.0
+    assert resolve_voice_params(1.0, 'happy')['speed'] == 1.1
@@ -1,60 +1,101 @@
-# text_processor.py - 文本分段与音频合并工具
-import re
-import io
-from pydub import AudioSegment
-import logging
-logger = logging.getLogger('TextProcessor')
-class TextProcessor:
-    def __init__(self, max_chunk_length=200):
-        """
-        :param max_chunk_length: 单段文本最大长度（根据TTS API能力调整）
-        """
-        self.max_chunk_length = max_chunk_length
-    
-    def split_text(self, text):
-        """智能分段：按标点符号拆分，避免句子被截断"""
-        # 按中文标点分段（。！？；）
-        chunks = re.split(r'([。！？；]\s*)', text)
-        merged = []
-        current_chunk = ""
-        
-        for chunk in chunks:
-            if len(current_chunk) + len(chunk) <= self.max_chunk_length:
-                current_chunk += chunk
-            else:
-                if current_chunk:
-                    merged.append(current_chunk.strip())
-                current_chunk = chunk
-        
-        if current_chunk:
-            merged.append(current_chunk.strip())
-        
-        logger.info(f"文本分段完成：原始长度{len(text)}字符，分为{len(merged)}段")
-        return merged
-    
-    def merge_audio(self, audio_chunks):
-        """合并多个音频片段为一个完整MP3"""
-        if not audio_chunks:
-            raise ValueError("音频片段列表为空")
-        
-        if len(audio_chunks) == 1:
-            return audio_chunks[0]  # 只有一段，直接返回
-        
-        try:
-            combined = AudioSegment.empty()
-            for i, chunk in enumerate(audio_chunks):
-                logger.info(f"合并第{i+1}/{len(audio_chunks)}段音频，大小: {len(chunk)}字节")
-                # 将二进制音频数据转换为AudioSegment对象
-                audio = AudioSegment.from_mp3(io.BytesIO(chunk))
-                combined += audio
-            
-            # 导出合并后的音频为二进制数据
-            output = io.BytesIO()
-            combined.export(output, format="mp3")
-            result = output.getvalue()
-            logger.info(f"音频合并完成，总大小: {len(result)}字节")
-            return result
-        except Exception as e:
-            logger.error(f"音频合并失败: {str(e)}", exc_info=True)
-            # 如果合并失败，返回第一段音频
-            return audio_chunks[0]
+# text_processor.py - 文本分段与音频合并工具
+import re
+import io
+import logging
+import mp3_frames
+from utils.metrics import time_stage
+logger = logging.getLogger('TextProcessor')
+
+
+class AudioMergeError(Exception):
+    """分段音频无法合并；不能退化为只返回部分分段，否则长文本会被静默截断"""
+
+
+class TextProcessor:
+    def __init__(self, max_chunk_length=200):
+        """
+        :param max_chunk_length: 单段文本最大长度（根据TTS API能力调整）
+        """
+        self.max_chunk_length = max_chunk_length
+    
+    def split_text(self, text):
+        """智能分段：按标点符号拆分，避免句子被截断"""
+        # 按中英文句末标点和换行分段，标点保留在所属句子末尾；英文句号须后跟空白，避免拆开小数和网址
+        parts = re.split(r'([。！？；!?;\n]\s*|\.\s+)', text)
+        sentences = [''.join(parts[i:i + 2]) for i in range(0, len(parts), 2)]
+        merged = []
+        current_chunk = ""
+        
+        for sentence in sentences:
+            for piece in self._split_long_sentence(sentence):
+                if len(current_chunk) + len(piece) <= self.max_chunk_length:
+                    current_chunk += piece
+                else:
+                    if current_chunk.strip():
+                        merged.append(current_chunk.strip())
+                    current_chunk = piece
+        
+        if current_chunk.strip():
+            merged.append(current_chunk.strip())
+        
+        logger.info(f"文本分段完成：原始长度{len(text)}字符，分为{len(merged)}段")
+        return merged
+    
+    def _split_long_sentence(self, sentence):
+        """超长句子先按逗号等次级标点拆分，仍然超长则按长度硬切（优先在空白处切，不切断英文单词），保证不丢字"""
+        if len(sentence) <= self.max_chunk_length:
+            return [sentence]
+        parts = re.split(r'([，,、：:]\s*)', sentence)
+        pieces = []
+        for clause in (''.join(parts[i:i + 2]) for i in range(0, len(parts), 2)):
+            while len(clause) > self.max_chunk_length:
+                # 在窗口内最后一个空白之后切开，空白留在前一段末尾；没有空白（如中文）时按长度切
+                match = re.search(r'\s\S*$', clause[:self.max_chunk_length])
+                cut = match.start() + 1 if match and match.start() > 0 else self.max_chunk_length
+                pieces.append(clause[:cut])
+                clause = clause[cut:]
+            pieces.append(clause)
+        return pieces
+    
+    def merge_audio(self, audio_chunks):
+        """合并多个音频片段为一个完整MP3"""
+        with time_stage('merge'):
+            return self._merge_audio(audio_chunks)
+    
+    def _merge_audio(self, audio_chunks):
+        if not audio_chunks:
+            raise ValueError("音频片段列表为空")
+        
+        if len(audio_chunks) == 1:
+            return audio_chunks[0]  # 只有一段，直接返回
+        
+        # 各段来自同一上游编码器，优先按帧直接拼接，无需解码和重新编码
+        try:
+            result = mp3_frames.concat(audio_chunks)
+            logger.info(f"音频帧级拼接完成，{len(audio_chunks)}段，总大小: {len(result)}字节")
+            return result
+        except mp3_frames.Mp3FormatError as e:
+            logger.warning(f"帧级拼接不可用，回退到解码合并: {str(e)}")
+        
+        try:
+            # pydub 依赖 ffmpeg 且导入较重，仅在需要合并时加载（可选依赖，未列入 requirements.txt）
+            from pydub import AudioSegment
+        except ImportError:
+            raise AudioMergeError(f"分段音频格式不一致，无法按帧拼接，且未安装 pydub，无法解码合并（共{len(audio_chunks)}段）")
+        try:
+            combined = AudioSegment.empty()
+            for i, chunk in enumerate(audio_chunks):
+                logger.info(f"合并第{i+1}/{len(audio_chunks)}段音频，大小: {len(chunk)}字节")
+                # 将二进制音频数据转换为AudioSegment对象
+                audio = AudioSegment.from_mp3(io.BytesIO(chunk))
+                combined += audio
+            
+            # 导出合并后的音频为二进制数据
+            output = io.BytesIO()
+            combined.export(output, format="mp3")
+            result = output.getvalue()
+            logger.info(f"音频合并完成，总大小: {len(result)}字节")
+            return result
+        except Exception as e:
+            logger.error(f"音频合并失败: {str(e)}", exc_info=True)
+            raise AudioMergeError(f"音频合并失败: {str(e)}") from e
@@ -0,0 +1,292 @@
+# upstream_client.py - 线程安全的 HTTP 长连接池（用于访问 bot.n.cn）
+import http.client
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+from utils import metrics
+
+logger = logging.getLogger('UpstreamPool')
+
+# 复用空闲连接时可能遇到服务端已关闭的情况，这些异常允许在新连接上重试一次
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+
+def classify_error(exc):
+    """把连接层异常归类为指标中的错误类型"""
+    if isinstance(exc, (TimeoutError, socket.timeout)):
+        return 'timeout'
+    if isinstance(exc, ssl.SSLError):
+        return 'tls'
+    if isinstance(exc, ConnectionRefusedError):
+        return 'connection_refused'
+    if isinstance(exc, (ConnectionError, http.client.RemoteDisconnected)):
+        return 'connection_reset'
+    if isinstance(exc, http.client.HTTPException):
+        return 'protocol'
+    if isinstance(exc, OSError):
+        return 'network'
+    return 'unknown'
+
+
+def status_error_type(status):
+    return 'http_5xx' if status >= 500 else 'http_4xx'
+
+
+class RequestHandle:
+    """跨线程观察和控制一次上游请求：记录首字节耗时，并可从其他线程中止（关闭底层 socket）"""
+
+    def __init__(self):
+        self.first_byte = threading.Event()
+        self.ttfb = None
+        self.cancelled = False
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def attach(self, conn):
+        with self._lock:
+            self._conn = conn
+            if self.cancelled:
+                self._abort(conn)
+
+    def detach(self):
+        """
+        解除与连接的关联，连接归还连接池前必须调用，之后的 cancel() 不会再影响该连接
+        :return: 请求未被中止、连接可以复用时返回 True
+        """
+        with self._lock:
+            self._conn = None
+            return not self.cancelled
+
+    def mark_first_byte(self, ttfb):
+        self.ttfb = ttfb
+        self.first_byte.set()
+
+    def cancel(self):
+        # 在锁内中止：detach() 返回后连接可能已被其他请求取用，不能再关闭它的 socket
+        with self._lock:
+            self.cancelled = True
+            if self._conn is not None:
+                self._abort(self._conn)
+
+    @staticmethod
+    def _abort(conn):
+        # shutdown 会让另一个线程中阻塞的 recv 立即返回，请求随之失败并丢弃连接
+        sock = conn.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class UpstreamResponse:
+    """上游响应：读取完毕并关闭后，连接自动归还连接池"""
+
+    def __init__(self, pool, pool_key, conn, response, endpoint=None, started=None, handle=None):
+        self._pool = pool
+        self._handle = handle
+        self._endpoint = endpoint
+        self._started = started
+        self._pool_key = pool_key
+        self._conn = conn
+        self._response = response
+        self._closed = False
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def iter_chunks(self, chunk_size=16 * 1024):
+        """按块读取响应体，适用于流式转发"""
+        while True:
+            chunk = self._response.read1(chunk_size) if hasattr(self._response, 'read1') else self._response.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        # read1 在 Content-Length 读满时不会标记响应结束，补一次 read() 以便连接可被复用
+        self._response.read()
+
+    def close(self, reusable=True):
+        """关闭响应；只有在响应体已读完且服务端允许保持连接时才归还连接"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._started is not None:
+            metrics.observe_upstream(self._endpoint, 'total', time.perf_counter() - self._started)
+        if self._handle is not None and not self._handle.detach():
+            # 已被中止的连接 socket 已 shutdown，不能归还
+            reusable = False
+        if reusable and self._response.isclosed() and not self._response.will_close:
+            self._pool._release(self._pool_key, self._conn)
+        else:
+            self._response.close()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(reusable=exc_type is None)
+
+
+class UpstreamPool:
+    def __init__(self, max_idle_per_host=16, connect_timeout=5.0, read_timeout=30.0, idle_timeout=55.0):
+        """
+        :param max_idle_per_host: 每个主机保留的空闲长连接上限
+        :param connect_timeout: 建立 TCP/TLS 连接的超时（秒）
+        :param read_timeout: 等待响应和读取数据的超时（秒）
+        :param idle_timeout: 空闲连接超过该时长后丢弃，避免复用已被服务端关闭的连接
+        """
+        self.max_idle_per_host = max_idle_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_idle_per_host=int(os.getenv('UPSTREAM_POOL_SIZE', 16)),
+            connect_timeout=float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 5)),
+            read_timeout=float(os.getenv('UPSTREAM_READ_TIMEOUT', 30)),
+            idle_timeout=float(os.getenv('UPSTREAM_IDLE_TIMEOUT', 55)),
+        )
+
+    @staticmethod
+    def _split_url(url):
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        return (scheme, parts.hostname, port), path
+
+    def _new_connection(self, pool_key, endpoint):
+        """:param endpoint: 触发建连的请求路径，与 ttfb/total 使用同一指标标签"""
+        scheme, host, port = pool_key
+        started = time.perf_counter()
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        # 连接建立后切换为读超时
+        conn.sock.settimeout(self.read_timeout)
+        metrics.observe_upstream(endpoint, 'connect', time.perf_counter() - started)
+        with self._lock:
+            self.connections_created += 1
+        return conn
+
+    def _acquire(self, pool_key, endpoint):
+        """优先取最近归还的空闲连接（LIFO），取不到则新建"""
+        now = time.monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get(pool_key)
+            while idle:
+                candidate, released_at = idle.pop()
+                if now - released_at < self.idle_timeout:
+                    conn = candidate
+                    self.connections_reused += 1
+                    break
+                stale.append(candidate)
+        for c in stale:
+            c.close()
+        if conn is not None:
+            return conn, True
+        return self._new_connection(pool_key, endpoint), False
+
+    def _release(self, pool_key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(pool_key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, handle=None):
+        """
+        发送请求并返回已收到响应头的 UpstreamResponse，调用方负责 close()
+        :param handle: 可选的 RequestHandle，用于记录首字节耗时或从其他线程中止请求
+        """
+        pool_key, path = self._split_url(url)
+        endpoint = path.split('?', 1)[0]
+        headers = dict(headers or {})
+        headers.setdefault('Connection', 'keep-alive')
+        started = time.perf_counter()
+        while True:
+            conn, reused = self._acquire(pool_key, endpoint)
+            if handle is not None:
+                handle.attach(conn)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                # 收到响应头即视为首字节
+                ttfb = time.perf_counter() - started
+                metrics.observe_upstream(endpoint, 'ttfb', ttfb)
+                if handle is not None:
+                    handle.mark_first_byte(ttfb)
+                return UpstreamResponse(self, pool_key, conn, response, endpoint=endpoint, started=started,
+                                        handle=handle)
+            except _STALE_CONNECTION_ERRORS:
+                conn.close()
+                if not reused or (handle is not None and handle.cancelled):
+                    raise
+                # 复用的连接已失效，换新连接重试
+                logger.debug(f"复用连接已失效，重新建立连接: {pool_key[1]}")
+            except BaseException:
+                conn.close()
+                raise
+
+    def fetch(self, method, url, body=None, headers=None, handle=None):
+        """发送请求并读取完整响应体，返回 (status, reason, headers, body)"""
+        with self.request(method, url, body=body, headers=headers, handle=handle) as response:
+            data = response.read()
+            return response.status, response.reason, response.headers, data
+
+    def warm(self, url, count=1):
+        """预先建立连接放入连接池，消除首个请求的握手延迟"""
+        pool_key, path = self._split_url(url)
+        endpoint = path.split('?', 1)[0]
+        warmed = 0
+        for _ in range(min(count, self.max_idle_per_host)):
+            try:
+                self._release(pool_key, self._new_connection(pool_key, endpoint))
+                warmed += 1
+            except OSError as e:
+                logger.warning(f"预热上游连接失败: {str(e)}")
+                break
+        return warmed
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "idle": sum(len(v) for v in self._idle.values()),
+                "created": self.connections_created,
+                "reused": self.connections_reused,
+            }
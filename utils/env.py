@@ -0,0 +1,12 @@
+# utils/env.py - .env 加载（每个进程只读取一次）
+_loaded = False
+
+
+def load_env():
+    """加载 .env 到环境变量；重复调用无副作用，各入口与模块统一调用这里"""
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    from dotenv import load_dotenv
+    load_dotenv()
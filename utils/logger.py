@@ -3,9 +3,10 @@ import logging
 import logging.handlers
 import os
 import sys
+import threading
 from datetime import datetime
-from dotenv import load_dotenv
-load_dotenv()
+from utils.env import load_env
+load_env()
 
 # 初始化日志器
 logger = logging.getLogger('nanoai_tts')
@@ -43,11 +44,11 @@ if not is_readonly_env:
         logger.warning(f"无法创建日志目录: {e}，只使用控制台日志输出")
 
 # Sentry错误监控（可选）
-if os.getenv('SENTRY_DSN'):
+def _init_sentry(dsn):
     try:
         import sentry_sdk
         sentry_sdk.init(
-            dsn=os.getenv('SENTRY_DSN'),
+            dsn=dsn,
             traces_sample_rate=1.0,
             environment=os.getenv('ENVIRONMENT', 'development')
         )
@@ -55,6 +56,20 @@ if os.getenv('SENTRY_DSN'):
     except Exception as e:
         logger.warning(f"Sentry 初始化失败: {e}")
 
+
+def init_sentry():
+    """
+    初始化 Sentry（仅在设置 SENTRY_DSN 时）
+    sentry_sdk 导入较慢，默认在后台线程中完成，不计入启动耗时；SENTRY_DEFERRED=false 时同步初始化
+    """
+    dsn = os.getenv('SENTRY_DSN')
+    if not dsn:
+        return
+    if os.getenv('SENTRY_DEFERRED', 'true').lower() == 'true':
+        threading.Thread(target=_init_sentry, args=(dsn,), name='sentry-init', daemon=True).start()
+    else:
+        _init_sentry(dsn)
+
 # 导出日志器
 def get_logger():
     return logger
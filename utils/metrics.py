@@ -0,0 +1,132 @@
+# utils/metrics.py - Prometheus 指标（prometheus_client 可选，未安装时所有操作为空操作）
+import contextlib
+import os
+import time
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram
+    PROMETHEUS_AVAILABLE = True
+except ImportError:  # pragma: no cover - 未安装 prometheus_client
+    PROMETHEUS_AVAILABLE = False
+
+# 多进程模式（gunicorn 多 worker）由 PROMETHEUS_MULTIPROC_DIR 启用，需在导入 prometheus_client 前设置
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+# 覆盖从亚毫秒（签名、鉴权）到数十秒（上游长尾）的延迟
+_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+if PROMETHEUS_AVAILABLE:
+    STAGE_SECONDS = Histogram(
+        'nanoai_stage_seconds', '各处理阶段耗时（auth/get_models/sign_headers/merge/response_write）',
+        ['stage'], buckets=_LATENCY_BUCKETS
+    )
+    UPSTREAM_SECONDS = Histogram(
+        'nanoai_upstream_seconds', '上游请求各阶段耗时（connect/ttfb/total）',
+        ['endpoint', 'phase'], buckets=_LATENCY_BUCKETS
+    )
+    UPSTREAM_ERRORS = Counter(
+        'nanoai_upstream_errors_total', '上游请求错误数（按类型）', ['endpoint', 'type']
+    )
+    HTTP_REQUESTS = Counter(
+        'nanoai_http_requests_total', 'HTTP 请求数', ['endpoint', 'status']
+    )
+    HTTP_SECONDS = Histogram(
+        'nanoai_http_request_seconds', 'HTTP 请求处理耗时（不含响应体传输）',
+        ['endpoint'], buckets=_LATENCY_BUCKETS
+    )
+    IN_FLIGHT = Gauge(
+        'nanoai_requests_in_flight', '正在处理的请求数', ['endpoint'], multiprocess_mode='livesum'
+    )
+    BYTES_SERVED = Counter(
+        'nanoai_bytes_served_total', '响应体字节数', ['endpoint']
+    )
+    AUDIO_CACHE_EVENTS = Counter(
+        'nanoai_audio_cache_events_total', '音频缓存事件（hit/miss/eviction）', ['event']
+    )
+    COALESCED = Counter(
+        'nanoai_singleflight_total', '请求合并：leader 为实际上游调用，collapsed 为被合并的调用', ['role']
+    )
+    HEDGED = Counter(
+        'nanoai_hedged_requests_total', '对冲请求（fired 已发出/won 对冲先完成/budget_exhausted 预算不足未发出/no_capacity 无空闲准入名额未发出）', ['outcome']
+    )
+    UPSTREAM_RETRIES = Counter(
+        'nanoai_upstream_retries_total', '上游重试（retried 已重试/budget_exhausted 预算不足/deadline 超过总时限）', ['endpoint', 'outcome']
+    )
+    CIRCUIT_STATE = Gauge(
+        'nanoai_circuit_state', '上游熔断器状态（0 closed/1 half_open/2 open）', ['endpoint'], multiprocess_mode='livemax'
+    )
+    CIRCUIT_REJECTED = Counter(
+        'nanoai_circuit_rejected_total', '熔断期间直接拒绝的上游请求数', ['endpoint']
+    )
+    ADMISSION_LIMIT = Gauge(
+        'nanoai_admission_limit', '上游调用的自适应并发上限（各 worker 之和）', multiprocess_mode='livesum'
+    )
+    ADMISSION_REJECTED = Counter(
+        'nanoai_admission_rejected_total', '准入控制拒绝的请求（queue_full/deadline）', ['reason']
+    )
+    ADMISSION_QUEUE_SECONDS = Histogram(
+        'nanoai_admission_queue_seconds', '获得上游调用名额前的排队时长（按请求类别）', ['priority'], buckets=_LATENCY_BUCKETS
+    )
+else:
+    STAGE_SECONDS = UPSTREAM_SECONDS = UPSTREAM_ERRORS = HTTP_REQUESTS = HTTP_SECONDS = _NoopMetric()
+    IN_FLIGHT = BYTES_SERVED = AUDIO_CACHE_EVENTS = COALESCED = HEDGED = _NoopMetric()
+    UPSTREAM_RETRIES = CIRCUIT_STATE = CIRCUIT_REJECTED = ADMISSION_LIMIT = ADMISSION_REJECTED = _NoopMetric()
+    ADMISSION_QUEUE_SECONDS = _NoopMetric()
+
+
+@contextlib.contextmanager
+def time_stage(stage):
+    """记录代码块耗时到 nanoai_stage_seconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_upstream(endpoint, phase, seconds):
+    UPSTREAM_SECONDS.labels(endpoint, phase).observe(seconds)
+
+
+def upstream_error(endpoint, error_type):
+    UPSTREAM_ERRORS.labels(endpoint, error_type).inc()
+
+
+def process_rss_bytes():
+    """当前进程常驻内存（RSS），无法获取时返回 None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        import sys
+        # ru_maxrss 为峰值：Linux 单位 KB，macOS 单位字节
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except (ImportError, OSError):
+        return None
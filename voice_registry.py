@@ -0,0 +1,131 @@
+# voice_registry.py - 不可变的声音列表快照
+import gzip
+import hashlib
+import json
+import os
+import time
+from types import MappingProxyType
+
+# 声音清单文件格式版本，格式不兼容时递增
+MANIFEST_FORMAT = 1
+
+
+class ManifestError(ValueError):
+    pass
+
+
+class VoiceRegistry:
+    """
+    声音列表的只读快照：构建完成后不再修改，刷新时整体替换引用
+    读取方无需加锁，也不会看到清空或半填充的中间状态
+    """
+
+    __slots__ = ('version', 'voices', 'names', 'updated_at', 'fallback', 'models_payload', 'models_payload_gzip', 'etag')
+
+    def __init__(self, voices, version=0, updated_at=None, fallback=False):
+        """
+        :param voices: tag -> {'name': ..., 'iconUrl': ...}
+        :param version: 快照版本号，每次内容变化递增
+        :param updated_at: 最近一次确认列表有效的时间戳
+        :param fallback: 是否为加载失败后的默认列表
+        """
+        self.voices = MappingProxyType({tag: MappingProxyType(dict(info)) for tag, info in voices.items()})
+        self.names = MappingProxyType({tag: info['name'] for tag, info in voices.items()})
+        self.version = version
+        self.updated_at = time.time() if updated_at is None else updated_at
+        self.fallback = fallback
+        # 只由声音内容决定（不含各 worker 各自的加载时间），同一列表在所有 worker 上 ETag 相同
+        self.etag = hashlib.sha256(
+            json.dumps(dict(self.names), ensure_ascii=False, sort_keys=True).encode('utf-8')
+        ).hexdigest()[:32]
+        # /v1/models 响应体预先序列化，列出模型时直接返回
+        self.models_payload = json.dumps({
+            "object": "list",
+            "data": [
+                {
+                    "id": tag,
+                    "object": "model",
+                    "created": int(self.updated_at),
+                    "owned_by": "nanoai",
+                    "description": name
+                }
+                for tag, name in self.names.items()
+            ]
+        }, ensure_ascii=False).encode('utf-8')
+        self.models_payload_gzip = gzip.compress(self.models_payload, compresslevel=6, mtime=0)
+
+    @classmethod
+    def from_platform_data(cls, data, version=0, updated_at=None):
+        """由上游 /api/robot/platform 的响应构建快照"""
+        if 'data' not in data or 'list' not in data['data']:
+            raise ValueError("API返回的数据格式不正确")
+        voices = {
+            item['tag']: {'name': item['title'], 'iconUrl': item['icon']}
+            for item in data['data']['list']
+        }
+        return cls(voices, version=version, updated_at=updated_at)
+
+    @classmethod
+    def default(cls, version=0):
+        return cls({'DeepSeek': {'name': 'DeepSeek (默认)', 'iconUrl': ''}}, version=version, fallback=True)
+
+    def touched(self, updated_at=None):
+        """内容未变（上游 304）时刷新有效时间，版本号不变"""
+        return VoiceRegistry(self.voices, version=self.version, updated_at=updated_at, fallback=self.fallback)
+
+    def __contains__(self, tag):
+        return tag in self.voices
+
+    def __len__(self):
+        return len(self.voices)
+
+    def get(self, tag, default=None):
+        return self.voices.get(tag, default)
+
+
+def _voices_checksum(voices):
+    return hashlib.sha256(
+        json.dumps(voices, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    ).hexdigest()
+
+
+def dump_manifest(registry, source=None, etag=None, last_modified=None):
+    """
+    序列化为紧凑的声音清单（构建时写入部署产物）
+    :return: UTF-8 编码的 JSON 字节
+    """
+    voices = {tag: [info['name'], info.get('iconUrl', '')] for tag, info in registry.voices.items()}
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'generated_at': int(registry.updated_at),
+        'source': source,
+        'etag': etag,
+        'last_modified': last_modified,
+        'sha256': _voices_checksum(voices),
+        'voices': voices,
+    }
+    return json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def load_manifest(path, version=0):
+    """
+    读取并校验声音清单
+    :return: (VoiceRegistry, 清单元数据 dict)
+    :raises ManifestError: 文件格式版本不符、校验和不一致或内容为空
+    """
+    with open(path, 'rb') as f:
+        manifest = json.loads(f.read().decode('utf-8'))
+    if manifest.get('format') != MANIFEST_FORMAT:
+        raise ManifestError(f"不支持的清单格式版本: {manifest.get('format')}")
+    voices = manifest.get('voices') or {}
+    if not voices:
+        raise ManifestError("清单中没有声音")
+    if manifest.get('sha256') != _voices_checksum(voices):
+        raise ManifestError("清单校验和不一致")
+    registry = VoiceRegistry(
+        {tag: {'name': name, 'iconUrl': icon} for tag, (name, icon) in voices.items()},
+        version=version,
+        updated_at=manifest.get('generated_at') or os.path.getmtime(path),
+    )
+    meta = {key: manifest.get(key) for key in ('generated_at', 'source', 'etag', 'last_modified')}
+    return registry, meta